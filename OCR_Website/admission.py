@@ -0,0 +1,204 @@
+"""
+Admission control for OCR jobs.
+
+Each upload gets a cost estimate (disk, peak memory and CPU time) built from
+its page counts, sizes and embedded image resolution. The estimate is checked
+against free disk, available memory and the backlog of jobs already admitted,
+and the job is accepted, deferred with a retry time, or rejected outright.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+import logging
+
+import PyPDF2
+
+from resources import available_memory_mb
+
+logger = logging.getLogger(__name__)
+
+# Input copy, optimized copy, OCR output, cache entry and ZIP entry
+DISK_COPIES_PER_FILE = 5
+# Fixed memory footprint of one ocrmypdf worker before any page is rasterized
+WORKER_BASE_MEMORY_MB = 150
+# Working copies of a page raster held at once (decode, deskew, OCR input)
+RASTER_COPIES = 3
+# Measured-ish OCR throughput for a 300 DPI letter page on one core
+SECONDS_PER_PAGE_AT_300_DPI = 2.0
+SECONDS_PER_TEXT_PAGE = 0.05
+DEFAULT_DPI = 300
+# US letter, used when a PDF's page size can't be read
+DEFAULT_PAGE_SIZE_IN = (8.5, 11.0)
+
+
+def estimate_image_dpi(pdf_path, sample_pages=3):
+    """Estimate the highest image resolution on the first few pages of a PDF (0 if none)"""
+    max_dpi = 0
+    try:
+        with open(pdf_path, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            for page in reader.pages[:sample_pages]:
+                page_width_in = float(page.mediabox.width) / 72.0
+                resources = page.get('/Resources')
+                if not resources or page_width_in <= 0:
+                    continue
+                xobjects = resources.get_object().get('/XObject')
+                if not xobjects:
+                    continue
+                for xobject in xobjects.get_object().values():
+                    xobject = xobject.get_object()
+                    if xobject.get('/Subtype') == '/Image':
+                        max_dpi = max(max_dpi, int(xobject.get('/Width', 0)) / page_width_in)
+    except Exception as e:
+        logger.warning(f"Could not estimate image DPI for {os.path.basename(pdf_path)}: {str(e)}")
+        return DEFAULT_DPI
+    return int(max_dpi)
+
+
+def largest_page_inches(pdf_path, sample_pages=3):
+    """Return the (width, height) in inches of the largest of the first few pages of a PDF"""
+    largest = None
+    try:
+        with open(pdf_path, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            for page in reader.pages[:sample_pages]:
+                size = (float(page.mediabox.width) / 72.0, float(page.mediabox.height) / 72.0)
+                if largest is None or size[0] * size[1] > largest[0] * largest[1]:
+                    largest = size
+    except Exception as e:
+        logger.warning(f"Could not read page size of {os.path.basename(pdf_path)}: {str(e)}")
+    return (round(largest[0], 2), round(largest[1], 2)) if largest else DEFAULT_PAGE_SIZE_IN
+
+
+def estimate_task_memory_mb(info):
+    """
+    Estimate the peak memory of one OCR worker processing a file.
+
+    `info` is a dict with 'dpi' and optionally 'page_size_in'. OCR runs with
+    max_image_mpixels=0, so the raster grows with page area times DPI squared.
+    """
+    dpi = info.get('dpi', DEFAULT_DPI)
+    if not dpi:
+        # Born-digital pages are skipped, not rasterized
+        return WORKER_BASE_MEMORY_MB
+    width_in, height_in = info.get('page_size_in') or DEFAULT_PAGE_SIZE_IN
+    # 4 bytes per pixel
+    raster_mb = (width_in * dpi) * (height_in * dpi) * 4 / (1024 * 1024)
+    return round(WORKER_BASE_MEMORY_MB + raster_mb * RASTER_COPIES, 1)
+
+
+def estimate_job_cost(files, workers=4):
+    """
+    Estimate the resources a job will need.
+
+    `files` is a list of dicts with 'page_count', 'size_mb' and 'dpi' keys.
+    """
+    disk_mb = 0
+    cpu_seconds = 0
+    peak_task_memory_mb = WORKER_BASE_MEMORY_MB
+
+    for info in files:
+        pages = max(info.get('page_count', 0), 1)
+        dpi = info.get('dpi', DEFAULT_DPI)
+        disk_mb += info.get('size_mb', 0) * DISK_COPIES_PER_FILE
+
+        if dpi:
+            scale = (dpi / 300.0) ** 2
+            cpu_seconds += pages * SECONDS_PER_PAGE_AT_300_DPI * scale
+            peak_task_memory_mb = max(peak_task_memory_mb, estimate_task_memory_mb(info))
+        else:
+            cpu_seconds += pages * SECONDS_PER_TEXT_PAGE
+
+    concurrent = max(1, min(workers, len(files)))
+    return {
+        'disk_mb': round(disk_mb, 1),
+        'memory_mb': round(concurrent * peak_task_memory_mb, 1),
+        'cpu_seconds': round(cpu_seconds, 1),
+        'wall_seconds': round(cpu_seconds / concurrent, 1)
+    }
+
+
+def free_disk_mb(paths):
+    """Return the smallest free space in MB across the filesystems holding `paths`"""
+    free = []
+    for path in paths:
+        if os.path.exists(path):
+            free.append(shutil.disk_usage(path).free / (1024 * 1024))
+    return min(free) if free else None
+
+
+class AdmissionController:
+    """Track admitted jobs and decide whether new ones fit"""
+
+    def __init__(self, workers=4, disk_reserve_mb=1024, memory_reserve_mb=512,
+                 max_backlog_seconds=3600, paths=None):
+        self.workers = workers
+        self.disk_reserve_mb = disk_reserve_mb
+        self.memory_reserve_mb = memory_reserve_mb
+        self.max_backlog_seconds = max_backlog_seconds
+        self.paths = paths or [tempfile.gettempdir()]
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def backlog(self):
+        """Return the estimated wall-clock seconds of work already admitted"""
+        with self._lock:
+            return sum(cost['cpu_seconds'] for cost in self._jobs.values()) / self.workers
+
+    def check_upload_size(self, content_length):
+        """Cheap pre-check before an upload is written to disk"""
+        free = free_disk_mb(self.paths)
+        if content_length and free is not None:
+            needed_mb = content_length / (1024 * 1024) * DISK_COPIES_PER_FILE
+            if needed_mb > free - self.disk_reserve_mb:
+                return {
+                    'decision': 'reject',
+                    'reason': f'Not enough disk space for this upload ({needed_mb:.0f}MB needed, {free:.0f}MB free)'
+                }
+        return {'decision': 'accept'}
+
+    def try_admit(self, job_id, cost):
+        """Decide whether a job fits and, if it does, reserve its resources in the same step"""
+        free_disk = free_disk_mb(self.paths)
+        free_memory = available_memory_mb()
+
+        with self._lock:
+            decision = self._evaluate(cost, free_disk, free_memory)
+            if decision['decision'] == 'accept':
+                self._jobs[job_id] = cost
+            return decision
+
+    def _evaluate(self, cost, free_disk, free_memory):
+        reserved_disk = sum(c['disk_mb'] for c in self._jobs.values())
+        reserved_memory = sum(c['memory_mb'] for c in self._jobs.values())
+        backlog = sum(c['cpu_seconds'] for c in self._jobs.values()) / self.workers
+
+        # Jobs that could never fit, even on an idle machine
+        if free_disk is not None and cost['disk_mb'] > free_disk + reserved_disk - self.disk_reserve_mb:
+            return {
+                'decision': 'reject',
+                'reason': f"Job needs about {cost['disk_mb']:.0f}MB of disk but only {free_disk:.0f}MB is free"
+            }
+        if free_memory is not None and cost['memory_mb'] > free_memory + reserved_memory - self.memory_reserve_mb:
+            return {
+                'decision': 'reject',
+                'reason': f"Job needs about {cost['memory_mb']:.0f}MB of memory, more than this server has available"
+            }
+
+        # Jobs that will fit once the current backlog drains
+        retry_after = int(backlog) + 1
+        if free_disk is not None and cost['disk_mb'] > free_disk - reserved_disk - self.disk_reserve_mb:
+            return {'decision': 'defer', 'reason': 'Disk space is reserved by jobs in progress', 'retry_after': retry_after}
+        if free_memory is not None and cost['memory_mb'] > free_memory - self.memory_reserve_mb and self._jobs:
+            return {'decision': 'defer', 'reason': 'Memory is in use by jobs in progress', 'retry_after': retry_after}
+        if backlog + cost['wall_seconds'] > self.max_backlog_seconds and self._jobs:
+            return {'decision': 'defer', 'reason': 'The processing queue is full', 'retry_after': retry_after}
+
+        return {'decision': 'accept', 'eta_seconds': int(backlog + cost['wall_seconds'])}
+
+    def release(self, job_id):
+        """Return a finished job's reservation"""
+        with self._lock:
+            self._jobs.pop(job_id, None)
@@ -0,0 +1,533 @@
+"""
+Versioned JSON API for integrations, under /api/v1.
+
+Requests authenticate with an API token (`Authorization: Bearer <token>`).
+Tokens are created from a logged-in browser session, shown once, and only
+their SHA-256 hash is stored. A job is submitted either as a multipart upload
+or as a list of paths on the server (under API_IMPORT_ROOTS), which are
+reflinked or copied into the job rather than uploaded. An `Idempotency-Key`
+header makes a retried submission return the original job instead of
+starting another, and a `webhook_url` is POSTed each file's outcome as it
+finishes and the job's results at the end (retried; see webhooks.py), so
+clients don't have to poll.
+Webhooks are signed with the submitting token's own signing secret, which is
+returned alongside the token when it is created and never shown again.
+
+    POST   /api/v1/tokens                     create a token (session login)
+    GET    /api/v1/tokens                     list tokens (session login)
+    DELETE /api/v1/tokens/<id>                revoke a token (session login)
+    POST   /api/v1/jobs                       submit a job
+    GET    /api/v1/jobs                       list jobs (?status=, ?limit=, ?offset=)
+    GET    /api/v1/jobs/<id>                  job status and results
+    GET    /api/v1/jobs/<id>/files            per-file results
+    GET    /api/v1/jobs/<id>/files/<name>     one output PDF
+    GET    /api/v1/jobs/<id>/download         all outputs as a ZIP
+    GET    /api/v1/jobs/<id>/webhooks         webhook delivery log
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+import secrets
+import zipfile
+from datetime import datetime, timezone
+from functools import wraps
+from types import SimpleNamespace
+
+from flask import Blueprint, Response, current_app, g, jsonify, request, send_file
+from flask_login import current_user, login_required
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from archives import unique_name
+from log_store import set_current_job
+from scratch import ScratchQuotaExceeded, link_or_copy
+from webhooks import UnsafeWebhookURL, resolve_url
+
+logger = logging.getLogger(__name__)
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+TOKEN_PREFIX = 'ocr_'
+# Don't write to the database on every request just to record that a token is in use
+TOKEN_TOUCH_SECONDS = 60
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+STREAM_CHUNK_SIZE = 1024 * 1024
+
+
+def init_api(app, **backend):
+    """Register the API with the app, along with the models and job entry points it calls into"""
+    app.config.setdefault('API_IMPORT_ROOTS', [
+        os.path.realpath(root) for root in os.environ.get('API_IMPORT_ROOTS', '').split(',') if root.strip()
+    ])
+    app.extensions['ocr_api'] = SimpleNamespace(**backend)
+    app.register_blueprint(api)
+
+
+def backend():
+    return current_app.extensions['ocr_api']
+
+
+@api.before_app_request
+def start_webhooks():
+    # Resumes deliveries left in the queue by a restart, without waiting for a new job to finish
+    backend().webhooks.start()
+
+
+def hash_token(token):
+    """Tokens are long and random, so an unsalted SHA-256 is enough to make a leaked table useless"""
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+def error(message, http_status, **extra):
+    return jsonify(dict(extra, error=message)), http_status
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def token_required(view):
+    """Authenticate the request by its bearer token and make the token's user `g.api_user`"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        ocr = backend()
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not token.strip():
+            response, status = error('Missing bearer token', 401)
+            response.headers['WWW-Authenticate'] = 'Bearer'
+            return response, status
+
+        record = ocr.ApiToken.query.filter_by(token_hash=hash_token(token.strip()), revoked_at=None).first()
+        user = ocr.db.session.get(ocr.User, record.user_id) if record is not None else None
+        if user is None or not user.is_active:
+            response, status = error('Invalid or revoked token', 401)
+            response.headers['WWW-Authenticate'] = 'Bearer error="invalid_token"'
+            return response, status
+
+        now = utcnow()
+        if record.last_used_at is None or (now - record.last_used_at).total_seconds() > TOKEN_TOUCH_SECONDS:
+            record.last_used_at = now
+            ocr.db.session.commit()
+        g.api_user = user
+        g.api_token = record
+        return view(*args, **kwargs)
+    return wrapper
+
+
+def token_summary(record):
+    return {
+        'id': record.id,
+        'name': record.name,
+        'prefix': record.prefix,
+        'created_at': record.created_at.isoformat() if record.created_at else None,
+        'last_used_at': record.last_used_at.isoformat() if record.last_used_at else None,
+        'revoked': record.revoked_at is not None
+    }
+
+
+@api.route('/tokens', methods=['POST'])
+@login_required
+def create_token():
+    """Create an API token for the logged-in user; the token and its webhook secret are only returned here"""
+    ocr = backend()
+    name = ((request.get_json(silent=True) or {}).get('name') or request.form.get('name') or 'API token')[:100]
+    token = TOKEN_PREFIX + secrets.token_urlsafe(32)
+    signing_secret = secrets.token_hex(32)
+    record = ocr.ApiToken(user_id=int(current_user.get_id()), name=name, token_hash=hash_token(token),
+                          prefix=token[:len(TOKEN_PREFIX) + 6], signing_secret=signing_secret)
+    ocr.db.session.add(record)
+    ocr.db.session.commit()
+    logger.info(f"Created API token {record.prefix}... for user {current_user.get_id()}")
+    return jsonify(dict(token_summary(record), token=token, webhook_secret=signing_secret)), 201
+
+
+@api.route('/tokens', methods=['GET'])
+@login_required
+def list_tokens():
+    ocr = backend()
+    records = ocr.ApiToken.query.filter_by(user_id=int(current_user.get_id())).order_by(ocr.ApiToken.id).all()
+    return jsonify({'tokens': [token_summary(record) for record in records]})
+
+
+@api.route('/tokens/<int:token_id>', methods=['DELETE'])
+@login_required
+def revoke_token(token_id):
+    ocr = backend()
+    record = ocr.ApiToken.query.filter_by(id=token_id, user_id=int(current_user.get_id())).first()
+    if record is None:
+        return error('Token not found', 404)
+    if record.revoked_at is None:
+        record.revoked_at = utcnow()
+        ocr.db.session.commit()
+    return jsonify(token_summary(record))
+
+
+def zip_path(job_id):
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], f'processed_files_{job_id}.zip')
+
+
+def job_summary(record):
+    """The API's view of a job: status, links and, once finished, its results"""
+    data = {
+        'id': record.id,
+        'status': record.status,
+        'output_mode': record.output_mode,
+        'webhook_url': record.webhook_url,
+        'created_at': record.created_at.isoformat() if record.created_at else None,
+        'completed_at': record.completed_at.isoformat() if record.completed_at else None,
+        'links': {
+            'self': f'{api.url_prefix}/jobs/{record.id}',
+            'files': f'{api.url_prefix}/jobs/{record.id}/files',
+            'download': f'{api.url_prefix}/jobs/{record.id}/download'
+        }
+    }
+    if record.results:
+        results = json.loads(record.results)
+        data.update({key: results.get(key) for key in ('stats', 'errors', 'total_pages', 'optimized_output')})
+        if results.get('error'):
+            data['error'] = results['error']
+    return data
+
+
+def file_results(record):
+    """Per-file outcome of a finished job, with a download link for each output"""
+    results = json.loads(record.results) if record.results else {}
+    sources = json.loads(record.sources) if record.sources else {}
+    files = []
+    for info in results.get('file_info') or []:
+        failed = bool(info.get('error')) or 'compute_units' not in info
+        # Converted images and archive members are traced back to what was submitted
+        origin = info.get('converted_from') or info['name']
+        files.append({
+            'name': info['name'],
+            'source': sources.get(origin, origin),
+            'archive': sources.get(info['archive'], info['archive']) if info.get('archive') else None,
+            'pages': info.get('page_count'),
+            'status': 'failed' if failed else 'prior_ocr' if info.get('prior_ocr') else
+            'cached' if info.get('from_cache') or info.get('deduplicated') else 'ok',
+            'error': info.get('error'),
+            'compute_units': info.get('compute_units'),
+            'download_url': None if 'compute_units' not in info else
+            f"{api.url_prefix}/jobs/{record.id}/files/{info['name']}"
+        })
+    return files
+
+
+def owned_job(job_id):
+    ocr = backend()
+    return ocr.ApiJob.query.filter_by(id=job_id, user_id=g.api_user.id).first()
+
+
+def file_status(result):
+    """The API's status for one file's pipeline result"""
+    if result.get('prior_ocr'):
+        return 'prior_ocr'
+    # A file OCR failed on is still passed through as-is, so success alone isn't enough
+    if not result.get('success') or result.get('error'):
+        return 'failed'
+    return 'cached' if result.get('from_cache') or result.get('deduplicated') else 'ok'
+
+
+def file_finished(app, job_id, token_id, webhook_url, sources):
+    """Per-file handler: queue a file.completed webhook as each file finishes"""
+    def on_file(result):
+        name = result['filename']
+        app.extensions['ocr_api'].webhooks.enqueue(job_id, token_id, webhook_url, 'file.completed', {
+            'job_id': job_id,
+            'file': {
+                'name': name,
+                'source': sources.get(name, name),
+                'status': file_status(result),
+                'error': None if result.get('prior_ocr') else result.get('error')
+            }
+        })
+    return on_file
+
+
+def job_finished(app, job_id):
+    """Completion handler: persist the job's results and queue its job.completed webhook"""
+    def on_complete(job):
+        with app.app_context():
+            ocr = backend()
+            record = ocr.db.session.get(ocr.ApiJob, job_id)
+            if record is None:
+                return
+            results = job.get('results') or {}
+            record.status = 'completed' if results.get('success') else \
+                'canceled' if job.get('cancel_requested') else 'failed'
+            record.results = json.dumps(results)
+            record.completed_at = utcnow()
+            ocr.db.session.commit()
+            if record.webhook_url:
+                ocr.webhooks.enqueue(job_id, record.token_id, record.webhook_url, 'job.completed', {
+                    'job': job_summary(record),
+                    'files': file_results(record)
+                })
+    return on_complete
+
+
+def import_root(path):
+    """Return the configured import root that contains `path`, or None"""
+    for root in current_app.config['API_IMPORT_ROOTS']:
+        if path == root or path.startswith(root.rstrip(os.sep) + os.sep):
+            return root
+    return None
+
+
+def resolve_paths(paths):
+    """Expand submitted server paths into (path, name) pairs, refusing anything outside the import roots"""
+    ocr = backend()
+    found = []
+    for submitted in paths:
+        if not isinstance(submitted, str) or not submitted:
+            raise ValueError('paths must be a list of strings')
+        # Resolve symlinks before checking the root, so a link can't point the job elsewhere
+        path = os.path.realpath(submitted)
+        root = import_root(path)
+        if root is None:
+            raise PermissionError(f"{submitted} is outside the allowed import directories")
+        if os.path.isdir(path):
+            for dirpath, dirnames, filenames in os.walk(path):
+                dirnames.sort()
+                for name in sorted(filenames):
+                    full = os.path.join(dirpath, name)
+                    # A symlink inside the root may still point outside it
+                    if ocr.accepted_upload(name) and import_root(os.path.realpath(full)) is not None:
+                        found.append((full, os.path.relpath(full, root)))
+        elif os.path.isfile(path):
+            if not ocr.accepted_upload(path):
+                raise ValueError(f"{submitted} is not a PDF, image or archive")
+            found.append((path, os.path.relpath(path, root)))
+        else:
+            raise FileNotFoundError(f"{submitted} does not exist")
+    return found
+
+
+def fingerprint(*parts):
+    """Hash of what a submission asked for, to catch an idempotency key reused for a different request"""
+    return hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+
+
+@api.route('/jobs', methods=['POST'])
+@token_required
+def submit_job():
+    """Start a job from uploaded files (multipart `files[]`) or server paths (JSON `paths`)"""
+    ocr = backend()
+    user = g.api_user
+    payload = request.get_json(silent=True) if request.is_json else None
+    options = payload if payload is not None else request.form
+    output_mode = options.get('output_mode') or current_app.config['DEFAULT_OUTPUT_MODE']
+    webhook_url = options.get('webhook_url') or None
+    if output_mode not in ocr.output_modes:
+        return error(f"Unknown output mode: {output_mode}", 400)
+    if webhook_url:
+        if not g.api_token.signing_secret:
+            return error('This token has no webhook signing secret; create a new token to use webhook_url', 400)
+        # Refuses loopback, private, link-local and reserved hosts; checked again on every delivery
+        try:
+            resolve_url(webhook_url, allow_private=ocr.webhooks.allow_private)
+        except UnsafeWebhookURL as e:
+            return error(str(e), 400)
+
+    if payload is not None:
+        paths = payload.get('paths')
+        if not isinstance(paths, list) or not paths:
+            return error('Provide a non-empty list of paths, or upload files[] as multipart form data', 400)
+        if not current_app.config['API_IMPORT_ROOTS']:
+            return error('Submitting server paths is not enabled on this server', 403)
+        try:
+            sources = resolve_paths(paths)
+        except PermissionError as e:
+            return error(str(e), 403)
+        except (ValueError, FileNotFoundError) as e:
+            return error(str(e), 400)
+        uploads = []
+        request_fingerprint = fingerprint(output_mode, webhook_url, sorted(paths))
+    else:
+        size_check = ocr.check_upload_size(request.content_length)
+        if size_check['decision'] == 'reject':
+            return error(size_check['reason'], 507)
+        uploads = [f for f in request.files.getlist('files[]') if f.filename and ocr.accepted_upload(f.filename)]
+        sources = []
+        request_fingerprint = fingerprint(output_mode, webhook_url, [f.filename for f in uploads])
+    if not uploads and not sources:
+        return error('No PDF, image or archive files provided', 400)
+
+    # Claim the idempotency key before doing any work, so two concurrent retries can't both start a job
+    key = request.headers.get('Idempotency-Key')
+    if key and len(key) > 255:
+        return error('Idempotency-Key must be at most 255 characters', 400)
+    process_id = secrets.token_hex(16)
+    record = ocr.ApiJob(id=process_id, user_id=user.id, token_id=g.api_token.id, status='processing',
+                        output_mode=output_mode,
+                        webhook_url=webhook_url, idempotency_key=key, request_fingerprint=request_fingerprint)
+    ocr.db.session.add(record)
+    try:
+        ocr.db.session.commit()
+    except IntegrityError:
+        ocr.db.session.rollback()
+        existing = ocr.ApiJob.query.filter_by(user_id=user.id, idempotency_key=key).first()
+        if existing is None:
+            return error('Could not record the job; please retry', 409)
+        if existing.request_fingerprint != request_fingerprint:
+            return error('Idempotency-Key was already used for a different request', 422)
+        response = jsonify(job_summary(existing))
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response, 200
+
+    set_current_job(process_id)
+    expected_bytes = request.content_length or sum(os.path.getsize(path) for path, _ in sources)
+    scratch = ocr.create_scratch(process_id, expected_bytes)
+    try:
+        input_dir = scratch.mkdir('input')
+        names = {}
+        for upload in uploads:
+            name = unique_name(input_dir, secure_filename(upload.filename) or 'document.pdf')
+            upload.save(os.path.join(input_dir, name))
+            names[name] = upload.filename
+            scratch.check_quota()
+        for path, relative in sources:
+            # Server files are reflinked in where the filesystem allows, else copied; never hardlinked, since
+            # the job's outputs and cache entries may be linked to its inputs and must not share the originals
+            name = unique_name(input_dir, relative)
+            link_or_copy(path, os.path.join(input_dir, name), hardlink=False)
+            names[name] = path
+
+        # Recorded before the job starts, so its first results can already be traced to their sources
+        record.sources = json.dumps(names)
+        ocr.db.session.commit()
+        app = current_app._get_current_object()
+        started = ocr.start_job(process_id, scratch, list(names), user, output_mode,
+                                on_complete=job_finished(app, process_id),
+                                on_file=file_finished(app, process_id, record.token_id, webhook_url, names)
+                                if webhook_url else None)
+    except ocr.JobNotStarted as e:
+        scratch.cleanup()
+        # Forget the job so the same idempotency key can be retried once there is room
+        ocr.db.session.delete(record)
+        ocr.db.session.commit()
+        if e.retry_after:
+            response, status = error(str(e), e.status, retry_after=e.retry_after)
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, status
+        return error(str(e), e.status)
+    except (ScratchQuotaExceeded, OSError) as e:
+        logger.error(f"Could not start API job {process_id}: {str(e)}")
+        scratch.cleanup()
+        ocr.db.session.delete(record)
+        ocr.db.session.commit()
+        return error(f"Could not start the job: {str(e)}", 507)
+
+    logger.info(f"API job {process_id} started for user {user.id} with {len(names)} files")
+    data = job_summary(record)
+    data.update({'eta_seconds': started['eta_seconds'], 'quote': started['quote']})
+    response = jsonify(data)
+    response.headers['Location'] = data['links']['self']
+    return response, 202
+
+
+@api.route('/jobs', methods=['GET'])
+@token_required
+def list_jobs():
+    ocr = backend()
+    try:
+        limit = min(MAX_PAGE_SIZE, max(1, int(request.args.get('limit', DEFAULT_PAGE_SIZE))))
+        offset = max(0, int(request.args.get('offset', 0)))
+    except ValueError:
+        return error('limit and offset must be integers', 400)
+    query = ocr.ApiJob.query.filter_by(user_id=g.api_user.id)
+    if request.args.get('status'):
+        query = query.filter_by(status=request.args['status'])
+    total = query.count()
+    records = query.order_by(ocr.ApiJob.created_at.desc(), ocr.ApiJob.id).offset(offset).limit(limit).all()
+    return jsonify({'jobs': [job_summary(record) for record in records], 'total': total,
+                    'limit': limit, 'offset': offset})
+
+
+@api.route('/jobs/<job_id>', methods=['GET'])
+@token_required
+def get_job(job_id):
+    record = owned_job(job_id)
+    if record is None:
+        return error('Job not found', 404)
+    data = job_summary(record)
+    job = backend().job_states.get(job_id)
+    if record.status == 'processing' and job is not None:
+        data['elapsed_seconds'] = round(time.time() - job['timestamp'], 1)
+    if record.results:
+        data['files'] = file_results(record)
+    return jsonify(data)
+
+
+@api.route('/jobs/<job_id>/files', methods=['GET'])
+@token_required
+def list_job_files(job_id):
+    record = owned_job(job_id)
+    if record is None:
+        return error('Job not found', 404)
+    if not record.results:
+        return error('Job is still processing', 409, status=record.status)
+    return jsonify({'files': file_results(record)})
+
+
+@api.route('/jobs/<job_id>/files/<path:name>', methods=['GET'])
+@token_required
+def get_job_file(job_id, name):
+    record = owned_job(job_id)
+    if record is None:
+        return error('Job not found', 404)
+    path = zip_path(job_id)
+    if not os.path.exists(path):
+        return error('No output for this job', 404)
+    with zipfile.ZipFile(path) as zf:
+        if name not in zf.namelist():
+            return error('File not found in this job', 404)
+
+    def stream():
+        # Read the member straight out of the job's ZIP rather than unpacking it to disk
+        with zipfile.ZipFile(path) as zf, zf.open(name) as member:
+            while True:
+                chunk = member.read(STREAM_CHUNK_SIZE)
+                if not chunk:
+                    break
+                yield chunk
+
+    return Response(stream(), mimetype='application/pdf',
+                    headers={'Content-Disposition': f'attachment; filename="{secure_filename(name)}"'})
+
+
+@api.route('/jobs/<job_id>/download', methods=['GET'])
+@token_required
+def download_job(job_id):
+    record = owned_job(job_id)
+    if record is None:
+        return error('Job not found', 404)
+    path = zip_path(job_id)
+    if not os.path.exists(path):
+        return error('No output for this job', 404)
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=f'{job_id}.zip')
+
+
+@api.route('/jobs/<job_id>/webhooks', methods=['GET'])
+@token_required
+def list_job_webhooks(job_id):
+    """Delivery log of a job's webhooks: what was sent, how often, and the last error"""
+    record = owned_job(job_id)
+    if record is None:
+        return error('Job not found', 404)
+    model = backend().webhooks.model
+    deliveries = model.query.filter_by(job_id=job_id).order_by(model.id).all()
+    return jsonify({'webhooks': [{
+        'id': delivery.id,
+        'event': delivery.event,
+        'url': delivery.url,
+        'status': delivery.status,
+        'attempts': delivery.attempts,
+        'last_error': delivery.last_error,
+        'next_attempt_at': delivery.next_attempt_at.isoformat() if delivery.status == 'pending' else None,
+        'delivered_at': delivery.delivered_at.isoformat() if delivery.delivered_at else None
+    } for delivery in deliveries]})
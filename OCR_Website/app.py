@@ -5,11 +5,7 @@ import shutil
 import logging
 import time
 import threading
-import signal
-import multiprocessing
-import hashlib
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from collections import deque
+from concurrent.futures import as_completed
 from flask import Flask, render_template, request, send_file, jsonify, Response, flash, redirect, url_for
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
@@ -21,10 +17,26 @@ from wtforms.validators import DataRequired, Length, Email, EqualTo, ValidationE
 from werkzeug.utils import secure_filename
 from werkzeug.exceptions import RequestEntityTooLarge
 from itsdangerous import URLSafeTimedSerializer
-import ocrmypdf
 from pathlib import Path
 import PyPDF2  # Add PyPDF2 for PDF page counting
-import subprocess  # For calling ghostscript
+from log_store import LogStore, current_job_id, set_current_job
+from admission import (AdmissionController, estimate_image_dpi, estimate_job_cost, estimate_task_memory_mb,
+                       largest_page_inches)
+from concurrency import AdaptiveConcurrency
+from scheduler import FairShareScheduler
+from scratch import ScratchSpace, ScratchQuotaExceeded, link_or_copy, sweep_stale
+from postprocess import PostProcessor
+from static_assets import init_static_assets
+from database import engine_options, configure_sqlite, TTLCache
+from metering import inspect_pdf, quote, charged_units
+from archives import ArchiveError, ArchiveLimits, is_archive, iter_pdfs, estimate_info
+from images import IMAGE_EXTENSIONS, ImageConversionError, describe as describe_image, image_to_pdf, is_image
+from images import pdf_name as image_pdf_name
+from api import init_api
+from webhooks import WebhookDispatcher
+import pipeline
+from pipeline import OUTPUT_MODES, get_file_hash, submit_ocr
+import resources
 
 # Set up logging
 logging.basicConfig(
@@ -34,22 +46,26 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-# Store logs in memory for retrieval
-log_buffer = deque(maxlen=100)  # Store last 100 log entries
+# Store structured logs in memory for retrieval, indexed by job ID and sequence number
+log_store = LogStore(maxlen=1000, per_job_maxlen=500, max_jobs=50)
 
 class LogHandler(logging.Handler):
     def emit(self, record):
-        log_entry = self.format(record)
-        log_buffer.append({
-            'timestamp': time.strftime('%Y-%m-%d %H:%M:%S'),
-            'level': record.levelname,
-            'message': record.getMessage()
-        })
+        log_store.append(
+            record.levelname,
+            record.getMessage(),
+            job_id=getattr(record, 'job_id', None) or current_job_id(),
+            created=record.created
+        )
 
-# Add the custom handler to the logger
+# Add the custom handler to this module's logger and to those of the modules the pipeline runs through,
+# so their lines show up in the job log too (not the root logger: werkzeug would log every /logs poll)
+JOB_LOG_MODULES = ('admission', 'api', 'archives', 'concurrency', 'images', 'pipeline', 'postprocess',
+                   'resources', 'result_store', 'scheduler', 'scratch', 'splitting', 'webhooks')
 log_handler = LogHandler()
 log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
-logger.addHandler(log_handler)
+for name in (__name__,) + JOB_LOG_MODULES:
+    logging.getLogger(name).addHandler(log_handler)
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
@@ -59,9 +75,31 @@ app.config['MAX_CONTENT_LENGTH'] = 1.5 * 1024 * 1024 * 1024  # Increased to 1.5G
 import secrets
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', secrets.token_hex(16))
 
-# Database configuration
-app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///instance/users.db')
+# OCR worker pool shared by all jobs; with adaptive concurrency this is the ceiling, and memory decides
+# how many of the workers run at once. Defaults come from the container's cgroup CPU quota, split
+# between gunicorn workers, so the pools together don't oversubscribe the CPUs
+app.config['OCR_WORKERS'] = int(os.environ.get('OCR_WORKERS', resources.ocr_workers()))
+app.config['ADAPTIVE_CONCURRENCY'] = os.environ.get('ADAPTIVE_CONCURRENCY', 'True').lower() in ['true', 'on', '1']
+# Threads per OCR process for ghostscript and tesseract; each pool process pins OMP_THREAD_LIMIT,
+# OMP_NUM_THREADS and the BLAS thread counts to this (an explicit OMP_THREAD_LIMIT is the default)
+app.config['OCR_THREADS'] = int(os.environ.get('OCR_THREADS') or os.environ.get('OMP_THREAD_LIMIT') or
+                                resources.threads_per_worker(app.config['OCR_WORKERS']))
+resources.apply_thread_limits(app.config['OCR_THREADS'])
+logger.info(f"Resources: {resources.summary()}, {app.config['OCR_WORKERS']} OCR workers "
+            f"with {app.config['OCR_THREADS']} threads each")
+
+# Database configuration (relative SQLite paths are resolved inside the instance folder)
+app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', 'sqlite:///users.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+app.config['DB_BUSY_TIMEOUT_MS'] = int(os.environ.get('DB_BUSY_TIMEOUT_MS', '5000'))
+# One connection per concurrent job thread plus request threads
+app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', app.config['OCR_WORKERS'] + 2))
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(
+    app.config['SQLALCHEMY_DATABASE_URI'],
+    pool_size=app.config['DB_POOL_SIZE'],
+    busy_timeout_ms=app.config['DB_BUSY_TIMEOUT_MS']
+)
+app.config['USER_CACHE_TTL_SECONDS'] = float(os.environ.get('USER_CACHE_TTL_SECONDS', '5'))
 
 # Mail configuration
 app.config['MAIL_SERVER'] = os.environ.get('MAIL_SERVER', 'smtp.gmail.com')
@@ -73,6 +111,8 @@ app.config['MAIL_DEFAULT_SENDER'] = os.environ.get('MAIL_DEFAULT_SENDER')
 
 # Initialize extensions
 db = SQLAlchemy(app)
+with app.app_context():
+    configure_sqlite(db.engine, busy_timeout_ms=app.config['DB_BUSY_TIMEOUT_MS'])
 bcrypt = Bcrypt(app)
 login_manager = LoginManager()
 login_manager.init_app(app)
@@ -80,17 +120,212 @@ login_manager.login_view = 'login'
 login_manager.login_message_category = 'info'
 mail = Mail(app)
 
+# Hashed, precompressed static assets (built by `python static_assets.py`)
+init_static_assets(app)
+
 app.config['CACHE_FOLDER'] = 'ocr_cache'  # Folder to store processed files for caching
 app.config['USE_RELOADER'] = False  # Disable auto-reloader to prevent server restart during processing
-app.config['ALLOWED_EXTENSIONS'] = {'pdf'}  # Only allow PDF files
+app.config['ALLOWED_EXTENSIONS'] = {'pdf'}  # PDFs are OCR'd as uploaded; images and archives are converted first
+
+# Per-job scratch lives inside the cache folder so outputs can be hardlinked into the cache;
+# small jobs keep their intermediates on tmpfs
+app.config['SCRATCH_FOLDER'] = os.path.join(app.config['CACHE_FOLDER'], '.scratch')
+app.config['SCRATCH_TMPFS'] = os.environ.get('SCRATCH_TMPFS', '/dev/shm')
+app.config['SCRATCH_QUOTA_MB'] = int(os.environ.get('SCRATCH_QUOTA_MB', '0'))  # 0 = derive from upload size
+
+# ZIP/TAR uploads are extracted as they are processed; these bound what one archive may expand to
+app.config['ARCHIVE_MAX_MEMBERS'] = int(os.environ.get('ARCHIVE_MAX_MEMBERS', '2000'))
+app.config['ARCHIVE_MAX_MEMBER_MB'] = int(os.environ.get('ARCHIVE_MAX_MEMBER_MB', '1536'))
+app.config['ARCHIVE_MAX_TOTAL_MB'] = int(os.environ.get('ARCHIVE_MAX_TOTAL_MB', '4096'))
+app.config['ARCHIVE_MAX_RATIO'] = int(os.environ.get('ARCHIVE_MAX_RATIO', '100'))
+# What is taken out of an archive: PDFs, and images to convert
+DOCUMENT_EXTENSIONS = ('.pdf',) + IMAGE_EXTENSIONS
+archive_limits = ArchiveLimits(
+    max_members=app.config['ARCHIVE_MAX_MEMBERS'],
+    max_member_bytes=app.config['ARCHIVE_MAX_MEMBER_MB'] * 1024 * 1024,
+    max_total_bytes=app.config['ARCHIVE_MAX_TOTAL_MB'] * 1024 * 1024,
+    max_ratio=app.config['ARCHIVE_MAX_RATIO']
+)
+
+# The OCR pipeline reads its settings (CACHE_FOLDER, OCR_THREADS, and the timeout retry and
+# split-and-merge settings, which it takes from the environment) from this config from here on
+pipeline.use_config(app.config)
+
+# API job webhooks: signed with the submitting token's secret and retried with exponential backoff
+app.config['WEBHOOK_MAX_ATTEMPTS'] = int(os.environ.get('WEBHOOK_MAX_ATTEMPTS', '8'))
+app.config['WEBHOOK_BASE_DELAY_SECONDS'] = float(os.environ.get('WEBHOOK_BASE_DELAY_SECONDS', '10'))
+app.config['WEBHOOK_MAX_DELAY_SECONDS'] = float(os.environ.get('WEBHOOK_MAX_DELAY_SECONDS', '3600'))
+app.config['WEBHOOK_TIMEOUT_SECONDS'] = float(os.environ.get('WEBHOOK_TIMEOUT_SECONDS', '10'))
+# Webhook URLs must resolve to public addresses; only enable this to test against a local receiver
+app.config['WEBHOOK_ALLOW_PRIVATE_HOSTS'] = os.environ.get('WEBHOOK_ALLOW_PRIVATE_HOSTS', 'False').lower() in \
+    ['true', 'on', '1']
 
 # Ensure upload and cache directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 os.makedirs(app.config['CACHE_FOLDER'], exist_ok=True)
+os.makedirs(app.config['SCRATCH_FOLDER'], exist_ok=True)
 os.makedirs('instance', exist_ok=True)
 
+# Fair-share scheduling between users
+app.config['FAST_LANE_RESERVED_SLOTS'] = int(os.environ.get('FAST_LANE_RESERVED_SLOTS', '1'))
+app.config['FAST_LANE_MAX_FILES'] = 2
+app.config['FAST_LANE_MAX_PAGES'] = 20
+app.config['TIER_WEIGHTS'] = {'free': 1, 'premium': 3}
+
+# Output mode used when a job doesn't choose one ('pdf' or 'pdfa', see OUTPUT_MODES); the CLI shares it
+app.config['DEFAULT_OUTPUT_MODE'] = pipeline.DEFAULT_OUTPUT_MODE
+
+# Low-priority pass that optimizes and linearizes outputs after the fast OCR result is returned
+app.config['POSTPROCESS_ENABLED'] = os.environ.get('POSTPROCESS_ENABLED', 'True').lower() in ['true', 'on', '1']
+app.config['POSTPROCESS_WORKERS'] = int(os.environ.get('POSTPROCESS_WORKERS', '1'))
+app.config['POSTPROCESS_OPTIMIZE_LEVEL'] = int(os.environ.get('POSTPROCESS_OPTIMIZE_LEVEL', '2'))
+
+# Admission control: refuse or defer jobs the machine can't finish
+app.config['ADMISSION_DISK_RESERVE_MB'] = int(os.environ.get('ADMISSION_DISK_RESERVE_MB', '1024'))
+app.config['ADMISSION_MEMORY_RESERVE_MB'] = int(os.environ.get('ADMISSION_MEMORY_RESERVE_MB', '512'))
+app.config['ADMISSION_MAX_BACKLOG_SECONDS'] = int(os.environ.get('ADMISSION_MAX_BACKLOG_SECONDS', '3600'))
+admission = AdmissionController(
+    workers=app.config['OCR_WORKERS'],
+    disk_reserve_mb=app.config['ADMISSION_DISK_RESERVE_MB'],
+    memory_reserve_mb=app.config['ADMISSION_MEMORY_RESERVE_MB'],
+    max_backlog_seconds=app.config['ADMISSION_MAX_BACKLOG_SECONDS'],
+    paths=[app.config['UPLOAD_FOLDER'], app.config['CACHE_FOLDER'], tempfile.gettempdir()]
+)
+
 # User model
-class User(db.Model, UserMixin):\n    id = db.Column(db.Integer, primary_key=True)\n    username = db.Column(db.String(20), unique=True, nullable=False)\n    email = db.Column(db.String(120), unique=True, nullable=False)\n    password_hash = db.Column(db.String(60), nullable=False)\n    is_active = db.Column(db.Boolean, default=True)\n    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())\n\n    def __repr__(self):\n        return f\"User('{self.username}', '{self.email}')\"\n\n@login_manager.user_loader\ndef load_user(user_id):\n    return User.query.get(int(user_id))\n\n# Forms\nclass RegistrationForm(FlaskForm):\n    username = StringField('Username', validators=[DataRequired(), Length(min=2, max=20)])\n    email = StringField('Email', validators=[DataRequired(), Email()])\n    password = PasswordField('Password', validators=[DataRequired(), Length(min=6)])\n    confirm_password = PasswordField('Confirm Password', validators=[DataRequired(), EqualTo('password')])\n    submit = SubmitField('Sign Up')\n\n    def validate_username(self, username):\n        user = User.query.filter_by(username=username.data).first()\n        if user:\n            raise ValidationError('That username is already taken. Please choose a different one.')\n\n    def validate_email(self, email):\n        user = User.query.filter_by(email=email.data).first()\n        if user:\n            raise ValidationError('That email is already taken. Please choose a different one.')\n\nclass LoginForm(FlaskForm):\n    email = StringField('Email', validators=[DataRequired(), Email()])\n    password = PasswordField('Password', validators=[DataRequired()])\n    remember = BooleanField('Remember Me')\n    submit = SubmitField('Sign In')\n\nclass RequestResetForm(FlaskForm):\n    email = StringField('Email', validators=[DataRequired(), Email()])\n    submit = SubmitField('Request Password Reset')\n\n    def validate_email(self, email):\n        user = User.query.filter_by(email=email.data).first()\n        if user is None:\n            raise ValidationError('There is no account with that email. You must register first.')\n\nclass ResetPasswordForm(FlaskForm):\n    password = PasswordField('Password', validators=[DataRequired(), Length(min=6)])\n    confirm_password = PasswordField('Confirm Password', validators=[DataRequired(), EqualTo('password')])\n    submit = SubmitField('Reset Password')\n\n# Helper functions\ndef get_reset_token(user, expires_sec=1800):\n    s = URLSafeTimedSerializer(app.config['SECRET_KEY'])\n    return s.dumps({'user_id': user.id})\n\ndef verify_reset_token(token, expires_sec=1800):\n    s = URLSafeTimedSerializer(app.config['SECRET_KEY'])\n    try:\n        user_id = s.loads(token, max_age=expires_sec)['user_id']\n    except:\n        return None\n    return User.query.get(user_id)\n\ndef send_reset_email(user):\n    token = get_reset_token(user)\n    msg = Message('Password Reset Request',\n                  sender=app.config['MAIL_DEFAULT_SENDER'],\n                  recipients=[user.email])\n    msg.body = f'''To reset your password, visit the following link:\n{url_for('reset_token', token=token, _external=True)}\n\nIf you did not make this request then simply ignore this email and no changes will be made.\n'''\n    mail.send(msg)
+class User(db.Model, UserMixin):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(20), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password_hash = db.Column(db.String(60), nullable=False)
+    is_active = db.Column(db.Boolean, default=True)
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+
+    def __repr__(self):
+        return f"User('{self.username}', '{self.email}')"
+
+# API tokens for integrations (see api.py); only a hash of each token is stored
+class ApiToken(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    name = db.Column(db.String(100), nullable=False)
+    token_hash = db.Column(db.String(64), unique=True, nullable=False)
+    prefix = db.Column(db.String(12), nullable=False)  # Shown in token lists so users can tell tokens apart
+    # Signs the webhooks of jobs submitted with this token; kept in full, since signing needs it
+    signing_secret = db.Column(db.String(64))
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    last_used_at = db.Column(db.DateTime)
+    revoked_at = db.Column(db.DateTime)
+
+# Jobs submitted through the API, persisted so any web worker can list them, including after a restart
+class ApiJob(db.Model):
+    id = db.Column(db.String(32), primary_key=True)  # The job's process ID
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    token_id = db.Column(db.Integer, db.ForeignKey('api_token.id'))  # The token the job was submitted with
+    status = db.Column(db.String(20), nullable=False, default='processing')
+    output_mode = db.Column(db.String(10), nullable=False)
+    webhook_url = db.Column(db.String(2048))
+    idempotency_key = db.Column(db.String(255))
+    request_fingerprint = db.Column(db.String(64))
+    sources = db.Column(db.Text)  # JSON: file name in the job -> uploaded name or server path
+    results = db.Column(db.Text)  # JSON: the job's results once it finishes
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    completed_at = db.Column(db.DateTime)
+
+    __table_args__ = (db.UniqueConstraint('user_id', 'idempotency_key'),)
+
+# Outbound webhook queue (see webhooks.py); rows survive restarts until delivered or out of attempts
+class WebhookDelivery(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    job_id = db.Column(db.String(32), index=True)
+    token_id = db.Column(db.Integer, db.ForeignKey('api_token.id'))  # Whose signing secret to sign with
+    url = db.Column(db.String(2048), nullable=False)
+    event = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON event data
+    status = db.Column(db.String(20), nullable=False, default='pending', index=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, index=True)
+    last_error = db.Column(db.String(500))
+    created_at = db.Column(db.DateTime, default=db.func.current_timestamp())
+    delivered_at = db.Column(db.DateTime)
+
+# Session checks run on every request, including status polls, so keep recently loaded users briefly
+user_cache = TTLCache(ttl_seconds=app.config['USER_CACHE_TTL_SECONDS'])
+
+@login_manager.user_loader
+def load_user(user_id):
+    user_id = int(user_id)
+    user = user_cache.get(user_id)
+    if user is None:
+        user = db.session.get(User, user_id)
+        if user is not None:
+            # Detach so a later commit in this request can't expire the shared cached copy
+            db.session.expunge(user)
+            user_cache.put(user_id, user)
+    return user
+
+# Forms
+class RegistrationForm(FlaskForm):
+    username = StringField('Username', validators=[DataRequired(), Length(min=2, max=20)])
+    email = StringField('Email', validators=[DataRequired(), Email()])
+    password = PasswordField('Password', validators=[DataRequired(), Length(min=6)])
+    confirm_password = PasswordField('Confirm Password', validators=[DataRequired(), EqualTo('password')])
+    submit = SubmitField('Sign Up')
+
+    def validate_username(self, username):
+        user = User.query.filter_by(username=username.data).first()
+        if user:
+            raise ValidationError('That username is already taken. Please choose a different one.')
+
+    def validate_email(self, email):
+        user = User.query.filter_by(email=email.data).first()
+        if user:
+            raise ValidationError('That email is already taken. Please choose a different one.')
+
+class LoginForm(FlaskForm):
+    email = StringField('Email', validators=[DataRequired(), Email()])
+    password = PasswordField('Password', validators=[DataRequired()])
+    remember = BooleanField('Remember Me')
+    submit = SubmitField('Sign In')
+
+class RequestResetForm(FlaskForm):
+    email = StringField('Email', validators=[DataRequired(), Email()])
+    submit = SubmitField('Request Password Reset')
+
+    def validate_email(self, email):
+        user = User.query.filter_by(email=email.data).first()
+        if user is None:
+            raise ValidationError('There is no account with that email. You must register first.')
+
+class ResetPasswordForm(FlaskForm):
+    password = PasswordField('Password', validators=[DataRequired(), Length(min=6)])
+    confirm_password = PasswordField('Confirm Password', validators=[DataRequired(), EqualTo('password')])
+    submit = SubmitField('Reset Password')
+
+# Helper functions
+def get_reset_token(user, expires_sec=1800):
+    s = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+    return s.dumps({'user_id': user.id})
+
+def verify_reset_token(token, expires_sec=1800):
+    s = URLSafeTimedSerializer(app.config['SECRET_KEY'])
+    try:
+        user_id = s.loads(token, max_age=expires_sec)['user_id']
+    except:
+        return None
+    return db.session.get(User, user_id)
+
+def send_reset_email(user):
+    token = get_reset_token(user)
+    msg = Message('Password Reset Request',
+                  sender=app.config['MAIL_DEFAULT_SENDER'],
+                  recipients=[user.email])
+    msg.body = f'''To reset your password, visit the following link:
+{url_for('reset_token', token=token, _external=True)}
+
+If you did not make this request then simply ignore this email and no changes will be made.
+'''
+    mail.send(msg)
 
 # Global variable to track processing status
 processing_status = {
@@ -104,277 +339,294 @@ processing_status = {
     'last_activity': None
 }
 
-# Global variable to store processing results for recovery after server restart
+# Most recent job, used by the legacy /download endpoint
 processing_results = {
-    'last_process_id': None,
-    'results': None,
-    'is_complete': False,
-    'timestamp': None,
-    'cancel_requested': False
+    'last_process_id': None
 }
 
+# Per-job state (results, completion and cancel flags) so several jobs can run at once
+job_states = {}
+JOB_STATE_TTL_SECONDS = 24 * 60 * 60
+
 # Global variable to track active processing threads
 active_processing_threads = {}
 
+# Shared OCR scheduler, created on first use so the pool isn't forked at import time
+ocr_scheduler = None
+ocr_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Return the process-wide fair-share scheduler"""
+    global ocr_scheduler
+    with ocr_scheduler_lock:
+        if ocr_scheduler is None:
+            concurrency = None
+            if app.config['ADAPTIVE_CONCURRENCY']:
+                concurrency = AdaptiveConcurrency(app.config['OCR_WORKERS'],
+                                                  reserve_mb=app.config['ADMISSION_MEMORY_RESERVE_MB'])
+            ocr_scheduler = FairShareScheduler(
+                slots=app.config['OCR_WORKERS'],
+                fast_lane_reserved=app.config['FAST_LANE_RESERVED_SLOTS'],
+                concurrency=concurrency,
+                initializer=resources.init_worker,
+                initargs=(app.config['OCR_THREADS'],)
+            )
+            logger.info(f"Started OCR scheduler with {ocr_scheduler.slots} worker processes")
+        return ocr_scheduler
+
+# Post-pass pool, also created on first use
+post_processor = None
+
+def get_post_processor():
+    """Return the process-wide optimize/linearize post-processor"""
+    global post_processor
+    with ocr_scheduler_lock:
+        if post_processor is None:
+            post_processor = PostProcessor(
+                workers=app.config['POSTPROCESS_WORKERS'],
+                level=app.config['POSTPROCESS_OPTIMIZE_LEVEL']
+            )
+        return post_processor
+
+def create_job_state(process_id, user_id=None):
+    """Register a new job and forget finished jobs older than the TTL"""
+    cutoff = time.time() - JOB_STATE_TTL_SECONDS
+    for old_id in [pid for pid, job in job_states.items() if job['is_complete'] and job['timestamp'] < cutoff]:
+        del job_states[old_id]
+
+    job_states[process_id] = {
+        'user_id': user_id,
+        'results': None,
+        'is_complete': False,
+        'timestamp': time.time(),
+        'cancel_requested': False
+    }
+    processing_results['last_process_id'] = process_id
+    return job_states[process_id]
+
+def owned_job_state(process_id):
+    """The job's state if it belongs to the logged-in user; someone else's job looks the same as a missing one"""
+    job = job_states.get(process_id)
+    if job is None or job['user_id'] != current_user.id:
+        return None
+    return job
+
+def is_cancel_requested(job_id):
+    """Check whether the user asked to cancel a job"""
+    return job_states.get(job_id, {}).get('cancel_requested', False)
+
+def user_weight(user):
+    """Scheduling weight for a user, from their subscription tier where the model has one"""
+    tier = getattr(user, 'subscription_status', None) or 'free'
+    return app.config['TIER_WEIGHTS'].get(tier, 1)
+
 def allowed_file(filename):
     """Check if a file has an allowed extension"""
     return '.' in filename and \
            filename.rsplit('.', 1)[1].lower() in app.config['ALLOWED_EXTENSIONS']
 
-def optimize_large_pdf(input_path, output_path, size_threshold_mb=100):
-    """Optimize large PDF files to improve OCR processing speed"""
-    file_size_mb = os.path.getsize(input_path) / (1024 * 1024)
-
-    # Only optimize if file is larger than threshold
-    if file_size_mb > size_threshold_mb:
-        logger.info(f"File size {file_size_mb:.2f}MB exceeds {size_threshold_mb}MB threshold. Optimizing before OCR.")
-
-        # Create a temp file for the optimized PDF
-        temp_optimized = tempfile.mktemp(suffix='.pdf')
-
-        try:
-            # Use ghostscript to downsample images and optimize the PDF
-            cmd = [
-                'gs', '-sDEVICE=pdfwrite', '-dCompatibilityLevel=1.4',
-                '-dPDFSETTINGS=/ebook',  # Lower quality for faster processing
-                '-dNOPAUSE', '-dQUIET', '-dBATCH',
-                f'-sOutputFile={temp_optimized}',
-                input_path
-            ]
-
-            logger.info(f"Running optimization command: {' '.join(cmd)}")
-            result = subprocess.run(cmd, capture_output=True, text=True)
-
-            if result.returncode == 0:
-                # Check if optimization actually helped
-                new_size_mb = os.path.getsize(temp_optimized) / (1024 * 1024)
-                reduction = ((file_size_mb - new_size_mb) / file_size_mb) * 100
-
-                logger.info(f"Optimization complete. Original: {file_size_mb:.2f}MB, New: {new_size_mb:.2f}MB (Reduced by {reduction:.1f}%)")
-
-                if reduction > 10:  # Only use optimized version if it's significantly smaller
-                    shutil.move(temp_optimized, output_path)
-                    return output_path, True
-                else:
-                    logger.info("Optimization didn't significantly reduce file size. Using original.")
-                    shutil.copy2(input_path, output_path)
-                    os.remove(temp_optimized)
-                    return output_path, False
-            else:
-                logger.warning(f"Optimization failed: {result.stderr}")
-                shutil.copy2(input_path, output_path)
-                return output_path, False
-        except Exception as e:
-            logger.error(f"Error during PDF optimization: {str(e)}")
-            if os.path.exists(temp_optimized):
-                os.remove(temp_optimized)
-            shutil.copy2(input_path, output_path)
-            return output_path, False
+def accepted_upload(filename):
+    """Check if a file can be submitted to a job: a PDF, an image to convert or an archive to extract"""
+    return allowed_file(filename) or is_image(filename) or is_archive(filename)
+
+def create_scratch(process_id, expected_bytes):
+    """Create a job's scratch space; the quota defaults to the worst case for its input size"""
+    quota_mb = app.config['SCRATCH_QUOTA_MB'] or max(256, expected_bytes / (1024 * 1024) * 5)
+    return ScratchSpace(
+        process_id,
+        root=app.config['SCRATCH_FOLDER'],
+        tmpfs_root=app.config['SCRATCH_TMPFS'],
+        expected_bytes=expected_bytes,
+        quota_bytes=int(quota_mb * 1024 * 1024)
+    )
+
+
+def process_pdfs(input_dir, timeout=1800, max_workers=None, job_id=None, user_key=None, weight=1, fast_lane=False,
+                 scratch=None, file_info=None, output_mode='pdfa', sources=None,
+                 on_result=None):  # Default timeout of 30 minutes
+    # Outputs and intermediates live in the job's scratch space when the caller provides one
+    if scratch is not None:
+        output_dir = scratch.mkdir('output')
+        work_dirs = (scratch.hot, scratch.mkdir('work'))
     else:
-        # File is small enough, just copy it
-        shutil.copy2(input_path, output_path)
-        return output_path, False
-
-def get_file_hash(file_path):
-    """Generate a hash for a file to use as a cache key"""
-    hash_md5 = hashlib.md5()
-
-    # Also use file size and modification time in hash to detect changes
-    file_stat = os.stat(file_path)
-    size_mod = f"{file_stat.st_size}_{file_stat.st_mtime}"
-    hash_md5.update(size_mod.encode())
-
-    # For files smaller than 100MB, include file content in hash
-    if file_stat.st_size < 100 * 1024 * 1024:
-        with open(file_path, "rb") as f:
-            for chunk in iter(lambda: f.read(4096), b""):
-                hash_md5.update(chunk)
-
-    return hash_md5.hexdigest()
-
-def check_cache(file_path, filename):
-    """Check if file has been processed before and is in cache"""
-    try:
-        file_hash = get_file_hash(file_path)
-        cache_key = f"{file_hash}_{filename}"
-        cache_path = os.path.join(app.config['CACHE_FOLDER'], cache_key)
-
-        if os.path.exists(cache_path):
-            logger.info(f"Cache hit for {filename}")
-            return cache_path, True
-
-        logger.info(f"Cache miss for {filename}")
-        return cache_path, False
-    except Exception as e:
-        logger.error(f"Error checking cache: {str(e)}")
-        return None, False
-
-# Function to process a single PDF file (to be used with multiprocessing)
-def process_single_pdf(file_info):
-    """Process a single PDF file with OCR and return the result"""
-    input_path, output_path, filename, timeout = file_info
-    result = {
-        'filename': filename,
-        'success': False,
-        'output_path': output_path,
-        'error': None,
-        'optimized': False,
-        'from_cache': False
-    }
-
-    try:
-        # First check if we have this file in cache
-        cache_path, cache_hit = check_cache(input_path, filename)
-
-        if cache_hit and cache_path:
-            # File found in cache, just copy it to output
-            shutil.copy2(cache_path, output_path)
-            result['success'] = True
-            result['from_cache'] = True
-            return result
-
-        # First, try to optimize large PDFs
-        temp_dir = tempfile.mkdtemp()
-        optimized_path = os.path.join(temp_dir, filename)
-
-        input_path, was_optimized = optimize_large_pdf(input_path, optimized_path)
-        result['optimized'] = was_optimized
-
-        # Try to OCR the file with optimized settings for speed
-        ocrmypdf.ocr(
-            input_path,
-            output_path,
-            deskew=True,
-            skip_text=True,
-            force_ocr=False,
-            optimize=0,
-            clean=False,
-            fast_web_view=0,
-            max_image_mpixels=0,
-            progress_bar=False,
-            jobs=1,  # Use 1 core per file since we're parallelizing at the file level
-            skip_big=100,  # Skip very large images (helps with speed)
-            pdfa_image_compression="jpeg",  # Use faster compression
-            jpeg_quality=70,  # Lower quality for faster processing
-            png_quality=70
-        )
-        result['success'] = True
-
-        # If successful, save to cache for future use
-        if cache_path and result['success']:
-            try:
-                shutil.copy2(output_path, cache_path)
-                logger.info(f"Saved {filename} to cache")
-            except Exception as cache_error:
-                logger.error(f"Error saving to cache: {str(cache_error)}")
-    except ocrmypdf.exceptions.PriorOcrFoundError:
-        # File already has OCR
-        shutil.copy2(input_path, output_path)
-        result['success'] = True
-        result['error'] = "File already has OCR"
-
-        # Save to cache
-        if cache_path:
-            try:
-                shutil.copy2(output_path, cache_path)
-                logger.info(f"Saved {filename} to cache (already OCR'd)")
-            except Exception as cache_error:
-                logger.error(f"Error saving to cache: {str(cache_error)}")
-    except Exception as e:
-        # Handle any errors
-        result['error'] = str(e)
-        # If any error occurs, copy the original file
-        try:
-            shutil.copy2(input_path, output_path)
-            result['success'] = True  # Mark as success since we're providing the original file
-        except Exception as copy_error:
-            result['error'] += f" (Copy failed: {str(copy_error)})"
-    finally:
-        # Clean up temp directory
-        try:
-            shutil.rmtree(temp_dir, ignore_errors=True)
-        except:
-            pass
-
-    return result
-
-def process_pdfs(input_dir, timeout=1800):  # Default timeout of 30 minutes
-    output_dir = tempfile.mkdtemp()
+        output_dir = tempfile.mkdtemp()
+        work_dirs = (None, None)
     processed_files = []
     errors = []
     results = []  # Store all processing results to return
 
-    # Log the start of processing
+    # Log the start of processing. `sources` may be a generator that is still producing files
+    # (e.g. extracting an archive), in which case OCR starts on each file as soon as it arrives
     logger.info(f"Starting OCR processing for files in {input_dir}")
-    pdf_files = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')]
-    file_count = len(pdf_files)
-    processing_status['total_files'] = file_count
-    logger.info(f"Found {file_count} PDF files to process")
+    if sources is None:
+        sources = [f for f in os.listdir(input_dir) if f.lower().endswith('.pdf')]
+    expected_count = len(sources) if isinstance(sources, (list, tuple)) else None
+    processing_status['total_files'] = expected_count or 0
+    if expected_count is not None:
+        logger.info(f"Found {expected_count} PDF files to process")
 
     # Check if processing was canceled
-    if processing_results.get('cancel_requested', False):
+    if is_cancel_requested(job_id):
         logger.info("Processing canceled before starting OCR")
         return [], output_dir, ["Processing canceled by user"], [], {'cpu_cores': 0}
 
-    # Determine the optimal number of processes to use
-    max_workers = min(multiprocessing.cpu_count(), file_count, 4)  # Use up to 4 cores or number of files
-    logger.info(f"Using {max_workers} CPU cores for parallel processing")
+    # Files are scheduled on the shared pool; callers such as the benchmark may ask for a private one
+    if max_workers is None:
+        scheduler = get_scheduler()
+    else:
+        scheduler = FairShareScheduler(slots=max(1, min(max_workers, expected_count or max_workers)),
+                                       fast_lane_reserved=0, initializer=resources.init_worker,
+                                       initargs=(app.config['OCR_THREADS'],))
+    logger.info(f"Using {scheduler.slots} CPU cores for parallel processing"
+                f"{' (fast lane)' if fast_lane else f' (weight {weight})'}")
 
     # Store processing stats
     processing_stats = {
-        'cpu_cores': max_workers
+        'cpu_cores': scheduler.slots
     }
+    if scheduler.concurrency is not None:
+        processing_stats['concurrency'] = scheduler.concurrency.snapshot()
+
+    # Peak memory per file, from the upload inspection when the caller has it
+    known_info = {info['name']: info for info in (file_info or [])}
+
+    # Identical documents are grouped by content and OCR'd once; a group's outcome is kept
+    # so a copy that arrives after its group finished is served straight away
+    file_groups = {}
+    group_outcomes = {}
+    future_to_hash = {}
+    file_count = 0
+    completed = 0
+
+    def report(file_result):
+        """Tell the caller about a finished file as soon as it is done"""
+        if on_result is not None:
+            try:
+                on_result(file_result)
+            except Exception as e:
+                logger.error(f"Error reporting result for {file_result.get('filename')}: {str(e)}")
 
-    # Prepare the file information for parallel processing
-    process_args = []
-    for idx, filename in enumerate(pdf_files):
-        # Check if processing was canceled
-        if processing_results.get('cancel_requested', False):
-            logger.info("Processing canceled while preparing files")
-            return [], output_dir, ["Processing canceled by user"], [], processing_stats
-
-        input_path = os.path.join(input_dir, filename)
-        output_path = os.path.join(output_dir, filename)
-
-        file_size = os.path.getsize(input_path) / (1024 * 1024)  # Size in MB
-        logger.info(f"Preparing file {idx+1}/{file_count}: {filename} ({file_size:.2f} MB)")
-
-        process_args.append((input_path, output_path, filename, timeout))
-
-    # Process files in parallel using ProcessPoolExecutor
-    with ProcessPoolExecutor(max_workers=max_workers) as executor:
-        future_to_file = {executor.submit(process_single_pdf, arg): arg for arg in process_args}
-
-        # Update processing status as each file completes
-        for idx, future in enumerate(as_completed(future_to_file)):
-            # Check if processing was canceled
-            if processing_results.get('cancel_requested', False):
-                logger.info("Processing canceled during OCR processing")
-                executor.shutdown(wait=False)  # Try to shut down the executor without waiting
-                return processed_files, output_dir, ["Processing canceled by user"], results, processing_stats
-
-            arg = future_to_file[future]
+    def fan_out(group, outcome, start=0):
+        """Record the result of a unique document for each filename it was uploaded under"""
+        nonlocal completed
+        result, error = outcome
+        for idx, arg in enumerate(group[start:], start):
             filename = arg[2]
+            completed += 1
 
             # Update processing status
             processing_status['current_file'] = filename
-            processing_status['current_file_index'] = idx + 1
+            processing_status['current_file_index'] = completed
             processing_status['is_processing'] = True
             processing_status['last_activity'] = time.time()
 
+            if result is None:
+                logger.error(f"Exception during parallel processing of {filename}: {error}")
+                errors.append(f"{filename}: {error}")
+                report({'filename': filename, 'success': False, 'error': error})
+                continue
+
+            if idx > 0:
+                try:
+                    link_or_copy(result['output_path'], arg[1])
+                    file_result = dict(result, filename=filename, output_path=arg[1], deduplicated=True)
+                except Exception as e:
+                    logger.error(f"Error copying deduplicated result to {filename}: {str(e)}")
+                    errors.append(f"{filename}: {str(e)}")
+                    report({'filename': filename, 'success': False, 'error': str(e)})
+                    continue
+            else:
+                file_result = result
+            results.append(file_result)
+
+            if file_result['success']:
+                processed_files.append(file_result['output_path'])
+                logger.info(f"Successfully processed file {completed}/{expected_count or file_count}: {filename}"
+                            f"{' (duplicate of ' + group[0][2] + ')' if idx > 0 else ''}")
+            else:
+                logger.error(f"Error processing {filename}: {file_result['error']}")
+                errors.append(f"{filename}: {file_result['error']}")
+            report(file_result)
+
+    def collect(future):
+        """Fan out a finished future; return False if the job has outgrown its scratch quota"""
+        file_hash = future_to_hash.pop(future)
+        try:
+            outcome = (future.result(), None)
+        except Exception as e:
+            outcome = (None, str(e))
+        group_outcomes[file_hash] = outcome
+        fan_out(file_groups[file_hash], outcome)
+
+        # Stop the job if it has outgrown its scratch quota
+        if scratch is not None:
             try:
-                result = future.result()
-                results.append(result)
-
-                if result['success']:
-                    processed_files.append(result['output_path'])
-                    logger.info(f"Successfully processed file {idx+1}/{file_count}: {filename}")
-                else:
-                    logger.error(f"Error processing {filename}: {result['error']}")
-                    errors.append(f"{filename}: {result['error']}")
-            except Exception as e:
-                logger.error(f"Exception during parallel processing of {filename}: {str(e)}")
-                errors.append(f"{filename}: {str(e)}")
+                scratch.check_quota()
+            except ScratchQuotaExceeded as e:
+                logger.error(str(e))
+                scheduler.cancel_job(job_id)
+                errors.append(str(e))
+                return False
+        return True
+
+    def canceled():
+        logger.info("Processing canceled during OCR processing")
+        scheduler.cancel_job(job_id)  # Drop this job's queued files; running ones finish
+        return processed_files, output_dir, ["Processing canceled by user"], results, processing_stats
+
+    try:
+        # Queue each unique document with the scheduler as it arrives; the scheduler interleaves
+        # them with other users' jobs
+        for filename in sources:
+            # Check if processing was canceled
+            if is_cancel_requested(job_id):
+                return canceled()
+
+            input_path = os.path.join(input_dir, filename)
+            output_path = os.path.join(output_dir, filename)
+            file_count += 1
+            processing_status['total_files'] = max(expected_count or 0, file_count)
+
+            file_size = os.path.getsize(input_path) / (1024 * 1024)  # Size in MB
+            logger.info(f"Preparing file {file_count}{f'/{expected_count}' if expected_count else ''}: "
+                        f"{filename} ({file_size:.2f} MB)")
+
+            file_hash = get_file_hash(input_path)
+            arg = (input_path, output_path, filename, timeout, work_dirs, file_hash, output_mode)
+            if file_hash in file_groups:
+                file_groups[file_hash].append(arg)
+                if file_hash in group_outcomes:
+                    fan_out(file_groups[file_hash], group_outcomes[file_hash], start=len(file_groups[file_hash]) - 1)
+            else:
+                file_groups[file_hash] = [arg]
+                if filename not in known_info:
+                    known_info[filename] = {'dpi': estimate_image_dpi(input_path),
+                                            'page_size_in': largest_page_inches(input_path)}
+                future = submit_ocr(scheduler, user_key, job_id, arg, weight=weight, fast_lane=fast_lane,
+                                    memory_mb=estimate_task_memory_mb(known_info[filename]),
+                                    pages=known_info[filename].get('page_count'),
+                                    canceled=lambda: is_cancel_requested(job_id))
+                future_to_hash[future] = file_hash
+
+            # Collect whatever finished while this file was arriving
+            for future in [f for f in future_to_hash if f.done()]:
+                if not collect(future):
+                    return processed_files, output_dir, errors, results, processing_stats
+
+        duplicate_count = file_count - len(file_groups)
+        if duplicate_count:
+            logger.info(f"Found {duplicate_count} duplicate files in this batch; each unique document is OCR'd once")
+
+        # Update processing status as each remaining document completes
+        for future in as_completed(list(future_to_hash)):
+            # Check if processing was canceled
+            if is_cancel_requested(job_id):
+                return canceled()
+            if not collect(future):
+                break
+    finally:
+        if max_workers is not None:
+            scheduler.shutdown(wait=not is_cancel_requested(job_id))
 
     # Reset processing status
     processing_status['is_processing'] = False
@@ -383,17 +635,78 @@ def process_pdfs(input_dir, timeout=1800):  # Default timeout of 30 minutes
     return processed_files, output_dir, errors, results, processing_stats
 
 def count_pdf_pages(pdf_path):
-    """Count the number of pages in a PDF file."""
+    """Count the pages in a PDF file, and how many of them already have a text layer."""
     try:
         logger.info(f"Counting pages in {os.path.basename(pdf_path)}")
-        with open(pdf_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            page_count = len(pdf_reader.pages)
-            logger.info(f"File {os.path.basename(pdf_path)} has {page_count} pages")
-            return page_count
+        page_count, text_pages = inspect_pdf(pdf_path)
+        logger.info(f"File {os.path.basename(pdf_path)} has {page_count} pages ({text_pages} with text)")
+        return page_count, text_pages
     except Exception as e:
         logger.error(f"Error counting pages in {pdf_path}: {str(e)}")
-        return 0
+        return 0, 0
+
+def inspect_upload(file_path, filename):
+    """Page count, text pages, size and image DPI of an uploaded PDF, for admission and metering"""
+    page_count, text_pages = count_pdf_pages(file_path)
+    return {
+        'name': filename,
+        'page_count': page_count,
+        'text_pages': text_pages,
+        'size_mb': round(os.path.getsize(file_path) / (1024 * 1024), 2),
+        'dpi': estimate_image_dpi(file_path),
+        'page_size_in': largest_page_inches(file_path)
+    }
+
+def inspect_image(file_path, pdf_filename):
+    """Page count, size and resolution of an uploaded image, under the name of the PDF it becomes"""
+    described = describe_image(file_path)
+    return {
+        'name': pdf_filename,
+        'page_count': described['frames'],
+        'text_pages': 0,
+        'size_mb': round(os.path.getsize(file_path) / (1024 * 1024), 2),
+        'dpi': described['dpi'],
+        'page_size_in': described['page_size_in']
+    }
+
+def converted_name(input_dir, image_filename, reserved):
+    """A PDF name for a converted image that clashes with no upload and no other conversion"""
+    name = image_pdf_name(image_filename)
+    stem, ext = os.path.splitext(name)
+    counter = 1
+    while name in reserved or os.path.exists(os.path.join(input_dir, name)):
+        name = f"{stem}_{counter}{ext}"
+        counter += 1
+    reserved.add(name)
+    return name
+
+@app.route('/quote', methods=['POST'])
+@login_required
+def quote_files():
+    """Pre-flight cost quote: page counts and compute units for a set of PDFs, without processing them"""
+    if 'files[]' not in request.files:
+        return jsonify({'error': 'No files provided'}), 400
+
+    quote_dir = tempfile.mkdtemp(dir=app.config['SCRATCH_FOLDER'])
+    try:
+        file_info = []
+        for file in request.files.getlist('files[]'):
+            if file.filename and (allowed_file(file.filename) or is_image(file.filename)):
+                filename = secure_filename(file.filename)
+                file_path = os.path.join(quote_dir, filename)
+                file.save(file_path)
+                if is_image(filename):
+                    try:
+                        file_info.append(inspect_image(file_path, image_pdf_name(filename)))
+                    except ImageConversionError as e:
+                        logger.warning(str(e))
+                    continue
+                file_info.append(inspect_upload(file_path, filename))
+        if not file_info:
+            return jsonify({'error': 'No valid PDF files provided. Only PDF files are accepted.'}), 400
+        return jsonify({'quote': quote(file_info), 'file_info': file_info})
+    finally:
+        shutil.rmtree(quote_dir, ignore_errors=True)
 
 @app.route('/')
 def index():
@@ -404,9 +717,333 @@ def index():
 def dashboard():
     return render_template('dashboard.html', title='Dashboard')
 
+class JobNotStarted(Exception):
+    """A job that couldn't be started: nothing usable was uploaded, or admission control turned it away"""
+
+    def __init__(self, message, status=400, retry_after=None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+def start_ocr_job(process_id, scratch, filenames, user, output_mode, on_complete=None, on_file=None):
+    """
+    Inspect and admit the files saved in a job's scratch input folder, then OCR them in the background.
+
+    Returns the job's ETA and quote, or raises JobNotStarted (after removing the scratch space).
+    `on_file(result)` is called from the background thread as each file finishes, and
+    `on_complete(job)` once the job's results are final.
+    """
+    input_dir = scratch.mkdir('input')
+    file_info = []
+    pdf_names = []
+    image_uploads = []
+    archives = []
+    total_pages = 0
+
+    for filename in filenames:
+        file_path = os.path.join(input_dir, filename)
+
+        # Archives are extracted while the job runs; until then they are admitted on their declared size
+        if is_archive(filename):
+            archives.append(estimate_info(file_path, archive_limits, extensions=DOCUMENT_EXTENSIONS))
+            continue
+        # Images are converted to PDF while the job runs, once every upload has claimed its name
+        if is_image(filename):
+            image_uploads.append(filename)
+            continue
+
+        # Count pages (and pages that already have text) in the PDF
+        info = inspect_upload(file_path, filename)
+        total_pages += info['page_count']
+        file_info.append(info)
+        pdf_names.append(filename)
+
+    # Each image is metered and admitted as the PDF it becomes, one page per frame
+    reserved_names = set()
+    images = []
+    for filename in image_uploads:
+        try:
+            info = inspect_image(os.path.join(input_dir, filename),
+                                 converted_name(input_dir, filename, reserved_names))
+        except ImageConversionError as e:
+            logger.warning(f"Skipping unreadable image: {str(e)}")
+            continue
+        info['converted_from'] = filename
+        total_pages += info['page_count']
+        file_info.append(info)
+        images.append((filename, info))
+
+    if not file_info and not archives:
+        scratch.cleanup()
+        raise JobNotStarted('None of the uploaded files could be read')
+
+    # Extracted members need their own room in the job's scratch space
+    if archives and not app.config['SCRATCH_QUOTA_MB']:
+        scratch.quota_bytes += int(sum(a['size_mb'] for a in archives) * 5 * 1024 * 1024)
+
+    # Admission control: make sure the machine can finish this job before accepting it
+    cost = estimate_job_cost(file_info + archives, workers=admission.workers)
+    decision = admission.try_admit(process_id, cost)
+    if decision['decision'] != 'accept':
+        scratch.cleanup()
+        logger.warning(f"Job {process_id} not admitted ({decision['decision']}): {decision['reason']}")
+        if decision['decision'] == 'defer':
+            minutes = max(1, round(decision['retry_after'] / 60))
+            raise JobNotStarted(
+                f"{decision['reason']}. Please try again in about {minutes} minute{'s' if minutes != 1 else ''}.",
+                status=503, retry_after=decision['retry_after'])
+        raise JobNotStarted(f"{decision['reason']}. Please upload fewer or smaller files.", status=507)
+
+    job_quote = quote(file_info + archives)
+    if archives:
+        # Page counts for archives are guessed from their size until they are extracted
+        job_quote['estimated'] = True
+    logger.info(f"All files uploaded. Starting OCR processing for {len(filenames)} files with "
+                f"{total_pages}{' + archived' if archives else ''} total pages "
+                f"(estimated {cost['wall_seconds']:.0f}s, {cost['memory_mb']:.0f}MB peak memory)")
+
+    job = create_job_state(process_id, user_id=user.id)
+
+    # Scheduling inputs are read here because the user isn't available in the background thread
+    user_key = user.get_id()
+    weight = user_weight(user)
+    fast_lane = (not archives and len(file_info) <= app.config['FAST_LANE_MAX_FILES'] and
+                 total_pages <= app.config['FAST_LANE_MAX_PAGES'])
+
+    # Loose PDFs first, then images as they are converted, then each archive's members as they
+    # are extracted, so OCR starts on the first document while the rest are still being prepared
+    extraction_errors = []
+
+    def convert_image(filename, info):
+        """Convert an uploaded image to its PDF, frames in parallel on the OCR pool"""
+        image_path = os.path.join(input_dir, filename)
+        memory_mb = estimate_task_memory_mb(info)
+        scheduler = get_scheduler()
+
+        def submit(fn, *args):
+            return scheduler.submit(user_key, process_id, fn, *args, weight=weight, memory_mb=memory_mb)
+
+        try:
+            image_to_pdf(image_path, os.path.join(input_dir, info['name']), submit=submit,
+                         work_dir=scratch.mkdir('work'))
+            return True
+        except ImageConversionError as e:
+            logger.error(str(e))
+            extraction_errors.append(f"{filename}: {str(e)}")
+            return False
+        finally:
+            # The image isn't needed once converted; free its scratch space
+            if os.path.exists(image_path):
+                os.remove(image_path)
+
+    def job_sources():
+        for name in pdf_names:
+            yield name
+        for filename, info in images:
+            if convert_image(filename, info):
+                yield info['name']
+        for archive in archives:
+            archive_path = os.path.join(input_dir, archive['name'])
+            try:
+                for name, path in iter_pdfs(archive_path, input_dir, archive_limits,
+                                            extensions=DOCUMENT_EXTENSIONS):
+                    if is_image(name):
+                        try:
+                            info = inspect_image(path, converted_name(input_dir, name, reserved_names))
+                            info.update(converted_from=name, archive=archive['name'])
+                        except ImageConversionError as e:
+                            logger.error(str(e))
+                            extraction_errors.append(f"{archive['name']}/{name}: {str(e)}")
+                            os.remove(path)
+                            continue
+                        if convert_image(name, info):
+                            file_info.append(info)
+                            yield info['name']
+                        continue
+                    file_info.append(dict(inspect_upload(path, name), archive=archive['name']))
+                    yield name
+            except ArchiveError as e:
+                logger.error(f"Stopped extracting {archive['name']}: {str(e)}")
+                extraction_errors.append(f"{archive['name']}: {str(e)}")
+            finally:
+                # The archive isn't needed once extracted; free its scratch space
+                if os.path.exists(archive_path):
+                    os.remove(archive_path)
+
+    # Start processing in a background thread to prevent blocking
+    def process_in_background():
+        set_current_job(process_id)
+        try:
+            # Check if processing was canceled
+            if job['cancel_requested']:
+                logger.info(f"Processing canceled for process ID: {process_id}")
+                job['results'] = {
+                    'error': 'Processing was canceled by the user',
+                    'success': False,
+                    'process_id': process_id
+                }
+                job['is_complete'] = True
+                return
+
+            # Process PDFs - Note the additional return values
+            processed_files, output_dir, errors, results, processing_stats = process_pdfs(
+                input_dir, job_id=process_id, user_key=user_key, weight=weight, fast_lane=fast_lane,
+                scratch=scratch, file_info=file_info, output_mode=output_mode, sources=job_sources(),
+                on_result=on_file)
+            errors = errors + extraction_errors
+
+            # Check if processing was canceled during PDF processing
+            if job['cancel_requested']:
+                logger.info(f"Processing canceled for process ID: {process_id}")
+                job['results'] = {
+                    'error': 'Processing was canceled by the user',
+                    'success': False,
+                    'process_id': process_id
+                }
+                job['is_complete'] = True
+                return
+
+            if not processed_files:
+                logger.error("No files were processed successfully")
+                job['results'] = {
+                    'error': 'No files were processed successfully' +
+                             (f" ({'; '.join(extraction_errors)})" if extraction_errors else ''),
+                    'success': False,
+                    'process_id': process_id
+                }
+                job['is_complete'] = True
+                return
+
+            # Create zip file
+            zip_path = os.path.join(app.config['UPLOAD_FOLDER'], f'processed_files_{process_id}.zip')
+            logger.info(f"Creating ZIP archive at {zip_path}")
+            with zipfile.ZipFile(zip_path, 'w') as zipf:
+                for file_path in processed_files:
+                    arcname = os.path.basename(file_path)
+                    zipf.write(file_path, arcname)
+                    logger.info(f"Added to zip: {arcname}")
+
+            zip_size = os.path.getsize(zip_path) / (1024 * 1024)  # Size in MB
+            logger.info(f"ZIP archive created successfully. Size: {zip_size:.2f} MB")
+
+            # Archive members are only counted once they have been extracted
+            job_pages = sum(fi['page_count'] for fi in file_info)
+            max_units = quote(file_info)['max_units'] if archives else job_quote['max_units']
+
+            # Calculate optimization statistics
+            optimized_count = sum(1 for r in results if r.get('optimized', False))
+            from_cache_count = sum(1 for r in results if r.get('from_cache', False))
+            deduplicated_count = sum(1 for r in results if r.get('deduplicated', False))
+
+            # Update file info with processing details and meter what was actually OCR'd
+            compute_units = 0.0
+            for result in results:
+                for fi in file_info:
+                    if fi['name'] == result.get('filename'):
+                        fi['optimized'] = result.get('optimized', False)
+                        fi['from_cache'] = result.get('from_cache', False)
+                        fi['deduplicated'] = result.get('deduplicated', False)
+                        fi['prior_ocr'] = result.get('prior_ocr', False)
+                        fi['error'] = None if fi['prior_ocr'] else result.get('error')
+                        fi['compute_units'] = round(charged_units(
+                            fi,
+                            from_cache=fi['from_cache'] or fi['deduplicated'],
+                            prior_ocr=result.get('prior_ocr', False),
+                            failed=bool(result.get('error')) and not result.get('prior_ocr', False),
+                            ocr_pages=result.get('ocr_pages')
+                        ), 2)
+                        compute_units += fi['compute_units']
+                        break
+
+            # Store the results for retrieval
+            job['results'] = {
+                'message': 'Processing complete',
+                'download_url': f'/download/{process_id}',
+                'errors': errors if errors else None,
+                'file_info': file_info,
+                'total_pages': job_pages,
+                'stats': {
+                    'optimized_files': optimized_count,
+                    'from_cache': from_cache_count,
+                    'deduplicated_files': deduplicated_count,
+                    'pages': job_pages,
+                    'compute_units': round(compute_units, 2),
+                    'refunded_units': round(max_units - compute_units, 2),
+                    'total_files': len(file_info),
+                    'cpu_cores': processing_stats['cpu_cores']
+                },
+                'output_mode': output_mode,
+                'process_id': process_id,
+                'success': True
+            }
+
+            # Hand the cached outputs to the post-pass; the download is swapped for the optimized ZIP when ready
+            members = {os.path.basename(r['output_path']): r['cache_path']
+                       for r in results if r.get('success') and r.get('cache_path')}
+            if app.config['POSTPROCESS_ENABLED'] and members:
+                job['results']['optimized_output'] = 'pending'
+
+                def postprocess_done(stats, job_results=job['results']):
+                    job_results['optimized_output'] = 'ready' if not stats['errors'] else 'partial'
+                    job_results['stats']['optimized_bytes_saved'] = stats['bytes_before'] - stats['bytes_after']
+
+                # Plain output is only linearized, so the post-pass doesn't re-encode its images either
+                get_post_processor().submit(process_id, zip_path, members, on_done=postprocess_done,
+                                            level=0 if output_mode == 'pdf' else None)
+
+            job['is_complete'] = True
+            logger.info(f"Processing completed successfully for process ID: {process_id}")
+        except Exception as e:
+            logger.error(f"Unexpected error in background processing: {str(e)}")
+            job['results'] = {
+                'error': f'An unexpected error occurred: {str(e)}',
+                'success': False,
+                'process_id': process_id
+            }
+            job['is_complete'] = True
+        finally:
+            # Cleanup the job's scratch space (inputs, outputs and intermediates)
+            try:
+                logger.info("Cleaning up temporary directories")
+                scratch.cleanup()
+            except Exception as e:
+                logger.error(f"Error during cleanup: {str(e)}")
+
+            # Remove thread reference and return the job's admission reservation
+            if process_id in active_processing_threads:
+                del active_processing_threads[process_id]
+            admission.release(process_id)
+
+            if on_complete is not None:
+                try:
+                    on_complete(job)
+                except Exception as e:
+                    logger.error(f"Error in completion handler for {process_id}: {str(e)}")
+
+    # Start the background processing thread
+    processing_thread = threading.Thread(target=process_in_background)
+    processing_thread.daemon = True
+    processing_thread.start()
+
+    # Store thread reference for potential cancellation
+    active_processing_threads[process_id] = processing_thread
+
+    return {
+        'process_id': process_id,
+        'eta_seconds': decision['eta_seconds'],
+        'output_mode': output_mode,
+        'quote': job_quote
+    }
+
 @app.route('/process', methods=['POST'])
 @login_required
 def process_files():
+    # Check the declared upload size before Flask spools the files to disk
+    size_check = admission.check_upload_size(request.content_length)
+    if size_check['decision'] == 'reject':
+        logger.warning(f"Upload rejected: {size_check['reason']}")
+        return jsonify({'error': size_check['reason']}), 507
+
     if 'files[]' not in request.files:
         logger.warning("No files provided in request")
         return jsonify({'error': 'No files provided'}), 400
@@ -416,207 +1053,111 @@ def process_files():
         logger.warning("No files selected for processing")
         return jsonify({'error': 'No files selected'}), 400
 
+    output_mode = request.form.get('output_mode') or app.config['DEFAULT_OUTPUT_MODE']
+    if output_mode not in OUTPUT_MODES:
+        return jsonify({'error': f"Unknown output mode: {output_mode}"}), 400
+
+    scratch = None
     try:
-        # Generate a unique process ID
-        process_id = hashlib.md5(str(time.time()).encode()).hexdigest()
-        processing_results['last_process_id'] = process_id
-        processing_results['is_complete'] = False
-        processing_results['cancel_requested'] = False
-        processing_results['timestamp'] = time.time()
-
-        # Create temporary directory for input files
-        input_dir = tempfile.mkdtemp()
-        file_info = []
-        total_pages = 0
+        # Generate an unguessable process ID; it names the job's status, cancel and download URLs
+        process_id = secrets.token_hex(16)
+
+        # Tag upload-phase log lines with this job; cleared again when the request ends
+        set_current_job(process_id)
+
+        # Create the job's scratch space; the quota defaults to the worst case for this upload
+        scratch = create_scratch(process_id, request.content_length or 0)
+        input_dir = scratch.mkdir('input')
 
         logger.info(f"Starting to process {len(files)} files (Process ID: {process_id})")
 
         # Validate files
         valid_files = []
         for file in files:
-            if file.filename and allowed_file(file.filename):
+            if file.filename and accepted_upload(file.filename):
                 valid_files.append(file)
             else:
                 logger.warning(f"Skipping file with invalid extension: {file.filename}")
 
         if not valid_files:
             logger.warning("No valid PDF files provided")
-            shutil.rmtree(input_dir, ignore_errors=True)
-            return jsonify({'error': 'No valid PDF files provided. Only PDF files are accepted.'}), 400
+            scratch.cleanup()
+            return jsonify({'error': 'No valid PDF files provided. Only PDF, TIFF, JPEG, PNG, ZIP and TAR files '
+                                     'are accepted.'}), 400
 
+        saved = []
         for idx, file in enumerate(valid_files):
             filename = secure_filename(file.filename)
             file_path = os.path.join(input_dir, filename)
             file.save(file_path)
             file_size = os.path.getsize(file_path) / (1024 * 1024)  # Size in MB
             logger.info(f"Saved file {idx+1}/{len(valid_files)}: {filename} ({file_size:.2f} MB)")
+            scratch.check_quota()
+            if filename not in saved:
+                saved.append(filename)
 
-            # Count pages in the PDF
-            page_count = count_pdf_pages(file_path)
-            total_pages += page_count
-            file_info.append({
-                'name': filename,
-                'page_count': page_count,
-                'size_mb': round(file_size, 2)
-            })
-
-        logger.info(f"All files uploaded. Starting OCR processing for {len(valid_files)} files with {total_pages} total pages")
-
-        # Start processing in a background thread to prevent blocking
-        def process_in_background():
-            output_dir = None
-            try:
-                # Check if processing was canceled
-                if processing_results['cancel_requested']:
-                    logger.info(f"Processing canceled for process ID: {process_id}")
-                    processing_results['results'] = {
-                        'error': 'Processing was canceled by the user',
-                        'success': False,
-                        'process_id': process_id
-                    }
-                    processing_results['is_complete'] = True
-                    return
-
-                # Process PDFs - Note the additional return values
-                processed_files, output_dir, errors, results, processing_stats = process_pdfs(input_dir)
-
-                # Check if processing was canceled during PDF processing
-                if processing_results['cancel_requested']:
-                    logger.info(f"Processing canceled for process ID: {process_id}")
-                    processing_results['results'] = {
-                        'error': 'Processing was canceled by the user',
-                        'success': False,
-                        'process_id': process_id
-                    }
-                    processing_results['is_complete'] = True
-                    return
-
-                if not processed_files:
-                    logger.error("No files were processed successfully")
-                    processing_results['results'] = {
-                        'error': 'No files were processed successfully',
-                        'success': False,
-                        'process_id': process_id
-                    }
-                    processing_results['is_complete'] = True
-                    return
-
-                # Create zip file
-                zip_path = os.path.join(app.config['UPLOAD_FOLDER'], f'processed_files_{process_id}.zip')
-                logger.info(f"Creating ZIP archive at {zip_path}")
-                with zipfile.ZipFile(zip_path, 'w') as zipf:
-                    for file_path in processed_files:
-                        arcname = os.path.basename(file_path)
-                        zipf.write(file_path, arcname)
-                        logger.info(f"Added to zip: {arcname}")
-
-                zip_size = os.path.getsize(zip_path) / (1024 * 1024)  # Size in MB
-                logger.info(f"ZIP archive created successfully. Size: {zip_size:.2f} MB")
-
-                # Calculate optimization statistics
-                optimized_count = sum(1 for r in results if r.get('optimized', False))
-                from_cache_count = sum(1 for r in results if r.get('from_cache', False))
-
-                # Update file info with processing details
-                for result in results:
-                    for fi in file_info:
-                        if fi['name'] == result.get('filename'):
-                            fi['optimized'] = result.get('optimized', False)
-                            fi['from_cache'] = result.get('from_cache', False)
-                            break
-
-                # Store the results for retrieval
-                processing_results['results'] = {
-                    'message': 'Processing complete',
-                    'download_url': f'/download/{process_id}',
-                    'errors': errors if errors else None,
-                    'file_info': file_info,
-                    'total_pages': total_pages,
-                    'stats': {
-                        'optimized_files': optimized_count,
-                        'from_cache': from_cache_count,
-                        'total_files': len(file_info),
-                        'cpu_cores': processing_stats['cpu_cores']
-                    },
-                    'process_id': process_id,
-                    'success': True
-                }
-                processing_results['is_complete'] = True
-                logger.info(f"Processing completed successfully for process ID: {process_id}")
-            except Exception as e:
-                logger.error(f"Unexpected error in background processing: {str(e)}")
-                processing_results['results'] = {
-                    'error': f'An unexpected error occurred: {str(e)}',
-                    'success': False,
-                    'process_id': process_id
-                }
-                processing_results['is_complete'] = True
-            finally:
-                # Cleanup temporary directories
-                try:
-                    logger.info("Cleaning up temporary directories")
-                    shutil.rmtree(input_dir, ignore_errors=True)
-                    if output_dir:
-                        shutil.rmtree(output_dir, ignore_errors=True)
-                except Exception as e:
-                    logger.error(f"Error during cleanup: {str(e)}")
-
-                # Remove thread reference
-                if process_id in active_processing_threads:
-                    del active_processing_threads[process_id]
-
-        # Start the background processing thread
-        processing_thread = threading.Thread(target=process_in_background)
-        processing_thread.daemon = True
-        processing_thread.start()
-
-        # Store thread reference for potential cancellation
-        active_processing_threads[process_id] = processing_thread
-
-        return jsonify({
-            'message': 'Processing started',
-            'process_id': process_id
-        })
-
+        try:
+            started = start_ocr_job(process_id, scratch, saved, current_user, output_mode)
+        except JobNotStarted as e:
+            body = {'error': str(e)}
+            if e.retry_after:
+                body['retry_after'] = e.retry_after
+            response = jsonify(body)
+            if e.retry_after:
+                response.headers['Retry-After'] = str(e.retry_after)
+            return response, e.status
+
+        return jsonify(dict(started, message='Processing started'))
+
+    except ScratchQuotaExceeded as e:
+        logger.error(f"Upload rejected: {str(e)}")
+        scratch.cleanup()
+        return jsonify({'error': str(e)}), 507
     except Exception as e:
         logger.error(f"Unexpected error starting process: {str(e)}")
+        if scratch is not None:
+            scratch.cleanup()
         return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
 
 @app.route('/process-status/<process_id>', methods=['GET'])
 @login_required
 def process_status(process_id):
     """Get the status of a processing job"""
-    if not processing_results['last_process_id']:
+    if not job_states:
         return jsonify({'error': 'No processing job found'}), 404
 
-    if processing_results['last_process_id'] != process_id:
+    job = owned_job_state(process_id)
+    if job is None:
         return jsonify({'error': 'Process ID not found'}), 404
 
-    if processing_results['is_complete']:
-        return jsonify(processing_results['results'])
+    if job['is_complete']:
+        return jsonify(job['results'])
     else:
         return jsonify({
             'message': 'Processing in progress',
             'process_id': process_id,
-            'elapsed_seconds': time.time() - processing_results['timestamp'],
-            'cancel_requested': processing_results['cancel_requested']
+            'elapsed_seconds': time.time() - job['timestamp'],
+            'cancel_requested': job['cancel_requested']
         })
 
 @app.route('/cancel-process/<process_id>', methods=['POST'])
 @login_required
 def cancel_process(process_id):
     """Cancel a running processing job"""
-    if not processing_results['last_process_id']:
+    if not job_states:
         return jsonify({'error': 'No processing job found'}), 404
 
-    if processing_results['last_process_id'] != process_id:
+    job = owned_job_state(process_id)
+    if job is None:
         return jsonify({'error': 'Process ID not found'}), 404
 
-    if processing_results['is_complete']:
+    if job['is_complete']:
         return jsonify({'error': 'Process already completed'}), 400
 
-    # Mark the process as canceled
-    processing_results['cancel_requested'] = True
+    # Mark the process as canceled and drop its files that are still queued
+    job['cancel_requested'] = True
+    if ocr_scheduler is not None:
+        ocr_scheduler.cancel_job(process_id)
     logger.info(f"Cancel requested for process ID: {process_id}")
 
     # If we have a thread reference, try to terminate it
@@ -637,7 +1178,7 @@ def cancel_process(process_id):
 def download(process_id):
     """Download the processed files for a specific process ID"""
     zip_path = os.path.join(app.config['UPLOAD_FOLDER'], f'processed_files_{process_id}.zip')
-    if not os.path.exists(zip_path):
+    if owned_job_state(process_id) is None or not os.path.exists(zip_path):
         logger.warning(f"Download requested but no processed files found for process ID: {process_id}")
         return jsonify({'error': 'No processed files found'}), 404
 
@@ -649,15 +1190,34 @@ def download(process_id):
 @login_required
 def download_legacy():
     """Legacy download endpoint for backward compatibility"""
-    if not processing_results['last_process_id']:
+    # The user's most recent job, not the server's: the last job overall may be someone else's
+    owned = [(job['timestamp'], pid) for pid, job in list(job_states.items()) if job['user_id'] == current_user.id]
+    if not owned:
         return jsonify({'error': 'No processed files found'}), 404
 
-    return download(processing_results['last_process_id'])
+    return download(max(owned)[1])
+
+@app.teardown_request
+def clear_job_log_context(exc):
+    """Stop tagging log lines once the request that bound a job has finished"""
+    set_current_job(None)
 
 @app.route('/logs')
 def get_logs():
-    """Return the latest logs as JSON"""
-    return jsonify(list(log_buffer))
+    """Return log entries newer than the `after` cursor, optionally for a single job"""
+    after = request.args.get('after', 0, type=int)
+    job_id = request.args.get('job') or None
+    limit = min(request.args.get('limit', 500, type=int), 1000)
+
+    # A cursor ahead of the store means the server restarted, so start over
+    if after > log_store.last_seq:
+        after = 0
+
+    entries = log_store.since(after, job_id=job_id, limit=limit)
+    return jsonify({
+        'entries': entries,
+        'cursor': entries[-1]['seq'] if entries else after
+    })
 
 @app.route('/status')
 def get_status():
@@ -682,7 +1242,8 @@ def clear_cache():
     try:
         cache_dir = app.config['CACHE_FOLDER']
         if os.path.exists(cache_dir):
-            file_count = len(os.listdir(cache_dir))
+            # Only count cache entries, not the scratch directory that lives alongside them
+            file_count = sum(1 for name in os.listdir(cache_dir) if os.path.isfile(os.path.join(cache_dir, name)))
 
             # Remove files from the cache directory
             for filename in os.listdir(cache_dir):
@@ -769,8 +1330,9 @@ def cleanup_old_cache_files(max_age_days=7, max_size_mb=5000):
     except Exception as e:
         logger.error(f"Error during cache cleanup: {str(e)}")
 
-# Run cache cleanup on startup
+# Run cache cleanup on startup, and remove scratch left behind by a crashed process
 cleanup_old_cache_files()
+sweep_stale([app.config['SCRATCH_FOLDER'], app.config['SCRATCH_TMPFS']])
 
 @app.errorhandler(RequestEntityTooLarge)
 def handle_file_too_large(e):
@@ -844,10 +1406,35 @@ def reset_token(token):
         hashed_password = bcrypt.generate_password_hash(form.password.data).decode('utf-8')
         user.password_hash = hashed_password
         db.session.commit()
+        user_cache.invalidate(user.id)
         flash('Your password has been updated! You are now able to log in', 'success')
         return redirect(url_for('login'))
     return render_template('reset_token.html', title='Reset Password', form=form)
 
+# Versioned JSON API for integrations
+init_api(
+    app,
+    db=db,
+    User=User,
+    ApiToken=ApiToken,
+    ApiJob=ApiJob,
+    job_states=job_states,
+    accepted_upload=accepted_upload,
+    create_scratch=create_scratch,
+    start_job=start_ocr_job,
+    JobNotStarted=JobNotStarted,
+    check_upload_size=admission.check_upload_size,
+    output_modes=OUTPUT_MODES,
+    webhooks=WebhookDispatcher(
+        app, db, WebhookDelivery, ApiToken,
+        max_attempts=app.config['WEBHOOK_MAX_ATTEMPTS'],
+        base_delay=app.config['WEBHOOK_BASE_DELAY_SECONDS'],
+        max_delay=app.config['WEBHOOK_MAX_DELAY_SECONDS'],
+        timeout=app.config['WEBHOOK_TIMEOUT_SECONDS'],
+        allow_private=app.config['WEBHOOK_ALLOW_PRIVATE_HOSTS']
+    )
+)
+
 # Initialize database
 def create_tables():
     with app.app_context():
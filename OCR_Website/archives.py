@@ -0,0 +1,182 @@
+"""
+Streaming extraction of PDFs from uploaded ZIP and TAR archives.
+
+Members are extracted one at a time and handed to the caller as soon as each
+is written, so OCR on the first files starts while the rest of the archive is
+still being unpacked. Only regular files with an accepted extension (.pdf by
+default) are extracted, under flattened, sanitized names; directories, links
+and devices are skipped.
+
+Zip-bomb limits are enforced on the bytes actually written, not on the sizes
+the archive declares: a member count, a per-member size, a total size and a
+compression ratio (per member for ZIP, for the whole stream for TAR).
+"""
+
+import os
+import math
+import logging
+import tarfile
+import zipfile
+
+from werkzeug.utils import secure_filename
+
+logger = logging.getLogger(__name__)
+
+ZIP_EXTENSIONS = ('.zip',)
+TAR_EXTENSIONS = ('.tar', '.tar.gz', '.tgz', '.tar.bz2', '.tbz2', '.tar.xz', '.txz')
+CHUNK_SIZE = 1024 * 1024
+# Scanned pages run from about 0.1MB to 1MB each; assume the small end so estimates err high
+MB_PER_SCANNED_PAGE = 0.25
+
+
+class ArchiveError(Exception):
+    """The archive is unreadable or breaks the extraction limits"""
+
+
+class ArchiveLimits:
+    """Bounds on what one archive may expand to"""
+
+    def __init__(self, max_members=2000, max_member_bytes=1536 * 1024 * 1024,
+                 max_total_bytes=4096 * 1024 * 1024, max_ratio=100):
+        self.max_members = max_members
+        self.max_member_bytes = max_member_bytes
+        self.max_total_bytes = max_total_bytes
+        self.max_ratio = max_ratio
+
+
+def is_archive(filename):
+    """Return True if the file name looks like a ZIP or TAR archive"""
+    name = filename.lower()
+    return name.endswith(ZIP_EXTENSIONS) or name.endswith(TAR_EXTENSIONS)
+
+
+def declared_size(archive_path, extensions=('.pdf',)):
+    """Uncompressed bytes of the documents the archive says it holds (ZIP), or its own size if unknown (TAR)"""
+    if archive_path.lower().endswith(ZIP_EXTENSIONS):
+        try:
+            with zipfile.ZipFile(archive_path) as zf:
+                return sum(info.file_size for info in zf.infolist()
+                           if not info.is_dir() and info.filename.lower().endswith(extensions))
+        except zipfile.BadZipFile:
+            pass
+    # A compressed TAR can only be measured by decompressing it, which extraction does anyway
+    return os.path.getsize(archive_path)
+
+
+def estimate_info(archive_path, limits=None, extensions=('.pdf',)):
+    """
+    Stand-in file info for an archive that hasn't been extracted yet, for admission and quotas.
+
+    Assumes the archive is all scanned pages at the default DPI, up to what `limits` lets it expand to.
+    """
+    limits = limits or ArchiveLimits()
+    size_mb = min(declared_size(archive_path, extensions), limits.max_total_bytes) / (1024 * 1024)
+    return {
+        'name': os.path.basename(archive_path),
+        'page_count': max(1, math.ceil(size_mb / MB_PER_SCANNED_PAGE)),
+        'text_pages': 0,
+        'size_mb': round(size_mb, 2)
+    }
+
+
+def unique_name(dest_dir, member_name):
+    """Flatten a member path into a safe file name that isn't taken yet in `dest_dir`"""
+    parts = [part for part in member_name.replace('\\', '/').split('/') if part not in ('', '.', '..')]
+    base = secure_filename('_'.join(parts)) or 'document.pdf'
+    stem, ext = os.path.splitext(base)
+    name, counter = base, 1
+    while os.path.exists(os.path.join(dest_dir, name)):
+        name = f"{stem}_{counter}{ext}"
+        counter += 1
+    return name
+
+
+class _Extractor:
+    """Copies member streams to disk while enforcing the limits"""
+
+    def __init__(self, archive_path, dest_dir, limits):
+        self.archive_path = archive_path
+        self.dest_dir = dest_dir
+        self.limits = limits
+        self.members = 0
+        self.total_bytes = 0
+
+    def extract(self, member_name, stream, compressed_size=None):
+        """Write one member and return its (file name, path)"""
+        self.members += 1
+        if self.members > self.limits.max_members:
+            raise ArchiveError(f"Archive has more than {self.limits.max_members} documents")
+
+        name = unique_name(self.dest_dir, member_name)
+        path = os.path.join(self.dest_dir, name)
+        written = 0
+        try:
+            with open(path, 'wb') as out:
+                while True:
+                    chunk = stream.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    written += len(chunk)
+                    self.total_bytes += len(chunk)
+                    self._check(member_name, written, compressed_size)
+                    out.write(chunk)
+        except BaseException:
+            # Don't leave a partial member behind for the OCR queue to find
+            if os.path.exists(path):
+                os.remove(path)
+            raise
+        return name, path
+
+    def _check(self, member_name, written, compressed_size):
+        limits = self.limits
+        if written > limits.max_member_bytes:
+            raise ArchiveError(f"{member_name} expands to more than {limits.max_member_bytes // (1024 * 1024)}MB")
+        if self.total_bytes > limits.max_total_bytes:
+            raise ArchiveError(f"Archive expands to more than {limits.max_total_bytes // (1024 * 1024)}MB")
+        # Per-member ratio for ZIP; TAR compresses the stream as a whole, so check the running total
+        if compressed_size:
+            if written > compressed_size * limits.max_ratio:
+                raise ArchiveError(f"{member_name} is compressed more than {limits.max_ratio}:1")
+        elif self.total_bytes > os.path.getsize(self.archive_path) * limits.max_ratio:
+            raise ArchiveError(f"Archive is compressed more than {limits.max_ratio}:1")
+
+
+def iter_pdfs(archive_path, dest_dir, limits=None, extensions=('.pdf',)):
+    """
+    Extract the PDFs (or other files matching `extensions`) in an archive one at a time,
+    yielding (file name, path) for each.
+
+    Raises ArchiveError if the archive is corrupt or breaks `limits`; members
+    yielded before that point are complete and can be processed.
+    """
+    limits = limits or ArchiveLimits()
+    extractor = _Extractor(archive_path, dest_dir, limits)
+
+    if archive_path.lower().endswith(ZIP_EXTENSIONS):
+        try:
+            with zipfile.ZipFile(archive_path) as zf:
+                for info in zf.infolist():
+                    if info.is_dir() or not info.filename.lower().endswith(extensions):
+                        continue
+                    if info.flag_bits & 0x1:
+                        logger.warning(f"Skipping encrypted archive member {info.filename}")
+                        continue
+                    with zf.open(info) as stream:
+                        yield extractor.extract(info.filename, stream, compressed_size=max(1, info.compress_size))
+        except (zipfile.BadZipFile, zipfile.LargeZipFile, EOFError, OSError) as e:
+            raise ArchiveError(f"Could not read {os.path.basename(archive_path)}: {str(e)}")
+        return
+
+    try:
+        # Stream mode ('r|*') reads the archive front to back without seeking, whatever the compression
+        with tarfile.open(archive_path, mode='r|*') as tf:
+            for member in tf:
+                # Regular files only: no links, devices or directories
+                if not member.isreg() or not member.name.lower().endswith(extensions):
+                    continue
+                stream = tf.extractfile(member)
+                if stream is None:
+                    continue
+                yield extractor.extract(member.name, stream)
+    except (tarfile.TarError, EOFError, OSError) as e:
+        raise ArchiveError(f"Could not read {os.path.basename(archive_path)}: {str(e)}")
@@ -0,0 +1,572 @@
+#!/usr/bin/env python3
+"""
+OCR benchmark suite.
+
+Generates a deterministic synthetic PDF corpus (born-digital pages, scanned
+pages at several DPIs, mixed documents and a very large file) and runs it
+through the real process_pdfs() pipeline. Results are written as JSON so runs
+can be compared across commits.
+
+`sweep` runs the corpus once per worker x thread configuration (OCR worker
+processes, and OpenMP threads each worker's tesseract may use) and reports the
+fastest, so OCR_WORKERS and OCR_THREADS can be set to the measured optimum for
+the machine rather than guessed.
+
+Usage:
+    python benchmark.py generate --corpus bench_corpus
+    python benchmark.py run --corpus bench_corpus --output results.json
+    python benchmark.py compare baseline.json results.json
+    python benchmark.py sweep --corpus bench_corpus --output sweep.json
+"""
+
+import os
+import sys
+import io
+import json
+import time
+import random
+import shutil
+import argparse
+import hashlib
+import tempfile
+import platform
+import resource
+import subprocess
+import threading
+from abc import ABC, abstractmethod
+
+# The benchmark never touches user accounts, so keep app.py away from the real database
+os.environ.setdefault('DATABASE_URL', 'sqlite://')
+
+from PIL import Image, ImageDraw, ImageFont
+import pikepdf
+
+CORPUS_SEED = 20240611
+# Pillow stamps multi-page PDFs with the current time unless told otherwise
+CORPUS_DATE = time.strptime('2024-06-11', '%Y-%m-%d')
+
+WORDS = (
+    'plaintiff defendant exhibit deposition record medical history treatment '
+    'physician hospital report evaluation income earnings wage employer '
+    'statement account invoice payment contract agreement clause section '
+    'hereby whereas pursuant court county district motion filing order '
+    'diagnosis procedure therapy injury claim policy premium coverage date'
+).split()
+
+# Corpus profiles: how many documents of each kind to generate
+PROFILES = {
+    'quick': {
+        'born_digital': [(2, 3)],             # (documents, pages per document)
+        'scanned': {150: (1, 2), 300: (1, 2)},  # dpi -> (documents, pages)
+        'mixed': [(1, 2, 2)],                 # (documents, digital pages, scanned pages)
+        'large': [(1, 20)],                   # (documents, pages at 300 dpi)
+    },
+    'full': {
+        'born_digital': [(4, 5), (2, 40)],
+        'scanned': {150: (3, 5), 200: (3, 5), 300: (3, 5), 400: (1, 3)},
+        'mixed': [(3, 4, 4)],
+        'large': [(1, 150)],
+    },
+}
+
+
+def _sentence(rng, words=12):
+    """Build a deterministic pseudo-legal sentence"""
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+
+def _load_font(size):
+    """Load Pillow's built-in font at the requested size where supported"""
+    try:
+        return ImageFont.load_default(size=size)
+    except TypeError:
+        return ImageFont.load_default()
+
+
+def render_scanned_page(rng, dpi):
+    """Render a letter-size page image that looks like a skewed, noisy scan"""
+    width, height = int(8.5 * dpi), int(11 * dpi)
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    font = _load_font(max(10, dpi // 7))
+    line_height = max(14, dpi // 5)
+
+    y = dpi
+    while y < height - dpi:
+        draw.text((dpi, y), _sentence(rng, 9), fill=0, font=font)
+        y += line_height
+
+    # Speckle noise and a slight skew so deskew has real work to do
+    for _ in range(width * height // 4000):
+        draw.point((rng.randrange(width), rng.randrange(height)), fill=rng.randrange(0, 160))
+    return image.rotate(rng.uniform(-1.5, 1.5), fillcolor=255, expand=False)
+
+
+def write_scanned_pdf(path, rng, dpi, pages):
+    """Write a PDF made only of page images at the given DPI"""
+    images = [render_scanned_page(rng, dpi) for _ in range(pages)]
+    images[0].save(path, 'PDF', resolution=float(dpi), save_all=True,
+                   append_images=images[1:], quality=85,
+                   creationDate=CORPUS_DATE, modDate=CORPUS_DATE)
+
+
+def _text_page(pdf, rng):
+    """Create a born-digital page with a real text layer"""
+    lines = [_sentence(rng) for _ in range(40)]
+    ops = ['BT', '/F1 10 Tf', '14 TL', '72 740 Td']
+    for line in lines:
+        ops.append(f"({line}) Tj T*")
+    ops.append('ET')
+    font = pikepdf.Dictionary(
+        Type=pikepdf.Name.Font,
+        Subtype=pikepdf.Name.Type1,
+        BaseFont=pikepdf.Name.Helvetica,
+    )
+    page = pikepdf.Dictionary(
+        Type=pikepdf.Name.Page,
+        MediaBox=[0, 0, 612, 792],
+        Resources=pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font)),
+        Contents=pikepdf.Stream(pdf, '\n'.join(ops).encode('latin-1')),
+    )
+    return pikepdf.Page(page)
+
+
+def write_born_digital_pdf(path, rng, pages):
+    """Write a PDF whose pages already contain text"""
+    pdf = pikepdf.new()
+    for _ in range(pages):
+        pdf.pages.append(_text_page(pdf, rng))
+    pdf.save(path, deterministic_id=True)
+
+
+def write_mixed_pdf(path, rng, digital_pages, scanned_pages, dpi=200):
+    """Write a PDF interleaving born-digital and scanned pages"""
+    buffer = io.BytesIO()
+    images = [render_scanned_page(rng, dpi) for _ in range(scanned_pages)]
+    images[0].save(buffer, 'PDF', resolution=float(dpi), save_all=True,
+                   append_images=images[1:], quality=85,
+                   creationDate=CORPUS_DATE, modDate=CORPUS_DATE)
+    buffer.seek(0)
+
+    pdf = pikepdf.new()
+    with pikepdf.open(buffer) as scanned:
+        for idx in range(max(digital_pages, scanned_pages)):
+            if idx < digital_pages:
+                pdf.pages.append(_text_page(pdf, rng))
+            if idx < scanned_pages:
+                pdf.pages.append(scanned.pages[idx])
+        pdf.save(path, deterministic_id=True)
+
+
+def generate_corpus(corpus_dir, profile='quick', seed=CORPUS_SEED):
+    """Generate the synthetic corpus and a manifest describing it"""
+    spec = PROFILES[profile]
+    rng = random.Random(seed)
+    os.makedirs(corpus_dir, exist_ok=True)
+    documents = []
+
+    def add(name, kind, pages, dpi=None):
+        path = os.path.join(corpus_dir, name)
+        documents.append({'name': name, 'kind': kind, 'pages': pages, 'dpi': dpi, 'path': path})
+        return path
+
+    for count, pages in spec['born_digital']:
+        for n in range(count):
+            write_born_digital_pdf(add(f'born_digital_{pages}p_{n}.pdf', 'born_digital', pages), rng, pages)
+
+    for dpi, (count, pages) in sorted(spec['scanned'].items()):
+        for n in range(count):
+            write_scanned_pdf(add(f'scanned_{dpi}dpi_{pages}p_{n}.pdf', 'scanned', pages, dpi), rng, dpi, pages)
+
+    for count, digital_pages, scanned_pages in spec['mixed']:
+        for n in range(count):
+            pages = digital_pages + scanned_pages
+            write_mixed_pdf(add(f'mixed_{pages}p_{n}.pdf', 'mixed', pages, 200), rng, digital_pages, scanned_pages)
+
+    for count, pages in spec['large']:
+        for n in range(count):
+            write_scanned_pdf(add(f'large_300dpi_{pages}p_{n}.pdf', 'large', pages, 300), rng, 300, pages)
+
+    for doc in documents:
+        doc['bytes'] = os.path.getsize(doc.pop('path'))
+        with open(os.path.join(corpus_dir, doc['name']), 'rb') as f:
+            doc['sha256'] = hashlib.sha256(f.read()).hexdigest()
+
+    manifest = {'profile': profile, 'seed': seed, 'documents': documents}
+    with open(os.path.join(corpus_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    print(f"Generated {len(documents)} documents in {corpus_dir}")
+    return manifest
+
+
+def manifest_bytes(manifest):
+    """Total size of the corpus described by a manifest"""
+    return sum(doc['bytes'] for doc in manifest['documents'])
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return 0
+    ordered = sorted(values)
+    rank = max(1, int(round(pct / 100.0 * len(ordered))))
+    return ordered[min(rank, len(ordered)) - 1]
+
+
+class Sampler(ABC):
+    """Call sample() every `interval` seconds on a background thread while the block runs, and once at the end"""
+
+    def __init__(self, interval=0.2):
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    @abstractmethod
+    def sample(self):
+        """Take one measurement"""
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.sample()
+
+
+class DiskHighWaterMark(Sampler):
+    """Sample disk usage of the filesystems the pipeline writes to"""
+
+    def __init__(self, paths, interval=0.2):
+        super().__init__(interval)
+        self.paths = {}
+        for path in paths:
+            os.makedirs(path, exist_ok=True)
+            self.paths.setdefault(os.stat(path).st_dev, path)
+        self.baseline = {dev: shutil.disk_usage(p).used for dev, p in self.paths.items()}
+        self.peak_bytes = 0
+
+    def sample(self):
+        used = sum(shutil.disk_usage(p).used - self.baseline[dev] for dev, p in self.paths.items())
+        self.peak_bytes = max(self.peak_bytes, used)
+
+
+def descendant_pids(pid):
+    """PIDs of every live process below `pid` (pool workers, OCR children, tesseract and ghostscript)"""
+    children = {}
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f'/proc/{entry}/stat') as f:
+                # The command name is in parentheses and may contain spaces; the parent PID follows it
+                ppid = int(f.read().rsplit(')', 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+        children.setdefault(ppid, []).append(int(entry))
+    found, pending = [], [pid]
+    while pending:
+        for child in children.get(pending.pop(), []):
+            found.append(child)
+            pending.append(child)
+    return found
+
+
+def peak_rss_kb(pid):
+    """A process's own peak resident set size (VmHWM), or 0 if it is gone"""
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return 0
+
+
+class WorkerPeakRss(Sampler):
+    """
+    Largest peak RSS of any process this one starts while the block runs.
+
+    RUSAGE_CHILDREN can't be used per run: it is the largest child the process has ever had,
+    so in a sweep every configuration after the first would report the worst one so far.
+    Needs /proc; elsewhere `available` is False and nothing is sampled.
+    """
+
+    def __init__(self, interval=0.2):
+        super().__init__(interval)
+        self.available = os.path.isdir('/proc')
+        self.peak_kb = 0
+
+    def sample(self):
+        if not self.available:
+            return
+        for pid in descendant_pids(os.getpid()):
+            self.peak_kb = max(self.peak_kb, peak_rss_kb(pid))
+
+
+def git_commit():
+    """Return the current commit hash, if this is a git checkout"""
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run_benchmark(corpus_dir, max_workers=None, warm_cache=False, threads=None):
+    """Run the corpus through process_pdfs() and collect metrics"""
+    import app as ocr_app
+    import ocrmypdf
+    from scratch import ScratchSpace
+
+    # Settings changed for this run only, and put back when it ends
+    saved_config = {key: ocr_app.app.config[key] for key in ('OCR_THREADS', 'CACHE_FOLDER')}
+    # Read by the pool initializer (OpenMP threads) and ghostscript when the run's workers start
+    if threads is not None:
+        ocr_app.app.config['OCR_THREADS'] = threads
+    ocr_threads = ocr_app.app.config['OCR_THREADS']
+
+    with open(os.path.join(corpus_dir, 'manifest.json')) as f:
+        manifest = json.load(f)
+    pages_by_name = {doc['name']: doc['pages'] for doc in manifest['documents']}
+
+    work_dir = tempfile.mkdtemp(prefix='ocr_bench_')
+    input_dir = os.path.join(work_dir, 'input')
+    os.makedirs(input_dir)
+    for doc in manifest['documents']:
+        shutil.copy2(os.path.join(corpus_dir, doc['name']), os.path.join(input_dir, doc['name']))
+
+    scratch = None
+    try:
+        # A cold cache by default so every run measures real OCR work
+        if not warm_cache:
+            ocr_app.app.config['CACHE_FOLDER'] = os.path.join(work_dir, 'cache')
+            os.makedirs(ocr_app.app.config['CACHE_FOLDER'])
+
+        # Scratch sits next to the cache in use so outputs can be hardlinked into it, as in the app
+        scratch = ScratchSpace(
+            'benchmark',
+            root=os.path.join(ocr_app.app.config['CACHE_FOLDER'], '.scratch'),
+            tmpfs_root=ocr_app.app.config['SCRATCH_TMPFS'],
+            expected_bytes=manifest_bytes(manifest)
+        )
+        watched = [tempfile.gettempdir(), ocr_app.app.config['UPLOAD_FOLDER'], ocr_app.app.config['CACHE_FOLDER']]
+        if os.path.isdir(ocr_app.app.config['SCRATCH_TMPFS'] or ''):
+            watched.append(ocr_app.app.config['SCRATCH_TMPFS'])
+        with DiskHighWaterMark(watched) as disk, WorkerPeakRss() as workers:
+            started = time.perf_counter()
+            processed_files, output_dir, errors, results, stats = ocr_app.process_pdfs(
+                input_dir, max_workers=max_workers, scratch=scratch)
+            wall_seconds = time.perf_counter() - started
+    finally:
+        if scratch is not None:
+            scratch.cleanup()
+        shutil.rmtree(work_dir, ignore_errors=True)
+        # Later runs in the same process, a sweep's next configuration included, start from the app's settings
+        ocr_app.app.config.update(saved_config)
+
+    latencies = [r['elapsed_seconds'] for r in results]
+    total_pages = sum(pages_by_name.get(r['filename'], 0) for r in results)
+    # ru_maxrss is reported in kilobytes on Linux and bytes on macOS
+    rss_divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'environment': {
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'ocrmypdf': ocrmypdf.__version__,
+        },
+        'corpus': {
+            'profile': manifest['profile'],
+            'seed': manifest['seed'],
+            'files': len(manifest['documents']),
+            'pages': sum(pages_by_name.values()),
+            'bytes': manifest_bytes(manifest),
+        },
+        'warm_cache': warm_cache,
+        'cpu_cores': stats.get('cpu_cores'),
+        'ocr_threads': ocr_threads,
+        'wall_seconds': round(wall_seconds, 3),
+        'pages_per_second': round(total_pages / wall_seconds, 3) if wall_seconds else 0,
+        'latency_p50_seconds': percentile(latencies, 50),
+        'latency_p95_seconds': percentile(latencies, 95),
+        'peak_rss_mb': {
+            'parent': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / rss_divisor, 1),
+            # Without /proc, the largest child so far stands in; right for a single run, not for a sweep
+            'workers': round(workers.peak_kb / 1024 if workers.available else
+                             resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / rss_divisor, 1),
+        },
+        'disk_high_water_mb': round(disk.peak_bytes / (1024 * 1024), 1),
+        'errors': errors,
+        'files': [
+            {
+                'filename': r['filename'],
+                'pages': pages_by_name.get(r['filename'], 0),
+                'elapsed_seconds': r['elapsed_seconds'],
+                'from_cache': r.get('from_cache', False),
+                'optimized': r.get('optimized', False),
+                'error': r.get('error'),
+            }
+            for r in sorted(results, key=lambda r: r['filename'])
+        ],
+    }
+
+
+def sweep_configs(cpus):
+    """
+    Worker x thread configurations to try on `cpus` cores: each power-of-two
+    worker count with the cores split between them, plus every worker getting
+    every core (what tesseract does when nothing limits it)
+    """
+    configs = []
+    workers = 1
+    while workers < cpus:
+        configs.append((workers, max(1, cpus // workers)))
+        workers *= 2
+    configs.append((cpus, 1))
+    if cpus > 1:
+        configs.append((cpus, cpus))
+    return configs
+
+
+def parse_configs(value):
+    """Parse "4x1,2x2" into [(4, 1), (2, 2)]"""
+    configs = []
+    for part in value.split(','):
+        workers, _, threads = part.strip().lower().partition('x')
+        configs.append((int(workers), int(threads or 1)))
+    return configs
+
+
+def run_sweep(corpus_dir, configs=None, warm_cache=False):
+    """Benchmark each worker x thread configuration and report the fastest"""
+    import resources
+
+    cpus = resources.cpu_limit()
+    configs = configs or sweep_configs(cpus)
+    runs = []
+    for workers, threads in configs:
+        print(f"Running {workers} workers x {threads} threads...", file=sys.stderr)
+        report = run_benchmark(corpus_dir, max_workers=workers, warm_cache=warm_cache, threads=threads)
+        runs.append({
+            'workers': workers,
+            'threads': threads,
+            'pages_per_second': report['pages_per_second'],
+            'wall_seconds': report['wall_seconds'],
+            'latency_p95_seconds': report['latency_p95_seconds'],
+            'peak_rss_mb': report['peak_rss_mb']['workers'],
+            'errors': len(report['errors'] or []),
+        })
+    best = max(runs, key=lambda run: run['pages_per_second'])
+    return {
+        'commit': git_commit(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'cpus': cpus,
+        'warm_cache': warm_cache,
+        'runs': runs,
+        'best': {'OCR_WORKERS': best['workers'], 'OCR_THREADS': best['threads']},
+    }
+
+
+def print_sweep(sweep):
+    print(f"{'workers':>8}{'threads':>8}{'pages/s':>10}{'wall s':>10}{'p95 s':>10}{'errors':>8}")
+    for run in sweep['runs']:
+        print(f"{run['workers']:>8}{run['threads']:>8}{run['pages_per_second']:>10}{run['wall_seconds']:>10}"
+              f"{run['latency_p95_seconds']:>10}{run['errors']:>8}")
+    best = sweep['best']
+    print(f"Fastest on {sweep['cpus']} cores: OCR_WORKERS={best['OCR_WORKERS']} OCR_THREADS={best['OCR_THREADS']}")
+
+
+def compare_results(baseline_path, candidate_path):
+    """Print the change in headline metrics between two result files"""
+    with open(baseline_path) as f:
+        baseline = json.load(f)
+    with open(candidate_path) as f:
+        candidate = json.load(f)
+
+    if baseline['corpus'] != candidate['corpus']:
+        print("Warning: the two runs used different corpora")
+
+    metrics = [
+        ('pages_per_second', lambda r: r['pages_per_second']),
+        ('latency_p50_seconds', lambda r: r['latency_p50_seconds']),
+        ('latency_p95_seconds', lambda r: r['latency_p95_seconds']),
+        ('peak_rss_mb.workers', lambda r: r['peak_rss_mb']['workers']),
+        ('disk_high_water_mb', lambda r: r['disk_high_water_mb']),
+    ]
+    print(f"{'metric':<24}{'baseline':>12}{'candidate':>12}{'change':>10}")
+    for name, get in metrics:
+        old, new = get(baseline), get(candidate)
+        change = f"{(new - old) / old * 100:+.1f}%" if old else 'n/a'
+        print(f"{name:<24}{old:>12}{new:>12}{change:>10}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the OCR pipeline on a synthetic corpus')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    gen = sub.add_parser('generate', help='Generate the synthetic corpus')
+    gen.add_argument('--corpus', default='bench_corpus', help='Directory to write the corpus to')
+    gen.add_argument('--profile', choices=sorted(PROFILES), default='quick')
+    gen.add_argument('--seed', type=int, default=CORPUS_SEED)
+
+    run = sub.add_parser('run', help='Run the pipeline over a corpus and report metrics')
+    run.add_argument('--corpus', default='bench_corpus', help='Corpus directory (generated if missing)')
+    run.add_argument('--profile', choices=sorted(PROFILES), default='quick',
+                     help='Profile used when the corpus has to be generated')
+    run.add_argument('--workers', type=int, default=None, help='Override the number of OCR worker processes')
+    run.add_argument('--warm-cache', action='store_true', help='Use the shared OCR cache instead of a cold one')
+    run.add_argument('--output', help='Write the JSON report to this file instead of stdout')
+
+    cmp_parser = sub.add_parser('compare', help='Compare two JSON reports')
+    cmp_parser.add_argument('baseline')
+    cmp_parser.add_argument('candidate')
+
+    sweep = sub.add_parser('sweep', help='Find the fastest OCR worker x thread configuration')
+    sweep.add_argument('--corpus', default='bench_corpus', help='Corpus directory (generated if missing)')
+    sweep.add_argument('--profile', choices=sorted(PROFILES), default='quick',
+                       help='Profile used when the corpus has to be generated')
+    sweep.add_argument('--configs', type=parse_configs, default=None, metavar='WxT,...',
+                       help='Configurations to try, e.g. 4x1,2x2,1x4 (default: derived from the CPU limit)')
+    sweep.add_argument('--warm-cache', action='store_true', help='Use the shared OCR cache instead of a cold one')
+    sweep.add_argument('--output', help='Also write the JSON report to this file')
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'generate':
+        generate_corpus(args.corpus, args.profile, args.seed)
+    elif args.command == 'run':
+        if not os.path.exists(os.path.join(args.corpus, 'manifest.json')):
+            generate_corpus(args.corpus, args.profile)
+        report = run_benchmark(args.corpus, max_workers=args.workers, warm_cache=args.warm_cache)
+        payload = json.dumps(report, indent=2)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(payload + '\n')
+            print(f"Wrote benchmark report to {args.output}")
+        else:
+            print(payload)
+    elif args.command == 'compare':
+        compare_results(args.baseline, args.candidate)
+    elif args.command == 'sweep':
+        if not os.path.exists(os.path.join(args.corpus, 'manifest.json')):
+            generate_corpus(args.corpus, args.profile)
+        report = run_sweep(args.corpus, configs=args.configs, warm_cache=args.warm_cache)
+        print_sweep(report)
+        if args.output:
+            with open(args.output, 'w') as f:
+                f.write(json.dumps(report, indent=2) + '\n')
+            print(f"Wrote sweep report to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Adaptive OCR concurrency.
+
+The worker pool is sized for the CPUs the container may use, but how many of
+those workers can run at once depends on memory: a high-resolution scan OCR'd
+with max_image_mpixels=0 can need gigabytes, while a small scan needs a few
+hundred megabytes. Each task carries a peak memory estimate, and a task only
+starts when the estimates of the tasks already running plus its own fit in
+the memory budget. The budget and the CPU limit are re-read while jobs run,
+so concurrency grows when memory frees up or the container gets more CPU,
+and shrinks when something else takes it.
+
+The budget is capped by this process's share of the container's memory
+limit (less a reserve, split between the gunicorn workers, each of which
+runs its own pool), which is also re-read, so a resized container or a
+different worker count takes effect without a restart.
+"""
+
+import time
+import threading
+import logging
+
+from resources import available_memory_mb, cpu_limit, memory_limit_mb, web_workers
+
+logger = logging.getLogger(__name__)
+
+
+class AdaptiveConcurrency:
+    """Decides whether another OCR task can start, from live CPU and memory limits"""
+
+    def __init__(self, max_slots, reserve_mb=512, refresh_seconds=2.0, processes=None):
+        self.max_slots = max(1, max_slots)
+        self.reserve_mb = reserve_mb
+        self.refresh_seconds = refresh_seconds
+        # How many pools share the memory limit; web_workers() when None, re-read with the limits
+        self.processes = processes
+        self._lock = threading.Lock()
+        self._checked_at = 0
+        self._cpu_slots = self.max_slots
+        self._available_mb = None
+        self._capacity_mb = None
+
+    def _read_available(self):
+        available = available_memory_mb()
+        return None if available is None else max(0, available - self.reserve_mb)
+
+    def _read_capacity(self):
+        # Running tasks may not have allocated their rasters yet, so their estimates are always
+        # counted against this share of the limit, never against the live reading alone
+        limit = memory_limit_mb()
+        if limit is None:
+            return None
+        processes = self.processes or web_workers()
+        return max(0, limit - self.reserve_mb) / max(1, processes)
+
+    def _refresh(self):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._checked_at < self.refresh_seconds:
+                return
+            self._checked_at = now
+            cpu_slots = min(self.max_slots, cpu_limit())
+            if cpu_slots != self._cpu_slots:
+                logger.info(f"OCR concurrency limit changed from {self._cpu_slots} to {cpu_slots} CPUs")
+            self._cpu_slots = cpu_slots
+            self._available_mb = self._read_available()
+            self._capacity_mb = self._read_capacity()
+
+    def slots(self):
+        """Return how many tasks may run at once, as far as CPU is concerned"""
+        self._refresh()
+        return self._cpu_slots
+
+    def memory_budget_mb(self, in_flight_mb):
+        """Return the memory OCR tasks may use in total, or None if it can't be measured"""
+        self._refresh()
+        if self._available_mb is None:
+            return self._capacity_mb
+        # The live reading already excludes whatever running tasks have allocated, so add their estimates back
+        budget = self._available_mb + in_flight_mb
+        return budget if self._capacity_mb is None else min(budget, self._capacity_mb)
+
+    def can_start(self, in_flight, in_flight_mb, task_mb):
+        """Return True if a task estimated at `task_mb` may start next to the running ones"""
+        if in_flight == 0:
+            # A task that needs more than the whole budget still runs, alone
+            return True
+        if in_flight >= self.slots():
+            return False
+        budget = self.memory_budget_mb(in_flight_mb)
+        return budget is None or in_flight_mb + task_mb <= budget
+
+    def snapshot(self):
+        """Current limits, for status reporting"""
+        self._refresh()
+        return {
+            'cpu_slots': self._cpu_slots,
+            'available_mb': None if self._available_mb is None else round(self._available_mb),
+            'capacity_mb': None if self._capacity_mb is None else round(self._capacity_mb)
+        }
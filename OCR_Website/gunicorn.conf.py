@@ -0,0 +1,12 @@
+"""Gunicorn settings, sized from the container's CPU and memory limits (see resources.py)"""
+
+import os
+
+import resources
+
+bind = os.environ.get('BIND', '0.0.0.0:5000')
+workers = resources.web_workers()
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '300'))
+
+# Workers import the app after this file runs; they read the count to size their OCR pools
+os.environ['WEB_CONCURRENCY'] = str(workers)
@@ -0,0 +1,154 @@
+"""
+Conversion of scanned images (TIFF, JPEG, PNG) to PDF for OCR.
+
+Multi-page TIFFs are converted lazily, one frame per task: each task opens
+the file, seeks to its own frame and writes it as a one-page PDF, so a worker
+only ever holds one decoded frame however many pages the scan has, and the
+frames of a long scan are converted in parallel. The pages are then merged in
+order with pikepdf.
+
+JPEGs and bilevel (fax-compressed) frames are embedded by img2pdf without
+re-encoding; other frames are stored losslessly. The output has no dates and
+a fixed document ID, so the same image always converts to the same PDF and
+hits the OCR cache on a repeat upload.
+"""
+
+import io
+import os
+import shutil
+import logging
+import tempfile
+
+import img2pdf
+import pikepdf
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+IMAGE_EXTENSIONS = ('.tif', '.tiff', '.jpg', '.jpeg', '.png')
+# Scanners that don't record a resolution almost always scanned at 300 DPI
+DEFAULT_DPI = 300
+
+
+class ImageConversionError(Exception):
+    """The image couldn't be read or converted to PDF"""
+
+
+def is_image(filename):
+    """Return True if the file name looks like an image we can convert"""
+    return filename.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def pdf_name(filename):
+    """The PDF file name an image is converted to"""
+    return os.path.splitext(filename)[0] + '.pdf'
+
+
+def _frame_dpi(image):
+    dpi = image.info.get('dpi')
+    try:
+        x_dpi, y_dpi = (round(float(value)) for value in dpi)
+    except (TypeError, ValueError):
+        return DEFAULT_DPI, DEFAULT_DPI
+    # Some writers store 1x1 or 72x72 placeholders rather than the real scan resolution
+    if x_dpi <= 72 or y_dpi <= 72:
+        return DEFAULT_DPI, DEFAULT_DPI
+    return x_dpi, y_dpi
+
+
+def describe(image_path):
+    """Frame count, resolution and page size of an image, without decoding any pixels"""
+    try:
+        with Image.open(image_path) as image:
+            x_dpi, y_dpi = _frame_dpi(image)
+            return {
+                'frames': getattr(image, 'n_frames', 1),
+                'dpi': max(x_dpi, y_dpi),
+                'page_size_in': (image.width / x_dpi, image.height / y_dpi)
+            }
+    except (OSError, ValueError, Image.DecompressionBombError) as e:
+        raise ImageConversionError(f"Could not read {os.path.basename(image_path)}: {str(e)}")
+
+
+def convert_frame(image_path, index, output_path):
+    """Write frame `index` of an image as a one-page PDF; runs in a worker process"""
+    dpi_layout = None
+    with Image.open(image_path) as image:
+        image.seek(index)
+        dpi = _frame_dpi(image)
+        if image.format == 'JPEG':
+            # Embedded as-is; only the resolution may need overriding
+            data = None
+            if dpi != tuple(round(float(v)) for v in image.info.get('dpi', (0, 0))):
+                dpi_layout = img2pdf.get_fixed_dpi_layout_fun(dpi)
+        else:
+            frame = image
+            if frame.mode in ('RGBA', 'LA', 'PA') or (frame.mode == 'P' and 'transparency' in frame.info):
+                # PDF pages have no transparency; flatten onto white paper
+                frame = frame.convert('RGBA')
+                background = Image.new('RGB', frame.size, 'white')
+                background.paste(frame, mask=frame.getchannel('A'))
+                frame = background
+            elif frame.mode not in ('1', 'L', 'RGB', 'CMYK', 'P'):
+                frame = frame.convert('RGB')
+
+            data = io.BytesIO()
+            if frame.mode == '1':
+                frame.save(data, format='TIFF', compression='group4', dpi=dpi)
+            elif frame.mode == 'CMYK':
+                frame.save(data, format='TIFF', compression='tiff_adobe_deflate', dpi=dpi)
+            else:
+                frame.save(data, format='PNG', dpi=dpi)
+            data = data.getvalue()
+
+    options = {'nodate': True}
+    if dpi_layout is not None:
+        options['layout_fun'] = dpi_layout
+    with open(output_path, 'wb') as out:
+        img2pdf.convert(data if data is not None else image_path, outputstream=out, **options)
+    return output_path
+
+
+def merge_pages(page_paths, output_path):
+    """Concatenate one-page PDFs, in order, into `output_path`"""
+    with pikepdf.Pdf.new() as merged:
+        sources = []
+        try:
+            for path in page_paths:
+                source = pikepdf.Pdf.open(path)
+                sources.append(source)
+                merged.pages.extend(source.pages)
+            merged.save(output_path, deterministic_id=True)
+        finally:
+            for source in sources:
+                source.close()
+
+
+def image_to_pdf(image_path, output_path, submit=None, work_dir=None):
+    """
+    Convert an image to a PDF at `output_path`, one page per frame.
+
+    `submit(fn, *args)` runs a frame conversion and returns a Future; pass a
+    pool's submit to convert frames in parallel. Without it frames are
+    converted one after another in this process.
+    """
+    frames = describe(image_path)['frames']
+    frame_dir = tempfile.mkdtemp(prefix='frames_', dir=work_dir)
+    try:
+        frame_paths = [os.path.join(frame_dir, f'{index:05d}.pdf') for index in range(frames)]
+        if submit is None:
+            for index, path in enumerate(frame_paths):
+                convert_frame(image_path, index, path)
+        else:
+            futures = [submit(convert_frame, image_path, index, path) for index, path in enumerate(frame_paths)]
+            for future in futures:
+                future.result()
+        merge_pages(frame_paths, output_path)
+    except ImageConversionError:
+        raise
+    except Exception as e:
+        raise ImageConversionError(f"Could not convert {os.path.basename(image_path)}: {str(e)}")
+    finally:
+        shutil.rmtree(frame_dir, ignore_errors=True)
+    logger.info(f"Converted {os.path.basename(image_path)} to a {frames}-page PDF")
+    return frames
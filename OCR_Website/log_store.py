@@ -0,0 +1,90 @@
+"""
+Structured in-memory log store.
+
+Entries live in a bounded global ring buffer and in a bounded per-job index,
+both keyed by a monotonically increasing sequence number. Clients poll with
+the last sequence number they have seen and only receive newer entries.
+"""
+
+import threading
+import time
+from collections import deque, OrderedDict
+from contextlib import contextmanager
+
+_job_context = threading.local()
+
+
+def current_job_id():
+    """Return the job ID bound to the current thread, if any"""
+    return getattr(_job_context, 'job_id', None)
+
+
+def set_current_job(job_id):
+    """Bind a job ID to the current thread until it is replaced or cleared"""
+    _job_context.job_id = job_id
+
+
+@contextmanager
+def bind_job(job_id):
+    """Tag every log record emitted by this thread with a job ID"""
+    previous = current_job_id()
+    _job_context.job_id = job_id
+    try:
+        yield
+    finally:
+        _job_context.job_id = previous
+
+
+class LogStore:
+    """Bounded log store indexed by sequence number and job ID"""
+
+    def __init__(self, maxlen=1000, per_job_maxlen=500, max_jobs=50):
+        self._entries = deque(maxlen=maxlen)
+        self._jobs = OrderedDict()
+        self._per_job_maxlen = per_job_maxlen
+        self._max_jobs = max_jobs
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    @property
+    def last_seq(self):
+        return self._seq
+
+    def append(self, level, message, job_id=None, created=None):
+        """Store a log entry and return it"""
+        with self._lock:
+            self._seq += 1
+            entry = {
+                'seq': self._seq,
+                'timestamp': time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(created or time.time())),
+                'level': level,
+                'message': message,
+                'job_id': job_id
+            }
+            self._entries.append(entry)
+
+            if job_id is not None:
+                job_entries = self._jobs.get(job_id)
+                if job_entries is None:
+                    job_entries = self._jobs[job_id] = deque(maxlen=self._per_job_maxlen)
+                    # Forget the least recently active job once too many are tracked
+                    while len(self._jobs) > self._max_jobs:
+                        self._jobs.popitem(last=False)
+                else:
+                    self._jobs.move_to_end(job_id)
+                job_entries.append(entry)
+            return entry
+
+    def since(self, after=0, job_id=None, limit=500):
+        """Return entries newer than `after`, optionally restricted to one job"""
+        with self._lock:
+            source = self._entries if job_id is None else self._jobs.get(job_id, ())
+            newer = []
+            # Entries are stored in sequence order, so walk back only as far as needed
+            for entry in reversed(source):
+                if entry['seq'] <= after:
+                    break
+                newer.append(entry)
+            newer.reverse()
+            return newer[:limit]
+
@@ -0,0 +1,88 @@
+"""
+Page-based metering in compute units.
+
+One compute unit is one scanned page OCR'd at 300 DPI; other resolutions
+scale with the number of pixels. Quotes are worst-case: every page is priced
+as if it needs OCR. When a job settles, files served from the cache and pages
+that already carry text (which skip_text passes through untouched) are
+refunded.
+"""
+
+import math
+
+import PyPDF2
+
+UNIT_DPI = 300
+# Low-resolution scans still pay for rasterizing, deskew and OCR setup
+MIN_PAGE_UNITS = 0.25
+# Cap, so one very high resolution scan isn't priced above four 300 DPI pages
+MAX_PAGE_UNITS = 4.0
+UNITS_PER_CREDIT = 1.0
+
+
+def inspect_pdf(pdf_path):
+    """Return (page_count, text_pages) for a PDF; pages with fonts already have a text layer"""
+    with open(pdf_path, 'rb') as f:
+        reader = PyPDF2.PdfReader(f)
+        text_pages = 0
+        for page in reader.pages:
+            try:
+                resources = page.get('/Resources')
+                if resources and resources.get_object().get('/Font'):
+                    text_pages += 1
+            except Exception:
+                pass
+        return len(reader.pages), text_pages
+
+
+def page_units(dpi):
+    """Compute units for one scanned page at the given image resolution"""
+    if not dpi:
+        dpi = UNIT_DPI
+    return min(MAX_PAGE_UNITS, max(MIN_PAGE_UNITS, (dpi / UNIT_DPI) ** 2))
+
+
+def file_units(info, scanned_only=False):
+    """Compute units for one file; `info` has 'page_count', 'text_pages' and 'dpi'"""
+    pages = info.get('page_count', 0)
+    if scanned_only:
+        pages -= min(pages, info.get('text_pages', 0))
+    return pages * page_units(info.get('dpi'))
+
+
+def units_to_credits(units):
+    return int(math.ceil(round(units / UNITS_PER_CREDIT, 6)))
+
+
+def quote(files):
+    """Pre-flight quote for a list of file infos: the most a job can cost, and the likely cost"""
+    max_units = sum(file_units(info) for info in files)
+    expected_units = sum(file_units(info, scanned_only=True) for info in files)
+    return {
+        'files': len(files),
+        'pages': sum(info.get('page_count', 0) for info in files),
+        'text_pages': sum(info.get('text_pages', 0) for info in files),
+        'max_units': round(max_units, 2),
+        'expected_units': round(expected_units, 2),
+        'max_credits': units_to_credits(max_units),
+        'expected_credits': units_to_credits(expected_units)
+    }
+
+
+def charged_units(info, from_cache=False, prior_ocr=False, failed=False, ocr_pages=None):
+    """
+    Units actually charged for a processed file, after refunds.
+
+    `ocr_pages` is given for a file OCR'd in chunks: only the pages of chunks that succeeded are
+    charged, each with its share of the file's scanned pages, even if other chunks failed.
+    """
+    if from_cache or prior_ocr:
+        # Cache hits cost nothing to serve, born-digital files aren't OCR'd
+        return 0.0
+    if ocr_pages is not None:
+        pages = info.get('page_count', 0)
+        return file_units(info, scanned_only=True) * min(ocr_pages, pages) / pages if pages else 0.0
+    if failed:
+        # Failures are passed through
+        return 0.0
+    return file_units(info, scanned_only=True)
@@ -0,0 +1,373 @@
+#!/usr/bin/env python3
+"""
+Batch OCR from the command line.
+
+Walks a directory tree and runs every PDF through the same cache, optimize
+and OCR pipeline as the web app (pipeline.py, on the fair-share
+scheduler), writing the results to a mirrored tree under the output
+directory. Per-file results are appended to a JSONL file as they finish; the
+same file is the resume manifest, so an interrupted run picks up where it
+stopped and files already done are skipped. TIFF, JPEG and PNG scans are
+converted to PDF first (see images.py) and written out as .pdf.
+
+With --watch it keeps running as a daemon and processes each PDF dropped
+into the input tree once the file has stopped changing (see watch_folder.py).
+
+Usage:
+    python ocr_cli.py /data/scans /data/ocr --workers 4
+    python ocr_cli.py /data/scans /data/ocr --mode pdf --results nightly.jsonl
+    python ocr_cli.py /srv/dropbox /srv/dropbox-ocr --watch
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import tempfile
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+
+RESULTS_NAME = 'ocr_results.jsonl'
+# PDFs, and scanned images to convert to PDF first
+DOCUMENT_EXTENSIONS = ('.pdf', '.tif', '.tiff', '.jpg', '.jpeg', '.png')
+# Files queued ahead of the workers; enough to keep them busy without hashing the whole tree up front
+QUEUE_AHEAD_PER_WORKER = 2
+# The web app's cache, so files it has already OCR'd are hits here too (and the other way round)
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'ocr_cache')
+
+
+def ignore_interrupts():
+    """Pool initializer: Ctrl+C reaches the whole process group, but only the parent should handle it"""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+def discover(input_dir):
+    """Yield the relative paths of the PDFs and images under `input_dir`, in a stable order"""
+    for dirpath, dirnames, filenames in os.walk(input_dir):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(DOCUMENT_EXTENSIONS):
+                yield os.path.relpath(os.path.join(dirpath, name), input_dir)
+
+
+def load_manifest(results_path):
+    """Return {relative path: record} for the files a previous run finished without error"""
+    done = {}
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path) as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A run killed mid-write leaves a partial last line
+                continue
+            if record.get('status') in ('ok', 'prior_ocr', 'cached'):
+                done[record['path']] = record
+            else:
+                done.pop(record.get('path'), None)
+    return done
+
+
+def end_partial_line(results_path):
+    """Terminate a record left half-written by a killed run, so the next one starts on its own line"""
+    try:
+        with open(results_path, 'rb+') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b'\n':
+                f.write(b'\n')
+    except FileNotFoundError:
+        pass
+
+
+def is_unchanged(record, stat):
+    return record.get('size') == stat.st_size and record.get('mtime') == int(stat.st_mtime)
+
+
+def file_status(result):
+    if result.get('prior_ocr'):
+        return 'prior_ocr'
+    if result.get('error'):
+        # The original was passed through so the output tree stays complete
+        return 'failed'
+    return 'cached' if result.get('from_cache') else 'ok'
+
+
+class BatchPipeline:
+    """Queues files with the OCR scheduler and records each result in the JSONL manifest"""
+
+    def __init__(self, output_dir, workers=None, output_mode=None, results_path=None, resume=True,
+                 timeout=1800, cache_dir=None):
+        import pipeline
+        import resources
+        from concurrency import AdaptiveConcurrency
+        from scheduler import FairShareScheduler
+        from scratch import ScratchSpace
+
+        output_mode = output_mode or pipeline.DEFAULT_OUTPUT_MODE
+        if output_mode not in pipeline.OUTPUT_MODES:
+            raise ValueError(f"Unknown output mode: {output_mode}")
+        pipeline.config['CACHE_FOLDER'] = cache_dir or DEFAULT_CACHE_DIR
+        os.makedirs(pipeline.config['CACHE_FOLDER'], exist_ok=True)
+        os.makedirs(output_dir, exist_ok=True)
+
+        self.pipeline = pipeline
+        self.output_dir = output_dir
+        self.output_mode = output_mode
+        self.timeout = timeout
+        self.results_path = results_path or os.path.join(output_dir, RESULTS_NAME)
+        self.done = load_manifest(self.results_path) if resume else {}
+        # Same environment settings, and defaults, as the web app
+        self.workers = workers or int(os.environ.get('OCR_WORKERS', resources.ocr_workers()))
+        # The CLI has the machine to itself: split all the cores between its workers, unless OCR_THREADS says otherwise
+        self.threads = int(os.environ.get('OCR_THREADS') or max(1, resources.cpu_limit() // self.workers))
+        pipeline.config['OCR_THREADS'] = self.threads
+
+        concurrency = None
+        if os.environ.get('ADAPTIVE_CONCURRENCY', 'True').lower() in ['true', 'on', '1']:
+            # The CLI is the only pool on the machine, so it may budget against all of the memory limit
+            concurrency = AdaptiveConcurrency(self.workers,
+                                              reserve_mb=int(os.environ.get('ADMISSION_MEMORY_RESERVE_MB', '512')),
+                                              processes=1)
+        self.scheduler = FairShareScheduler(slots=self.workers, fast_lane_reserved=0, concurrency=concurrency,
+                                            initializer=resources.init_worker,
+                                            initargs=(self.threads, ignore_interrupts))
+        self.scratch = ScratchSpace('cli', root=os.path.join(pipeline.config['CACHE_FOLDER'], '.scratch'),
+                                    tmpfs_root=os.environ.get('SCRATCH_TMPFS', '/dev/shm'))
+        self.work_dirs = (self.scratch.hot, self.scratch.mkdir('work'))
+
+        self.pending = {}
+        self.summary = {'files': 0, 'processed': 0, 'skipped': 0, 'ok': 0, 'cached': 0, 'prior_ocr': 0,
+                        'failed': 0, 'pages': 0, 'input_bytes': 0}
+        self.started = time.perf_counter()
+        end_partial_line(self.results_path)
+        self._results = open(self.results_path, 'a')
+
+    def submit(self, input_dir, rel_path):
+        """Queue one file, unless the manifest says it is already done; returns False if skipped"""
+        from admission import estimate_image_dpi, estimate_task_memory_mb, largest_page_inches
+        from metering import inspect_pdf
+        import images
+
+        input_path = os.path.join(input_dir, rel_path)
+        stat = os.stat(input_path)
+        if rel_path in self.done and is_unchanged(self.done[rel_path], stat):
+            self.summary['skipped'] += 1
+            return False
+
+        output_path = os.path.join(self.output_dir, rel_path)
+        converted = None
+        if images.is_image(rel_path):
+            # Convert the scan first, its frames in parallel on the same pool, and OCR the PDF
+            output_path = images.pdf_name(output_path)
+            try:
+                described = images.describe(input_path)
+                memory_mb = estimate_task_memory_mb(described)
+                fd, converted = tempfile.mkstemp(suffix='.pdf', dir=self.work_dirs[1])
+                os.close(fd)
+                images.image_to_pdf(input_path, converted, work_dir=self.work_dirs[1],
+                                    submit=lambda fn, *args: self.scheduler.submit('cli', 'cli', fn, *args,
+                                                                                    memory_mb=memory_mb))
+            except images.ImageConversionError as e:
+                future = Future()
+                future.set_result({'error': str(e), 'elapsed_seconds': None})
+                self.pending[future] = (rel_path, {'path': rel_path, 'size': stat.st_size,
+                                                   'mtime': int(stat.st_mtime), 'pages': 0}, converted)
+                return True
+            pages = described['frames']
+            input_path = converted
+        else:
+            memory_mb = estimate_task_memory_mb({'dpi': estimate_image_dpi(input_path),
+                                                 'page_size_in': largest_page_inches(input_path)})
+            try:
+                pages, _ = inspect_pdf(input_path)
+            except Exception:
+                pages = 0
+
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        file_hash = self.pipeline.get_file_hash(input_path)
+        info = {'path': rel_path, 'size': stat.st_size, 'mtime': int(stat.st_mtime), 'sha256': file_hash,
+                'pages': pages}
+        # Outputs land in the user's tree, so they are copied (or reflinked), never hardlinked to inputs or the cache
+        arg = (input_path, output_path, os.path.basename(output_path), self.timeout, self.work_dirs, file_hash,
+               self.output_mode, False)
+        future = self.pipeline.submit_ocr(self.scheduler, 'cli', 'cli', arg, memory_mb=memory_mb, pages=pages or None)
+        self.pending[future] = (rel_path, info, converted)
+        return True
+
+    def fail(self, input_dir, rel_path, error):
+        """Record a file that couldn't be queued at all as failed, so it is retried on the next run"""
+        try:
+            stat = os.stat(os.path.join(input_dir, rel_path))
+            info = {'path': rel_path, 'size': stat.st_size, 'mtime': int(stat.st_mtime), 'pages': 0}
+        except OSError:
+            info = {'path': rel_path, 'size': 0, 'mtime': None, 'pages': 0}
+        future = Future()
+        future.set_result({'error': error, 'elapsed_seconds': None})
+        self.pending[future] = (rel_path, info, None)
+        self._finish(future)
+
+    def collect(self, timeout=None, max_pending=0):
+        """Record finished files, waiting (up to `timeout`) until at most `max_pending` are left"""
+        while len(self.pending) > max_pending:
+            finished, _ = wait(list(self.pending), timeout=timeout, return_when=FIRST_COMPLETED)
+            if not finished:
+                return
+            for future in finished:
+                self._finish(future)
+
+    def _finish(self, future):
+        rel_path, info, converted = self.pending.pop(future)
+        try:
+            result = future.result()
+        except Exception as e:
+            result = {'error': str(e), 'elapsed_seconds': None}
+        if converted and os.path.exists(converted):
+            os.remove(converted)
+        status = file_status(result)
+        record = dict(info, status=status, output=result.get('output_path') or os.path.join(self.output_dir, rel_path),
+                      error=result.get('error') if status == 'failed' else None,
+                      optimized=result.get('optimized', False),
+                      elapsed_seconds=result.get('elapsed_seconds'),
+                      finished_at=time.strftime('%Y-%m-%dT%H:%M:%S'))
+        self._results.write(json.dumps(record) + '\n')
+        self._results.flush()
+        if status != 'failed':
+            self.done[rel_path] = record
+
+        summary = self.summary
+        summary['processed'] += 1
+        summary[status] += 1
+        summary['pages'] += info['pages']
+        summary['input_bytes'] += info['size']
+        progress = f"{summary['processed'] + summary['skipped']}/{summary['files']}" if summary['files'] \
+            else str(summary['processed'])
+        print(f"[{progress}] {status:<9} {rel_path}", file=sys.stderr)
+
+    def cancel(self):
+        """Drop queued files; finished ones are already in the manifest for the next run"""
+        self.scheduler.cancel_job('cli')
+
+    def close(self):
+        """Shut down the pool and return the throughput summary"""
+        self.scheduler.shutdown(wait=True)
+        self.scratch.cleanup()
+        self._results.close()
+
+        wall_seconds = time.perf_counter() - self.started
+        summary = dict(self.summary)
+        summary.update({
+            'wall_seconds': round(wall_seconds, 1),
+            'files_per_second': round(summary['processed'] / wall_seconds, 3) if wall_seconds else 0,
+            'pages_per_second': round(summary['pages'] / wall_seconds, 3) if wall_seconds else 0,
+            'mb_per_second': round(summary['input_bytes'] / (1024 * 1024) / wall_seconds, 3) if wall_seconds else 0,
+            'results': self.results_path
+        })
+        return summary
+
+
+def run(input_dir, output_dir, **options):
+    """Process every PDF under `input_dir` and return the throughput summary"""
+    pipeline = BatchPipeline(output_dir, **options)
+    paths = list(discover(input_dir))
+    pipeline.summary['files'] = len(paths)
+    print(f"Found {len(paths)} documents under {input_dir}; {pipeline.workers} workers "
+          f"x {pipeline.threads} threads, {pipeline.output_mode} output", file=sys.stderr)
+    try:
+        for rel_path in paths:
+            pipeline.submit(input_dir, rel_path)
+            # Keep a bounded queue so results stream out while the tree is still being read
+            pipeline.collect(max_pending=pipeline.workers * QUEUE_AHEAD_PER_WORKER - 1)
+        pipeline.collect()
+    except KeyboardInterrupt:
+        print("Interrupted; re-run the same command to resume", file=sys.stderr)
+        pipeline.cancel()
+    return pipeline.close()
+
+
+def watch(input_dir, output_dir, settle_seconds=2.0, poll_interval=5.0, **options):
+    """Process PDFs as they appear under `input_dir` until interrupted, then return the summary"""
+    from watch_folder import FolderWatcher
+
+    pipeline = BatchPipeline(output_dir, **options)
+    # The output tree may live inside the watched one; never feed results back in
+    watcher = FolderWatcher(input_dir, settle_seconds=settle_seconds, poll_interval=poll_interval,
+                            exclude=[output_dir], extensions=DOCUMENT_EXTENSIONS)
+    print(f"Watching {input_dir} ({watcher.mode}); {pipeline.workers} workers x {pipeline.threads} threads, "
+          f"{pipeline.output_mode} output. Press Ctrl+C to stop", file=sys.stderr)
+    try:
+        while True:
+            for rel_path in watcher.poll(timeout=0.5):
+                try:
+                    pipeline.submit(input_dir, rel_path)
+                except Exception as e:
+                    # A file that vanished or can't be read mustn't take the daemon down with it
+                    print(f"Could not queue {rel_path}: {str(e)}", file=sys.stderr)
+                    pipeline.fail(input_dir, rel_path, str(e))
+            pipeline.collect(timeout=0)
+    except KeyboardInterrupt:
+        print("Stopping; files still queued will be picked up on the next start", file=sys.stderr)
+        pipeline.cancel()
+    finally:
+        watcher.close()
+    return pipeline.close()
+
+
+def print_summary(summary):
+    total = f" of {summary['files']}" if summary['files'] else ''
+    print(f"Processed {summary['processed']}{total} files "
+          f"({summary['skipped']} already done) in {summary['wall_seconds']}s")
+    print(f"  ok: {summary['ok']}  from cache: {summary['cached']}  already OCR'd: {summary['prior_ocr']}  "
+          f"failed: {summary['failed']}")
+    print(f"  {summary['pages']} pages, {summary['pages_per_second']} pages/s, "
+          f"{summary['files_per_second']} files/s, {summary['mb_per_second']} MB/s")
+    print(f"  Results: {summary['results']}")
+
+
+def main(argv=None):
+    from pipeline import DEFAULT_OUTPUT_MODE
+
+    parser = argparse.ArgumentParser(description='OCR every PDF (or TIFF/JPEG/PNG scan) in a directory tree, '
+                                                 'or watch one for new ones')
+    parser.add_argument('input_dir', help='Directory to search for PDFs and scans (recursively)')
+    parser.add_argument('output_dir', help='Directory to write OCR output to, mirroring the input tree')
+    parser.add_argument('--workers', type=int, default=None, help='Number of OCR worker processes')
+    parser.add_argument('--mode', choices=['pdf', 'pdfa'], default=DEFAULT_OUTPUT_MODE,
+                        help='pdf: searchable PDF with original images (fast); pdfa: PDF/A for court filing '
+                             f'(default: {DEFAULT_OUTPUT_MODE}, from DEFAULT_OUTPUT_MODE as in the web app)')
+    parser.add_argument('--results', help=f'JSONL results/resume manifest (default: OUTPUT_DIR/{RESULTS_NAME})')
+    parser.add_argument('--no-resume', action='store_true', help='Reprocess files the manifest lists as done')
+    parser.add_argument('--cache-dir', help='OCR cache directory (default: the web app\'s ocr_cache)')
+    parser.add_argument('--timeout', type=int, default=1800, help='Per-file timeout in seconds')
+    parser.add_argument('--json', action='store_true', help='Print the summary as JSON')
+    parser.add_argument('--watch', action='store_true',
+                        help='Keep running and process new PDFs as they are dropped into the input directory')
+    parser.add_argument('--settle-seconds', type=float, default=2.0,
+                        help='With --watch, how long a file must stay unchanged before it is processed')
+    parser.add_argument('--poll-interval', type=float, default=5.0,
+                        help='With --watch, seconds between directory scans when inotify is unavailable')
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.input_dir):
+        parser.error(f"{args.input_dir} is not a directory")
+
+    options = dict(workers=args.workers, output_mode=args.mode, results_path=args.results,
+                   resume=not args.no_resume, timeout=args.timeout, cache_dir=args.cache_dir)
+    if args.watch:
+        summary = watch(args.input_dir, args.output_dir, settle_seconds=args.settle_seconds,
+                        poll_interval=args.poll_interval, **options)
+    else:
+        summary = run(args.input_dir, args.output_dir, **options)
+    if args.json:
+        print(json.dumps(summary, indent=2))
+    else:
+        print_summary(summary)
+    return 1 if summary['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,552 @@
+"""
+The per-file OCR pipeline shared by the web app and the batch CLI.
+
+Checks the content-addressed cache, optimizes large scans, runs ocrmypdf in a
+killable child process (retrying once with a cheaper profile after a
+timeout), splits very large PDFs into separately scheduled page chunks, and
+shares in-flight work between jobs that submit identical content. Importing
+this module has no side effects: it creates no folders and opens no database.
+Settings are read from `config` at call time; the web app points it at its
+own app.config with use_config(), the CLI adjusts it directly.
+"""
+
+import os
+import time
+import pickle
+import shutil
+import signal
+import hashlib
+import logging
+import tempfile
+import threading
+import subprocess
+import multiprocessing
+from concurrent.futures import Future, CancelledError, FIRST_COMPLETED, wait
+
+import ocrmypdf
+
+from log_store import bind_job
+from scratch import link_or_copy, choose_work_dir
+from singleflight import SingleFlight, chain_future
+from splitting import chunk_ranges, merge_chunks, page_count, split_pdf
+
+logger = logging.getLogger(__name__)
+
+config = {
+    'CACHE_FOLDER': 'ocr_cache',  # Folder to store processed files for caching
+    'OCR_THREADS': 1,  # Threads per OCR process for ghostscript and tesseract
+
+    # A file whose OCR runs past its timeout is killed and retried once with FAST_OCR_PROFILE,
+    # for at most OCR_RETRY_TIMEOUT_SECONDS; if that times out too, the original is passed through
+    'OCR_RETRY_TIMEOUT_SECONDS': int(os.environ.get('OCR_RETRY_TIMEOUT_SECONDS', '600')),
+
+    # Very large PDFs are OCR'd as chunks of SPLIT_CHUNK_PAGES pages, each its own cached, retried task
+    'SPLIT_ENABLED': os.environ.get('SPLIT_ENABLED', 'True').lower() in ['true', 'on', '1'],
+    'SPLIT_MIN_PAGES': int(os.environ.get('SPLIT_MIN_PAGES', '400')),
+    'SPLIT_MIN_MB': int(os.environ.get('SPLIT_MIN_MB', '300')),
+    'SPLIT_CHUNK_PAGES': int(os.environ.get('SPLIT_CHUNK_PAGES', '100')),
+    'SPLIT_CHUNK_TIMEOUT_SECONDS': int(os.environ.get('SPLIT_CHUNK_TIMEOUT_SECONDS', '900')),
+    'SPLIT_CHUNK_RETRIES': int(os.environ.get('SPLIT_CHUNK_RETRIES', '1')),
+}
+
+
+def use_config(settings):
+    """Read the pipeline settings from `settings` from now on, filling in the defaults it doesn't set"""
+    global config
+    for key, value in config.items():
+        settings.setdefault(key, value)
+    config = settings
+
+
+def not_canceled():
+    """Cancel check for callers whose jobs can't be canceled"""
+    return False
+
+
+def optimize_large_pdf(input_path, output_path, size_threshold_mb=100, timeout=None):
+    """Optimize large PDF files to improve OCR processing speed.
+
+    Returns the path OCR should read from: `output_path` if an optimized copy was
+    written there, otherwise the untouched `input_path`.
+    """
+    file_size_mb = os.path.getsize(input_path) / (1024 * 1024)
+
+    # Only optimize if file is larger than threshold
+    if file_size_mb > size_threshold_mb:
+        logger.info(f"File size {file_size_mb:.2f}MB exceeds {size_threshold_mb}MB threshold. Optimizing before OCR.")
+
+        # Ghostscript writes straight to the output path, which sits in the job's scratch space
+        temp_optimized = output_path
+
+        try:
+            # Use ghostscript to downsample images and optimize the PDF
+            cmd = [
+                'gs', '-sDEVICE=pdfwrite', '-dCompatibilityLevel=1.4',
+                '-dPDFSETTINGS=/ebook',  # Lower quality for faster processing
+                '-dNOPAUSE', '-dQUIET', '-dBATCH',
+                f"-dNumRenderingThreads={config['OCR_THREADS']}",
+                f'-sOutputFile={temp_optimized}',
+                input_path
+            ]
+
+            logger.info(f"Running optimization command: {' '.join(cmd)}")
+            result = subprocess.run(cmd, capture_output=True, text=True, timeout=timeout)
+
+            if result.returncode == 0:
+                # Check if optimization actually helped
+                new_size_mb = os.path.getsize(temp_optimized) / (1024 * 1024)
+                reduction = ((file_size_mb - new_size_mb) / file_size_mb) * 100
+
+                logger.info(f"Optimization complete. Original: {file_size_mb:.2f}MB, New: {new_size_mb:.2f}MB (Reduced by {reduction:.1f}%)")
+
+                if reduction > 10:  # Only use optimized version if it's significantly smaller
+                    return output_path, True
+                else:
+                    logger.info("Optimization didn't significantly reduce file size. Using original.")
+                    os.remove(temp_optimized)
+                    return input_path, False
+            else:
+                logger.warning(f"Optimization failed: {result.stderr}")
+                if os.path.exists(temp_optimized):
+                    os.remove(temp_optimized)
+                return input_path, False
+        except Exception as e:
+            logger.error(f"Error during PDF optimization: {str(e)}")
+            if os.path.exists(temp_optimized):
+                os.remove(temp_optimized)
+            return input_path, False
+    else:
+        # File is small enough to OCR as-is
+        return input_path, False
+
+
+def get_file_hash(file_path):
+    """Hash a file's content, used as the cache key and to spot duplicate uploads"""
+    hash_sha256 = hashlib.sha256()
+
+    # Content only: the same document uploaded twice (or under another name) gets the same key
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_sha256.update(chunk)
+
+    return hash_sha256.hexdigest()
+
+
+# Output mode used when a job doesn't choose one, by the web app, the API and the CLI alike
+DEFAULT_OUTPUT_MODE = os.environ.get('DEFAULT_OUTPUT_MODE', 'pdfa')
+
+# ocrmypdf settings per output mode. 'pdf' grafts the text layer onto the original pages: no deskew,
+# no PDF/A conversion, so images come through byte for byte. 'pdfa' is the archival format courts require
+OUTPUT_MODES = {
+    'pdf': dict(
+        output_type='pdf',
+        deskew=False
+    ),
+    'pdfa': dict(
+        output_type='pdfa',
+        deskew=True,
+        pdfa_image_compression="jpeg",  # Use faster compression
+        jpeg_quality=70,  # Lower quality for faster processing
+        png_quality=70
+    )
+}
+
+
+# Overrides for the retry after a timeout: no deskew or oversampling, skip images over 25 megapixels
+# (usually full-page photos with little text) and give up on any page tesseract spends over a minute on
+FAST_OCR_PROFILE = dict(
+    deskew=False,
+    oversample=0,
+    skip_big=25,
+    tesseract_timeout=60
+)
+
+
+class OcrTimeout(Exception):
+    """OCR ran past its time limit and was killed"""
+
+
+def _ocr_child(conn, input_path, output_path, options):
+    """Body of the OCR child process: run ocrmypdf and send back None or the exception"""
+    # Lead a process group of our own, so a timeout kills tesseract and ghostscript along with us
+    os.setsid()
+    try:
+        ocrmypdf.ocr(input_path, output_path, **options)
+        outcome = None
+    except Exception as e:
+        outcome = e
+    try:
+        # Not every exception survives pickling; the message is what the caller records
+        pickle.loads(pickle.dumps(outcome))
+    except Exception:
+        outcome = RuntimeError(str(outcome))
+    conn.send(outcome)
+    conn.close()
+
+
+def run_ocr(input_path, output_path, timeout=None, **options):
+    """
+    Run ocrmypdf.ocr in a child process, killing it and everything it started after `timeout` seconds.
+
+    Raises OcrTimeout if the limit is hit, or whatever ocrmypdf raised.
+    """
+    context = multiprocessing.get_context('fork')
+    reader, writer = context.Pipe(duplex=False)
+    child = context.Process(target=_ocr_child, args=(writer, input_path, output_path, options))
+    child.start()
+    writer.close()
+    try:
+        # The child's only message is sent just before it exits, so waiting on the pipe is waiting on OCR
+        if reader.poll(timeout or None):
+            outcome = reader.recv()
+        elif child.is_alive():
+            try:
+                os.killpg(child.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                # The child hasn't made its process group yet, so nothing else is running under it
+                child.kill()
+            raise OcrTimeout(f"OCR timed out after {timeout}s")
+        else:
+            outcome = RuntimeError(f"OCR process exited unexpectedly (exit code {child.exitcode})")
+    except EOFError:
+        child.join()
+        outcome = RuntimeError(f"OCR process exited unexpectedly (exit code {child.exitcode})")
+    finally:
+        reader.close()
+        child.join()
+    if outcome is not None:
+        raise outcome
+
+
+def get_cache_key(file_hash, output_mode='pdfa'):
+    """Cache file name for a document's output in the given mode"""
+    # PDF/A entries keep the original naming, so existing caches (and saas_app's) stay valid
+    if output_mode == 'pdfa':
+        return f"{file_hash}.pdf"
+    return f"{file_hash}.{output_mode}.pdf"
+
+
+def check_cache(file_path, filename, file_hash=None, output_mode='pdfa'):
+    """Check if file has been processed before and is in cache"""
+    try:
+        if file_hash is None:
+            file_hash = get_file_hash(file_path)
+        cache_key = get_cache_key(file_hash, output_mode)
+        cache_path = os.path.join(config['CACHE_FOLDER'], cache_key)
+
+        if os.path.exists(cache_path):
+            logger.info(f"Cache hit for {filename}")
+            return cache_path, True
+
+        logger.info(f"Cache miss for {filename}")
+        return cache_path, False
+    except Exception as e:
+        logger.error(f"Error checking cache: {str(e)}")
+        return None, False
+
+
+# Function to process a single PDF file (to be used with multiprocessing)
+def process_single_pdf(file_info):
+    """Process a single PDF file with OCR and return the result"""
+    input_path, output_path, filename, timeout = file_info[:4]
+    # Optional (hot, cold) scratch directories for intermediates, and the precomputed content hash
+    work_dirs = file_info[4] if len(file_info) > 4 else (None, None)
+    file_hash = file_info[5] if len(file_info) > 5 else None
+    output_mode = file_info[6] if len(file_info) > 6 else 'pdfa'
+    # Hardlinks are only safe inside a job's scratch; the CLI writes into the user's own tree and turns them off
+    hardlink = file_info[7] if len(file_info) > 7 else True
+    original_input_path = input_path
+    started_at = time.time()
+    result = {
+        'filename': filename,
+        'success': False,
+        'output_path': output_path,
+        'error': None,
+        'optimized': False,
+        'from_cache': False,
+        'cache_path': None,
+        'elapsed_seconds': 0
+    }
+
+    try:
+        # First check if we have this file in cache
+        cache_path, cache_hit = check_cache(input_path, filename, file_hash, output_mode)
+
+        if cache_hit and cache_path:
+            # File found in cache, link it into the output instead of copying
+            link_or_copy(cache_path, output_path, hardlink)
+            result['success'] = True
+            result['from_cache'] = True
+            result['cache_path'] = cache_path
+            return result
+
+        # Intermediates (optimized copy, ocrmypdf's work folder) go to tmpfs when the file fits
+        hot_dir, cold_dir = work_dirs
+        temp_dir = tempfile.mkdtemp(dir=choose_work_dir(input_path, hot_dir, cold_dir))
+        optimized_path = os.path.join(temp_dir, filename)
+
+        # First, try to optimize large PDFs; plain output keeps the original images, so it skips the downsampling
+        if output_mode != 'pdf':
+            input_path, was_optimized = optimize_large_pdf(input_path, optimized_path, timeout=timeout)
+            result['optimized'] = was_optimized
+
+        # Try to OCR the file with optimized settings for speed
+        tempfile.tempdir = temp_dir  # ocrmypdf creates its work folder under the default tempdir
+        options = dict(
+            skip_text=True,
+            force_ocr=False,
+            optimize=0,
+            clean=False,
+            fast_web_view=0,
+            max_image_mpixels=0,
+            progress_bar=False,
+            jobs=1,  # Use 1 core per file since we're parallelizing at the file level
+            skip_big=100,  # Skip very large images (helps with speed)
+            **OUTPUT_MODES[output_mode]
+        )
+        try:
+            # The optimize pre-pass counts against the file's timeout, so OCR only gets what is left of it
+            ocr_timeout = timeout - (time.time() - started_at) if timeout else None
+            if ocr_timeout is not None and ocr_timeout <= 0:
+                raise OcrTimeout(f"Optimizing {filename} used up its {timeout}s timeout")
+            run_ocr(input_path, output_path, ocr_timeout, **options)
+        except OcrTimeout:
+            # A pathological file; one more, cheaper try before giving up on it
+            retry_timeout = min(timeout or config['OCR_RETRY_TIMEOUT_SECONDS'],
+                                config['OCR_RETRY_TIMEOUT_SECONDS'])
+            logger.warning(f"OCR of {filename} timed out after {timeout}s; retrying with the fast profile "
+                           f"for up to {retry_timeout}s")
+            result['timed_out'] = True
+            result['fast_profile'] = True
+            try:
+                run_ocr(input_path, output_path, retry_timeout, **dict(options, **FAST_OCR_PROFILE))
+            except OcrTimeout:
+                raise OcrTimeout(f"OCR timed out after {timeout}s, and again after {retry_timeout}s "
+                                 f"with the fast profile")
+        result['success'] = True
+
+        # If successful, save to cache for future use; the post-pass later replaces it with an optimized copy
+        if cache_path and result['success']:
+            try:
+                link_or_copy(output_path, cache_path, hardlink)
+                result['cache_path'] = cache_path
+                logger.info(f"Saved {filename} to cache")
+            except Exception as cache_error:
+                logger.error(f"Error saving to cache: {str(cache_error)}")
+    except ocrmypdf.exceptions.PriorOcrFoundError:
+        # File already has OCR
+        link_or_copy(input_path, output_path, hardlink)
+        result['success'] = True
+        result['prior_ocr'] = True
+        result['error'] = "File already has OCR"
+
+        # Save to cache; the output may be the input itself, which must never become a cache entry's inode
+        if cache_path:
+            try:
+                link_or_copy(output_path, cache_path, hardlink=False)
+                result['cache_path'] = cache_path
+                logger.info(f"Saved {filename} to cache (already OCR'd)")
+            except Exception as cache_error:
+                logger.error(f"Error saving to cache: {str(cache_error)}")
+    except Exception as e:
+        # Handle any errors
+        result['error'] = str(e)
+        # If any error occurs, pass the original file through
+        try:
+            link_or_copy(original_input_path, output_path, hardlink)
+            result['success'] = True  # Mark as success since we're providing the original file
+        except Exception as copy_error:
+            result['error'] += f" (Copy failed: {str(copy_error)})"
+    finally:
+        # Clean up temp directory
+        tempfile.tempdir = None
+        try:
+            shutil.rmtree(temp_dir, ignore_errors=True)
+        except:
+            pass
+        result['elapsed_seconds'] = round(time.time() - started_at, 3)
+
+    return result
+
+
+# OCR work currently running, keyed by content hash, shared between concurrent jobs
+ocr_inflight = SingleFlight()
+
+
+def split_plan(input_path, pages=None):
+    """Page ranges to OCR a very large PDF in, or None to OCR it as one task"""
+    if not config['SPLIT_ENABLED']:
+        return None
+    try:
+        pages = pages or page_count(input_path)
+    except Exception as e:
+        logger.warning(f"Could not count pages in {os.path.basename(input_path)}, OCRing it whole: {str(e)}")
+        return None
+    size_mb = os.path.getsize(input_path) / (1024 * 1024)
+    if pages <= config['SPLIT_CHUNK_PAGES'] or \
+            (pages < config['SPLIT_MIN_PAGES'] and size_mb < config['SPLIT_MIN_MB']):
+        return None
+    return chunk_ranges(pages, config['SPLIT_CHUNK_PAGES'])
+
+
+def submit_split_ocr(scheduler, user_key, job_id, arg, ranges, weight=1, fast_lane=False, memory_mb=0,
+                     canceled=not_canceled):
+    """
+    OCR a very large PDF as independent page chunks and merge them back in page order.
+
+    Each chunk is scheduled like a file of its own, with its own timeout and cache entry, and a
+    failed chunk is retried up to SPLIT_CHUNK_RETRIES times, unless `canceled()` says the job
+    was canceled; if it still fails, its pages are passed through without OCR and the rest of
+    the document keeps its text layer. Returns a Future for a result shaped like
+    process_single_pdf's, plus 'chunks' and 'ocr_pages', the pages that were actually OCR'd.
+    """
+    input_path, output_path, filename, timeout, work_dirs, file_hash, output_mode = arg[:7]
+    hardlink = arg[7] if len(arg) > 7 else True
+    future = Future()
+    future.set_running_or_notify_cancel()
+
+    def run():
+        # Runs on its own thread, so the job's log tag has to be bound here
+        with bind_job(job_id):
+            started_at = time.time()
+            result = {
+                'filename': filename,
+                'success': False,
+                'output_path': output_path,
+                'error': None,
+                'optimized': False,
+                'from_cache': False,
+                'cache_path': None,
+                'chunks': len(ranges),
+                'ocr_pages': 0,
+                'elapsed_seconds': 0
+            }
+            chunk_dir = None
+            try:
+                cache_path, cache_hit = check_cache(input_path, filename, file_hash, output_mode)
+                if cache_hit and cache_path:
+                    link_or_copy(cache_path, output_path, hardlink)
+                    result.update(success=True, from_cache=True, cache_path=cache_path)
+                    return
+
+                chunk_dir = tempfile.mkdtemp(prefix='chunks_', dir=work_dirs[1])
+                chunk_paths = split_pdf(input_path, ranges, chunk_dir)
+                chunk_args = [
+                    (path, None, os.path.basename(path), config['SPLIT_CHUNK_TIMEOUT_SECONDS'], work_dirs,
+                     get_file_hash(path), output_mode, hardlink)
+                    for path in chunk_paths
+                ]
+                attempts = [0] * len(chunk_args)
+
+                def submit_chunk(index):
+                    # A failed attempt leaves its passed-through pages behind, so each attempt writes a fresh file
+                    attempts[index] += 1
+                    chunk_path, _, name = chunk_args[index][:3]
+                    chunk_arg = (chunk_path, os.path.join(chunk_dir, f'ocr{attempts[index]}_{name}')) + \
+                        chunk_args[index][2:]
+                    return scheduler.submit(user_key, job_id, process_single_pdf, chunk_arg, weight=weight,
+                                            fast_lane=fast_lane, memory_mb=memory_mb)
+
+                pending = {submit_chunk(index): index for index in range(len(chunk_args))}
+                outputs = [None] * len(chunk_paths)  # The original's pages are kept until a chunk's OCR succeeds
+                chunk_errors = {}
+                prior_ocr = 0
+                ocr_pages = 0  # Pages OCR'd by this job, not served from the chunk cache or already text
+                while pending:
+                    done, _ = wait(list(pending), return_when=FIRST_COMPLETED)
+                    for chunk_future in done:
+                        index = pending.pop(chunk_future)
+                        try:
+                            chunk_result = chunk_future.result()
+                            error = None if chunk_result.get('prior_ocr') else chunk_result.get('error')
+                        except CancelledError:
+                            raise
+                        except Exception as e:
+                            chunk_result, error = None, str(e)
+
+                        # A chunk that timed out has already had its retry, with the fast profile
+                        timed_out = bool(chunk_result and chunk_result.get('timed_out'))
+                        if error and not timed_out and attempts[index] <= config['SPLIT_CHUNK_RETRIES'] and \
+                                not canceled():
+                            logger.warning(f"Retrying {chunk_args[index][2]} after error: {error}")
+                            pending[submit_chunk(index)] = index
+                            continue
+                        if error:
+                            start, stop = ranges[index]
+                            chunk_errors[index] = f"pages {start + 1}-{stop}: {error}"
+                        else:
+                            outputs[index] = chunk_result['output_path']
+                            prior_ocr += bool(chunk_result.get('prior_ocr'))
+                            if not chunk_result.get('prior_ocr') and not chunk_result.get('from_cache'):
+                                start, stop = ranges[index]
+                                ocr_pages += stop - start
+
+                # Pages left unconverted by a failed chunk would make a PDF/A claim untrue
+                merge_chunks(input_path, ranges, outputs, output_path, pdfa=not chunk_errors)
+                result['success'] = True
+                result['ocr_pages'] = ocr_pages
+                if chunk_errors:
+                    result['error'] = f"OCR failed on {len(chunk_errors)} of {len(ranges)} chunks (" + \
+                        '; '.join(chunk_errors[index] for index in sorted(chunk_errors)) + ")"
+                elif prior_ocr == len(ranges):
+                    result['prior_ocr'] = True
+                    result['error'] = "File already has OCR"
+                if not chunk_errors and cache_path:
+                    try:
+                        link_or_copy(output_path, cache_path, hardlink)
+                        result['cache_path'] = cache_path
+                        logger.info(f"Saved {filename} to cache")
+                    except Exception as cache_error:
+                        logger.error(f"Error saving to cache: {str(cache_error)}")
+            except CancelledError:
+                # The job was canceled and its queued chunks dropped
+                result['error'] = "Processing canceled by user"
+            except Exception as e:
+                logger.error(f"Error OCRing {filename} in chunks: {str(e)}")
+                result['error'] = str(e)
+                try:
+                    link_or_copy(input_path, output_path, hardlink)
+                    result['success'] = True
+                except Exception as copy_error:
+                    result['error'] += f" (Copy failed: {str(copy_error)})"
+            finally:
+                if chunk_dir is not None:
+                    shutil.rmtree(chunk_dir, ignore_errors=True)
+                result['elapsed_seconds'] = round(time.time() - started_at, 3)
+                future.set_result(result)
+
+    logger.info(f"OCRing {filename} in {len(ranges)} chunks of up to {config['SPLIT_CHUNK_PAGES']} pages")
+    threading.Thread(target=run, name=f'split-{filename}', daemon=True).start()
+    return future
+
+
+def submit_ocr(scheduler, user_key, job_id, arg, weight=1, fast_lane=False, memory_mb=0, pages=None,
+               canceled=not_canceled):
+    """Queue one file for OCR, joining any job that is already processing identical content"""
+    ranges = split_plan(arg[0], pages)
+
+    def submit():
+        if ranges:
+            return submit_split_ocr(scheduler, user_key, job_id, arg, ranges, weight=weight, fast_lane=fast_lane,
+                                    memory_mb=memory_mb, canceled=canceled)
+        return scheduler.submit(user_key, job_id, process_single_pdf, arg, weight=weight, fast_lane=fast_lane,
+                                memory_mb=memory_mb)
+
+    # Keyed like the cache, so only jobs that want the same output share work
+    future, shared = ocr_inflight.run(get_cache_key(arg[5], arg[6]), submit)
+    if not shared:
+        return future
+
+    # Another job is OCRing the same document; once it finishes, our own pass is a cache hit
+    logger.info(f"{arg[2]} is already being processed by another job, waiting for its result")
+    follower = Future()
+
+    def resubmit(_):
+        if canceled():
+            follower.cancel()
+            follower.set_running_or_notify_cancel()
+        else:
+            chain_future(submit(), follower)
+
+    future.add_done_callback(resubmit)
+    return follower
@@ -0,0 +1,194 @@
+"""
+Background post-pass that optimizes and linearizes OCR output.
+
+OCR runs with optimize=0 and fast_web_view=0 so results come back quickly.
+Afterwards, a low-priority process pool re-encodes images (JPEG/PNG
+recompression, JBIG2 when the encoder is installed), packs objects into
+object streams and linearizes each cached output. The optimized file replaces
+the cache entry, and the job's ZIP is rebuilt around it and swapped in.
+"""
+
+import os
+import shutil
+import logging
+import tempfile
+import threading
+import zipfile
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pikepdf
+from log_store import bind_job
+from ocrmypdf._exec import jbig2enc, pngquant
+from ocrmypdf.optimize import optimize, PdfContext, ObjectStreamMode
+
+logger = logging.getLogger(__name__)
+
+# Lowest CPU priority, so the post-pass only uses cycles OCR doesn't need
+POSTPROCESS_NICENESS = 19
+
+
+class _OptimizeOptions:
+    """The subset of ocrmypdf's options its optimizer reads"""
+
+    def __init__(self, input_file, level, jpeg_quality=0, png_quality=0):
+        self.input_file = input_file
+        self.jobs = 1
+        self.optimize = level
+        self.jpeg_quality = jpeg_quality
+        self.png_quality = png_quality
+        self.jbig2_page_group_size = 0
+        self.jbig2_lossy = False
+        self.jbig2_threshold = 0.85
+        self.quiet = True
+        self.progress_bar = False
+
+
+def supported_level(level):
+    """
+    The highest optimization level up to `level` whose tools are installed.
+
+    The optimizer is called directly, below ocrmypdf's own dependency checks,
+    so a level that needs pngquant would fail with a bare FileNotFoundError
+    where it is missing. JBIG2 is skipped by the optimizer itself when
+    jbig2enc is absent, so it doesn't lower the level.
+    """
+    if level >= 2 and not pngquant.available():
+        return 1
+    return level
+
+
+def _lower_priority(niceness):
+    try:
+        os.nice(niceness)
+    except OSError:
+        pass
+
+
+def optimize_pdf(path, level=2):
+    """
+    Optimize and linearize the PDF at `path` in place.
+
+    Level 0 leaves images untouched and only packs object streams and
+    linearizes. Returns the (old, new) size in bytes, or None if the file is
+    already linearized or gone (e.g. evicted from the cache).
+    """
+    try:
+        with pikepdf.open(path) as pdf:
+            if pdf.is_linearized:
+                return None
+    except FileNotFoundError:
+        return None
+
+    old_size = os.path.getsize(path)
+    if level == 0:
+        # A unique name next to the file, so two passes over one cache entry can't write the same temp file
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(path))
+        os.close(fd)
+        try:
+            with pikepdf.open(path) as pdf:
+                pdf.save(tmp_path, compress_streams=True, object_stream_mode=pikepdf.ObjectStreamMode.generate,
+                         linearize=True)
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        return old_size, os.path.getsize(path)
+
+    work_dir = tempfile.mkdtemp(prefix='postprocess_', dir=os.path.dirname(path))
+    try:
+        input_file = Path(path)
+        output_file = Path(work_dir) / 'out.pdf'
+        context = PdfContext(_OptimizeOptions(input_file, level), work_dir, input_file, None, None)
+        optimize(input_file, output_file, context, dict(
+            compress_streams=True,
+            preserve_pdfa=True,
+            object_stream_mode=ObjectStreamMode.generate,
+            linearize=True
+        ))
+        # The optimizer may leave a symlink to its work file; resolve it before the swap
+        final_path = os.path.join(work_dir, 'final.pdf')
+        shutil.copyfile(os.path.realpath(output_file), final_path)
+        os.replace(final_path, path)
+        return old_size, os.path.getsize(path)
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def rebuild_zip(zip_path, replacements):
+    """Rewrite a ZIP with some members replaced by files on disk, then swap it in atomically"""
+    fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=os.path.dirname(zip_path))
+    os.close(fd)
+    try:
+        with zipfile.ZipFile(zip_path) as old, zipfile.ZipFile(tmp_path, 'w') as new:
+            for info in old.infolist():
+                replacement = replacements.get(info.filename)
+                if replacement and os.path.exists(replacement):
+                    new.write(replacement, info.filename)
+                else:
+                    with old.open(info) as src, new.open(info, 'w') as dst:
+                        shutil.copyfileobj(src, dst, 1024 * 1024)
+        os.replace(tmp_path, zip_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class PostProcessor:
+    """Runs the optimize/linearize pass on a small low-priority process pool"""
+
+    def __init__(self, workers=1, level=2, niceness=POSTPROCESS_NICENESS):
+        self.level = supported_level(level)
+        if self.level != level:
+            logger.warning(f"pngquant is not installed; post-pass optimization lowered from level {level} "
+                           f"to {self.level}")
+        self._executor = ProcessPoolExecutor(max_workers=max(1, workers),
+                                             initializer=_lower_priority, initargs=(niceness,))
+
+    def submit(self, job_id, zip_path, members, on_done=None, level=None):
+        """
+        Optimize a finished job's outputs in the background.
+
+        `members` maps each ZIP member name to the cache file holding it. Once
+        every file is done, the ZIP is rebuilt and `on_done(stats)` is called.
+        `level` overrides the processor's optimization level for this job.
+        """
+        level = self.level if level is None else supported_level(level)
+        thread = threading.Thread(target=self._run, args=(job_id, zip_path, members, on_done, level), daemon=True)
+        thread.start()
+        return thread
+
+    def _run(self, job_id, zip_path, members, on_done, level):
+        # The pass runs on its own thread; tag its log lines with the job it is finishing
+        with bind_job(job_id):
+            stats = {'optimized_files': 0, 'bytes_before': 0, 'bytes_after': 0, 'errors': 0}
+            # Identical documents share one cache file, so optimize each file once
+            futures = {self._executor.submit(optimize_pdf, path, level): path
+                       for path in set(members.values())}
+            for future in as_completed(futures):
+                try:
+                    sizes = future.result()
+                except Exception as e:
+                    stats['errors'] += 1
+                    logger.warning(f"Post-pass optimization failed for {os.path.basename(futures[future])}: {str(e)}")
+                    continue
+                if sizes:
+                    stats['optimized_files'] += 1
+                    stats['bytes_before'] += sizes[0]
+                    stats['bytes_after'] += sizes[1]
+
+            try:
+                if os.path.exists(zip_path):
+                    rebuild_zip(zip_path, members)
+                    logger.info(f"Optimized output ready for job {job_id}: {stats['optimized_files']} files, "
+                                f"{stats['bytes_before'] / (1024 * 1024):.2f}MB -> "
+                                f"{stats['bytes_after'] / (1024 * 1024):.2f}MB")
+            except Exception as e:
+                stats['errors'] += 1
+                logger.error(f"Could not swap in optimized output for job {job_id}: {str(e)}")
+
+            if on_done:
+                on_done(stats)
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
@@ -0,0 +1,216 @@
+"""
+CPU and memory available to this process, as seen from inside a container.
+
+`os.cpu_count()` and /proc/meminfo report the host, not the container, so a
+container limited to 2 CPUs on a 16-core host would start 16 OCR workers and
+thrash. This reads the cgroup v2 (or v1) CPU quota and memory limit, and the
+process's CPU affinity, and derives the sizes everything else uses: gunicorn
+workers, OCR pool size per gunicorn worker, and threads per OCR worker for
+ghostscript and tesseract.
+
+Tesseract parallelises with OpenMP, which by default starts a thread per core
+in every process; with a pool of OCR workers that is workers x cores threads
+fighting over the CPUs. Each pool process therefore pins OpenMP (and the BLAS
+libraries, should anything load them) to its share of the core budget when it
+starts (`init_worker`).
+"""
+
+import os
+import math
+import logging
+
+logger = logging.getLogger(__name__)
+
+CGROUP_ROOT = '/sys/fs/cgroup'
+# cgroup v1 reports "no limit" as a page-rounded LONG_MAX rather than a keyword
+CGROUP_V1_UNLIMITED = 1 << 60
+# Flask app, SQLAlchemy pool and an idle OCR pool per gunicorn worker
+WEB_WORKER_MEMORY_MB = 1024
+MAX_WEB_WORKERS = 2
+# Thread counts honoured by tesseract's OpenMP runtime and by OpenBLAS/MKL
+THREAD_ENV_VARS = ('OMP_THREAD_LIMIT', 'OMP_NUM_THREADS', 'OPENBLAS_NUM_THREADS', 'MKL_NUM_THREADS')
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _cgroup_v2_dir():
+    """The process's own cgroup v2 directory, falling back to the root of the mount"""
+    own = _read('/proc/self/cgroup') or ''
+    for line in own.splitlines():
+        if line.startswith('0::'):
+            path = os.path.join(CGROUP_ROOT, line[3:].lstrip('/'))
+            if os.path.exists(os.path.join(path, 'cgroup.controllers')):
+                return path
+    return CGROUP_ROOT
+
+
+def cgroup_version():
+    """Return 2 for the unified hierarchy, 1 for legacy controllers, or None outside a cgroup"""
+    if os.path.exists(os.path.join(CGROUP_ROOT, 'cgroup.controllers')):
+        return 2
+    if os.path.isdir(os.path.join(CGROUP_ROOT, 'memory')) or os.path.isdir(os.path.join(CGROUP_ROOT, 'cpu')):
+        return 1
+    return None
+
+
+def _v1_file(controllers, name):
+    for controller in controllers:
+        value = _read(os.path.join(CGROUP_ROOT, controller, name))
+        if value is not None:
+            return value
+    return None
+
+
+def cpu_quota():
+    """Return the cgroup CPU quota in CPUs (may be fractional), or None if unlimited"""
+    try:
+        if cgroup_version() == 2:
+            value = _read(os.path.join(_cgroup_v2_dir(), 'cpu.max'))
+            if not value:
+                return None
+            quota, period = value.split()[:2]
+            return None if quota == 'max' else int(quota) / int(period)
+        quota = _v1_file(('cpu,cpuacct', 'cpu'), 'cpu.cfs_quota_us')
+        period = _v1_file(('cpu,cpuacct', 'cpu'), 'cpu.cfs_period_us')
+        if quota is None or period is None or int(quota) <= 0:
+            return None
+        return int(quota) / int(period)
+    except ValueError:
+        return None
+
+
+def cpu_limit():
+    """Return the whole CPUs this process may use: its affinity mask, capped by the cgroup quota"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+    quota = cpu_quota()
+    if quota is not None:
+        # Round down: a 1.5 CPU quota running two busy workers gets throttled every period
+        cpus = min(cpus, max(1, math.floor(quota)))
+    return cpus
+
+
+def _meminfo_mb(field):
+    for line in (_read('/proc/meminfo') or '').splitlines():
+        if line.startswith(field + ':'):
+            return int(line.split()[1]) / 1024
+    return None
+
+
+def _cgroup_memory_bytes():
+    """Return the cgroup (limit, usage) in bytes; the limit is None if unlimited"""
+    if cgroup_version() == 2:
+        path = _cgroup_v2_dir()
+        limit = _read(os.path.join(path, 'memory.max'))
+        usage = _read(os.path.join(path, 'memory.current'))
+        limit = None if limit in (None, 'max') else int(limit)
+    else:
+        limit = _v1_file(('memory',), 'memory.limit_in_bytes')
+        usage = _v1_file(('memory',), 'memory.usage_in_bytes')
+        limit = None if limit is None or int(limit) >= CGROUP_V1_UNLIMITED else int(limit)
+    return limit, None if usage is None else int(usage)
+
+
+def memory_limit_mb():
+    """Return the memory this process may use in MB: the cgroup limit, or the host's total"""
+    total = _meminfo_mb('MemTotal')
+    try:
+        limit, _ = _cgroup_memory_bytes()
+    except ValueError:
+        limit = None
+    if limit is None:
+        return total
+    limit_mb = limit / (1024 * 1024)
+    return limit_mb if total is None else min(total, limit_mb)
+
+
+def cgroup_memory_available_mb():
+    """Return the memory left under the cgroup limit in MB, or None if there is no limit"""
+    try:
+        limit, usage = _cgroup_memory_bytes()
+    except ValueError:
+        return None
+    if limit is None or usage is None:
+        return None
+    return max(0, limit - usage) / (1024 * 1024)
+
+
+def available_memory_mb():
+    """Return the memory available to new work in MB, within the container's limit if it has one"""
+    available = _meminfo_mb('MemAvailable')
+    if available is None:
+        try:
+            available = os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+        except (ValueError, OSError):
+            pass
+    cgroup_available = cgroup_memory_available_mb()
+    if cgroup_available is not None:
+        available = cgroup_available if available is None else min(available, cgroup_available)
+    return available
+
+
+def web_workers():
+    """Gunicorn worker count: WEB_CONCURRENCY if set, else what the CPU and memory limits allow"""
+    if os.environ.get('WEB_CONCURRENCY'):
+        return max(1, int(os.environ['WEB_CONCURRENCY']))
+    by_memory = int((memory_limit_mb() or WEB_WORKER_MEMORY_MB) // WEB_WORKER_MEMORY_MB)
+    return max(1, min(MAX_WEB_WORKERS, cpu_limit(), by_memory))
+
+
+def ocr_workers():
+    """OCR processes per gunicorn worker, so all workers' pools together fill the CPUs once"""
+    return max(1, cpu_limit() // web_workers())
+
+
+def threads_per_worker(workers):
+    """Threads each of a gunicorn worker's `workers` OCR processes may use without oversubscribing"""
+    return max(1, cpu_limit() // (max(1, workers) * web_workers()))
+
+
+def thread_environment(threads):
+    """Environment that limits OpenMP and BLAS thread pools to `threads`"""
+    return {name: str(max(1, int(threads))) for name in THREAD_ENV_VARS}
+
+
+def apply_thread_limits(threads):
+    """Default the OpenMP and BLAS thread counts (unless already set); child processes inherit them"""
+    for name, value in thread_environment(threads).items():
+        os.environ.setdefault(name, value)
+
+
+def init_worker(threads, initializer=None, *initargs):
+    """
+    Pool initializer: limit this OCR process's OpenMP and BLAS threads to `threads`.
+
+    Overrides what the process inherited, so every pool gets its share of the
+    core budget whatever the parent's environment says. Chains to
+    `initializer(*initargs)` for pools that need their own setup too.
+    """
+    os.environ.update(thread_environment(threads))
+    if initializer is not None:
+        initializer(*initargs)
+
+
+def summary():
+    """Detected limits, for logging at startup"""
+    return {
+        'cgroup_version': cgroup_version(),
+        'cpu_quota': cpu_quota(),
+        'cpus': cpu_limit(),
+        'memory_limit_mb': None if memory_limit_mb() is None else round(memory_limit_mb()),
+        'web_workers': web_workers(),
+        'ocr_workers': ocr_workers()
+    }
+
+
+if __name__ == '__main__':
+    for key, value in summary().items():
+        print(f"{key}: {value}")
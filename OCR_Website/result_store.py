@@ -0,0 +1,171 @@
+"""
+Per-job result retention with a hot and an archive tier.
+
+Finished job ZIPs are kept on local disk (the hot tier) for a while so
+re-downloads are instant. After `hot_ttl` they are compressed and handed to an
+archive backend, and after `archive_ttl` they are deleted. Archived results
+are restored to the hot tier on demand when a user downloads them again.
+
+Backends implement put/get/delete/exists on opaque keys; the default stores
+files in a local directory, and others (object storage, NFS) can be plugged
+in through `make_backend`.
+"""
+
+import os
+import gzip
+import shutil
+import logging
+import tempfile
+from abc import ABC, abstractmethod
+
+logger = logging.getLogger(__name__)
+
+HOT = 'hot'
+ARCHIVE = 'archive'
+EXPIRED = 'expired'
+
+
+class StorageBackend(ABC):
+    """Interface for archive storage; a backend missing a method fails when it is created"""
+
+    @abstractmethod
+    def put(self, key, path):
+        """Store the file at `path` under `key`, replacing any object already there"""
+
+    @abstractmethod
+    def get(self, key, path):
+        """Write the object stored under `key` to `path`"""
+
+    @abstractmethod
+    def delete(self, key):
+        """Remove the object under `key`; a missing object is not an error"""
+
+    @abstractmethod
+    def exists(self, key):
+        """Whether an object is stored under `key`"""
+
+
+class LocalDirectoryBackend(StorageBackend):
+    """Archive backend that keeps objects as files under a directory"""
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.root, key)
+
+    def put(self, key, path):
+        fd, tmp_path = tempfile.mkstemp(suffix='.tmp', dir=self.root)
+        os.close(fd)
+        try:
+            shutil.copyfile(path, tmp_path)
+            os.replace(tmp_path, self._path(key))
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def get(self, key, path):
+        shutil.copyfile(self._path(key), path)
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def exists(self, key):
+        return os.path.exists(self._path(key))
+
+
+def make_backend(url):
+    """Build an archive backend from a URL; a plain path or file:// URL means a local directory"""
+    if url.startswith('file://'):
+        url = url[len('file://'):]
+    if '://' in url:
+        raise ValueError(f"Unsupported result archive backend: {url}")
+    return LocalDirectoryBackend(url)
+
+
+class ResultStore:
+    """Stores job results in the hot tier and moves them to the archive as they age"""
+
+    def __init__(self, hot_dir, backend, compress_level=6):
+        self.hot_dir = hot_dir
+        self.backend = backend
+        self.compress_level = compress_level
+        os.makedirs(hot_dir, exist_ok=True)
+
+    def hot_path(self, job_id):
+        return os.path.join(self.hot_dir, f'{job_id}.zip')
+
+    def archive_key(self, job_id):
+        return f'{job_id}.zip.gz'
+
+    def save(self, job_id, zip_path):
+        """Move a finished job's ZIP into the hot tier and return its size"""
+        path = self.hot_path(job_id)
+        shutil.move(zip_path, path)
+        return os.path.getsize(path)
+
+    def archive(self, job_id):
+        """Compress a hot result into the archive tier and drop the local copy"""
+        path = self.hot_path(job_id)
+        fd, tmp_path = tempfile.mkstemp(suffix='.gz', dir=self.hot_dir)
+        try:
+            with open(path, 'rb') as src, os.fdopen(fd, 'wb') as raw, \
+                    gzip.GzipFile(fileobj=raw, mode='wb', compresslevel=self.compress_level, mtime=0) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            self.backend.put(self.archive_key(job_id), tmp_path)
+        finally:
+            os.remove(tmp_path)
+        os.remove(path)
+
+    def fetch(self, job_id, tier):
+        """Return a local path to the job's ZIP, restoring it from the archive if needed"""
+        path = self.hot_path(job_id)
+        if os.path.exists(path):
+            return path
+        if tier != ARCHIVE or not self.backend.exists(self.archive_key(job_id)):
+            return None
+
+        fd, tmp_path = tempfile.mkstemp(suffix='.gz', dir=self.hot_dir)
+        os.close(fd)
+        # Two downloads restoring the same job each decompress to their own file; the last rename wins
+        fd, restored_path = tempfile.mkstemp(suffix='.tmp', dir=self.hot_dir)
+        os.close(fd)
+        try:
+            self.backend.get(self.archive_key(job_id), tmp_path)
+            with gzip.open(tmp_path, 'rb') as src, open(restored_path, 'wb') as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(restored_path, path)
+        finally:
+            os.remove(tmp_path)
+            if os.path.exists(restored_path):
+                os.remove(restored_path)
+        logger.info(f"Restored job {job_id} from the archive tier")
+        return path
+
+    def local_copies(self):
+        """Yield (job_id, mtime) for every result on local disk"""
+        for name in os.listdir(self.hot_dir):
+            if name.endswith('.zip'):
+                try:
+                    yield name[:-len('.zip')], os.path.getmtime(os.path.join(self.hot_dir, name))
+                except FileNotFoundError:
+                    pass
+
+    def drop_local_copy(self, job_id):
+        """Remove the local copy of a result that is also held in the archive"""
+        try:
+            os.remove(self.hot_path(job_id))
+        except FileNotFoundError:
+            pass
+
+    def delete(self, job_id):
+        """Remove a job's result from both tiers"""
+        try:
+            os.remove(self.hot_path(job_id))
+        except FileNotFoundError:
+            pass
+        self.backend.delete(self.archive_key(job_id))
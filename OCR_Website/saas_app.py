@@ -2,8 +2,14 @@ import os
 import zipfile
 import tempfile
 import shutil
+import time
+import uuid
+import hashlib
 import logging
-from datetime import datetime
+import threading
+import resource
+from datetime import datetime, timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from flask import Flask, render_template, request, send_file, jsonify, redirect, url_for, flash, session
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import LoginManager, UserMixin, login_user, login_required, logout_user, current_user
@@ -12,6 +18,12 @@ from werkzeug.utils import secure_filename
 import ocrmypdf
 from pathlib import Path
 import stripe
+from sqlalchemy.exc import IntegrityError
+from admission import estimate_image_dpi
+from metering import inspect_pdf, quote, charged_units, units_to_credits
+from database import engine_options, configure_sqlite
+from result_store import ResultStore, make_backend, HOT, ARCHIVE, EXPIRED
+import resources
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
@@ -22,18 +34,37 @@ app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 500 * 1024 * 1024  # 500MB max file size
 app.config['SECRET_KEY'] = 'your-secret-key-here'  # Change this in production
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///users.db'
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+app.config['CACHE_FOLDER'] = 'ocr_cache'  # Same layout as app.py's cache, so the two can share it
+app.config['OCR_WORKERS'] = int(os.environ.get('OCR_WORKERS', resources.ocr_workers()))
+resources.apply_thread_limits(resources.threads_per_worker(app.config['OCR_WORKERS']))
+# Job results stay on local disk for RESULT_HOT_TTL_HOURS, then in the archive for RESULT_ARCHIVE_TTL_DAYS
+app.config['RESULT_HOT_TTL_HOURS'] = float(os.environ.get('RESULT_HOT_TTL_HOURS', '24'))
+app.config['RESULT_ARCHIVE_TTL_DAYS'] = float(os.environ.get('RESULT_ARCHIVE_TTL_DAYS', '30'))
+app.config['RESULT_ARCHIVE_BACKEND'] = os.environ.get('RESULT_ARCHIVE_BACKEND', os.path.join('uploads', 'archive'))
+app.config['RESULT_SWEEP_INTERVAL_SECONDS'] = int(os.environ.get('RESULT_SWEEP_INTERVAL_SECONDS', '600'))
+# Accounts allowed to see the global usage report
+app.config['ADMIN_EMAILS'] = [e.strip() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()]
 app.config['STRIPE_PUBLIC_KEY'] = 'your-stripe-public-key'
 app.config['STRIPE_SECRET_KEY'] = 'your-stripe-secret-key'
 
 stripe.api_key = app.config['STRIPE_SECRET_KEY']
 
 db = SQLAlchemy(app)
+with app.app_context():
+    configure_sqlite(db.engine)
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
 
-# Ensure upload directory exists
+# Ensure upload and cache directories exist
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['CACHE_FOLDER'], exist_ok=True)
+
+result_store = ResultStore(
+    os.path.join(app.config['UPLOAD_FOLDER'], 'results'),
+    make_backend(app.config['RESULT_ARCHIVE_BACKEND'])
+)
 
 # User model
 class User(UserMixin, db.Model):
@@ -52,76 +83,347 @@ class User(UserMixin, db.Model):
 
 # Usage history model
 class UsageHistory(db.Model):
+    # The dashboard lists a user's most recent usage
+    __table_args__ = (db.Index('ix_usage_history_user_timestamp', 'user_id', 'timestamp'),)
+
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     timestamp = db.Column(db.DateTime, default=datetime.utcnow)
     files_processed = db.Column(db.Integer)
     credits_used = db.Column(db.Integer)
 
+# Daily usage rollups, updated in the same transaction that settles each job
+ROLLUP_COUNTERS = ('jobs', 'files', 'pages', 'cpu_seconds', 'cache_hits', 'credits_used')
+
+class DailyUserUsage(db.Model):
+    __table_args__ = (db.UniqueConstraint('user_id', 'day', name='uq_daily_user_usage_user_day'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False)
+    jobs = db.Column(db.Integer, default=0, nullable=False)
+    files = db.Column(db.Integer, default=0, nullable=False)
+    pages = db.Column(db.Integer, default=0, nullable=False)
+    cpu_seconds = db.Column(db.Float, default=0, nullable=False)
+    cache_hits = db.Column(db.Integer, default=0, nullable=False)
+    credits_used = db.Column(db.Integer, default=0, nullable=False)
+
+class DailyGlobalUsage(db.Model):
+    day = db.Column(db.Date, primary_key=True)
+    jobs = db.Column(db.Integer, default=0, nullable=False)
+    files = db.Column(db.Integer, default=0, nullable=False)
+    pages = db.Column(db.Integer, default=0, nullable=False)
+    cpu_seconds = db.Column(db.Float, default=0, nullable=False)
+    cache_hits = db.Column(db.Integer, default=0, nullable=False)
+    credits_used = db.Column(db.Integer, default=0, nullable=False)
+
+def increment_rollup(model, key, counts):
+    """Add counts to one rollup row, creating it on first use (caller commits)"""
+    filters = [getattr(model, column) == value for column, value in key.items()]
+    values = {getattr(model, name): getattr(model, name) + counts.get(name, 0) for name in ROLLUP_COUNTERS}
+    if model.query.filter(*filters).update(values, synchronize_session=False):
+        return
+    try:
+        # Savepoint, so losing an insert race to another job doesn't roll back the settlement
+        with db.session.begin_nested():
+            db.session.add(model(**key, **{name: counts.get(name, 0) for name in ROLLUP_COUNTERS}))
+    except IntegrityError:
+        model.query.filter(*filters).update(values, synchronize_session=False)
+
+def record_usage(user_id, counts, day=None):
+    """Fold one finished job into the per-user and global daily rollups"""
+    day = day or datetime.utcnow().date()
+    increment_rollup(DailyUserUsage, {'user_id': user_id, 'day': day}, counts)
+    increment_rollup(DailyGlobalUsage, {'day': day}, counts)
+
+# One processing batch and where its result ZIP is kept
+class Job(db.Model):
+    # History is listed per user, newest first; the retention sweep scans by tier and age
+    __table_args__ = (
+        db.Index('ix_job_user_created', 'user_id', 'created_at'),
+        db.Index('ix_job_tier_created', 'storage_tier', 'created_at'),
+    )
+
+    id = db.Column(db.String(32), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    files_processed = db.Column(db.Integer, default=0)
+    credits_used = db.Column(db.Integer, default=0)
+    error_count = db.Column(db.Integer, default=0)
+    size_bytes = db.Column(db.Integer, default=0)
+    storage_tier = db.Column(db.String(10), default=HOT)  # hot, archive, expired
+
+    def expires_at(self):
+        return self.created_at + timedelta(hours=app.config['RESULT_HOT_TTL_HOURS'],
+                                           days=app.config['RESULT_ARCHIVE_TTL_DAYS'])
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'created_at': self.created_at.isoformat(),
+            'files_processed': self.files_processed,
+            'credits_used': self.credits_used,
+            'error_count': self.error_count,
+            'size_bytes': self.size_bytes,
+            'storage_tier': self.storage_tier,
+            'expires_at': self.expires_at().isoformat(),
+            'download_url': url_for('download_job', job_id=self.id) if self.storage_tier != EXPIRED else None
+        }
+
+# Credits held for a batch while it runs; settled (or released) in one transaction at the end
+class CreditReservation(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount = db.Column(db.Integer, nullable=False)
+    used = db.Column(db.Integer)
+    status = db.Column(db.String(20), default='reserved', index=True)  # reserved, settled, released
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    settled_at = db.Column(db.DateTime)
+
 @login_manager.user_loader
 def load_user(id):
-    return User.query.get(int(id))
+    return db.session.get(User, int(id))
+
+def reserve_credits(user, amount):
+    """Atomically take `amount` credits from the user's balance; returns None if they don't have enough"""
+    if user.subscription_status == 'premium':
+        amount = 0
+
+    # Conditional decrement, so two concurrent batches can't both spend the same credits
+    updated = User.query.filter(User.id == user.id, User.credits >= amount).update(
+        {User.credits: User.credits - amount}, synchronize_session=False)
+    if not updated:
+        db.session.rollback()
+        return None
+
+    reservation = CreditReservation(user_id=user.id, amount=amount)
+    db.session.add(reservation)
+    db.session.commit()
+    return reservation
+
+def close_reservation(reservation, status, used):
+    """Move a reservation out of 'reserved'; False if something else (a settle or the stale sweep) got there first"""
+    closed = CreditReservation.query.filter(CreditReservation.id == reservation.id,
+                                            CreditReservation.status == 'reserved').update(
+        {CreditReservation.status: status, CreditReservation.used: used,
+         CreditReservation.settled_at: datetime.utcnow()}, synchronize_session=False)
+    return closed == 1
+
+def settle_reservation(reservation, files_processed, credits_used, usage=None):
+    """
+    Charge what the batch used, refund the rest and record the usage, in a single transaction.
+
+    Returns False, changing nothing, if the reservation was already settled or released.
+    """
+    credits_used = min(credits_used, reservation.amount)
+    refund = reservation.amount - credits_used
+    # Conditional, so a reservation is only ever refunded once
+    if not close_reservation(reservation, 'settled', credits_used):
+        db.session.rollback()
+        logger.warning(f"Credit reservation {reservation.id} was already closed; not settling it again")
+        return False
+    if refund:
+        User.query.filter(User.id == reservation.user_id).update(
+            {User.credits: User.credits + refund}, synchronize_session=False)
+
+    db.session.add(UsageHistory(
+        user_id=reservation.user_id,
+        files_processed=files_processed,
+        credits_used=credits_used
+    ))
+    if files_processed:
+        record_usage(reservation.user_id, dict(usage or {}, jobs=1, files=files_processed, credits_used=credits_used))
+    db.session.commit()
+    return True
+
+def release_stale_reservations(max_age_hours=6):
+    """Refund reservations left open by a crashed or killed worker"""
+    cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+    stale = CreditReservation.query.filter(CreditReservation.status == 'reserved',
+                                           CreditReservation.created_at < cutoff).all()
+    released = 0
+    for reservation in stale:
+        # A batch may finish and settle between the query and here; only refund what is still open
+        if not close_reservation(reservation, 'released', 0):
+            continue
+        User.query.filter(User.id == reservation.user_id).update(
+            {User.credits: User.credits + reservation.amount}, synchronize_session=False)
+        released += 1
+    db.session.commit()
+    if released:
+        logger.info(f"Released {released} stale credit reservations")
+
+last_result_sweep = 0
+result_sweep_lock = threading.Lock()
+
+def sweep_results():
+    """Move aged results to the archive tier, expire old archives and drop stale restored copies"""
+    now = datetime.utcnow()
+    hot_cutoff = now - timedelta(hours=app.config['RESULT_HOT_TTL_HOURS'])
+    archive_cutoff = hot_cutoff - timedelta(days=app.config['RESULT_ARCHIVE_TTL_DAYS'])
+    archived = expired = 0
+
+    for job in Job.query.filter(Job.storage_tier == HOT, Job.created_at < hot_cutoff).limit(100):
+        try:
+            result_store.archive(job.id)
+            job.storage_tier = ARCHIVE
+            archived += 1
+        except FileNotFoundError:
+            job.storage_tier = EXPIRED
+        except Exception as e:
+            logger.error(f"Error archiving result for job {job.id}: {str(e)}")
+
+    for job in Job.query.filter(Job.storage_tier == ARCHIVE, Job.created_at < archive_cutoff).limit(100):
+        result_store.delete(job.id)
+        job.storage_tier = EXPIRED
+        expired += 1
+    db.session.commit()
+
+    # Archived results restored for a re-download only stay local for the hot TTL
+    restored_cutoff = time.time() - app.config['RESULT_HOT_TTL_HOURS'] * 3600
+    stale = [job_id for job_id, mtime in result_store.local_copies() if mtime < restored_cutoff]
+    if stale:
+        for job in Job.query.filter(Job.id.in_(stale), Job.storage_tier != HOT):
+            result_store.drop_local_copy(job.id)
+
+    if archived or expired:
+        logger.info(f"Result retention: archived {archived} jobs, expired {expired} jobs")
+
+def maybe_sweep_results():
+    """Run the retention sweep if it hasn't run within the sweep interval"""
+    global last_result_sweep
+    with result_sweep_lock:
+        if time.time() - last_result_sweep < app.config['RESULT_SWEEP_INTERVAL_SECONDS']:
+            return
+        last_result_sweep = time.time()
+    try:
+        sweep_results()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Error during result retention sweep: {str(e)}")
+
+def inspect_upload(pdf_path):
+    """Pages, text pages and image DPI of an uploaded PDF, for quoting and metering"""
+    try:
+        page_count, text_pages = inspect_pdf(pdf_path)
+    except Exception as e:
+        logger.error(f"Error counting pages in {os.path.basename(pdf_path)}: {str(e)}")
+        page_count, text_pages = 0, 0
+    return {
+        'name': os.path.basename(pdf_path),
+        'page_count': page_count,
+        'text_pages': text_pages,
+        'dpi': estimate_image_dpi(pdf_path)
+    }
 
-def process_pdfs(input_dir, user):
+def file_hash(pdf_path):
+    hash_sha256 = hashlib.sha256()
+    with open(pdf_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            hash_sha256.update(chunk)
+    return hash_sha256.hexdigest()
+
+def save_to_cache(output_path, cache_path):
+    tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+    shutil.copyfile(output_path, tmp_path)
+    os.replace(tmp_path, cache_path)
+
+def cpu_time():
+    """CPU seconds used by this process and its finished children (tesseract, ghostscript)"""
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+def ocr_file(input_path, output_path, cache_dir):
+    """OCR one file in a worker process and return what it cost"""
+    filename = os.path.basename(input_path)
+    result = {'error': None, 'cpu_seconds': 0.0, 'from_cache': False, 'prior_ocr': False}
+    started = cpu_time()
+    cache_path = os.path.join(cache_dir, f"{file_hash(input_path)}.pdf")
+    try:
+        if os.path.exists(cache_path):
+            logger.info(f"Cache hit for {filename}")
+            shutil.copyfile(cache_path, output_path)
+            result['from_cache'] = True
+            return result
+
+        logger.info(f"Processing file: {filename}")
+        ocrmypdf.ocr(
+            input_path, 
+            output_path,
+            deskew=True,
+            skip_text=True,
+            force_ocr=False,
+            optimize=0,
+            clean=False,
+            fast_web_view=0,
+            max_image_mpixels=0,
+            progress_bar=False,
+            jobs=1  # Files are processed in parallel, one core each
+        )
+        logger.info(f"Successfully processed: {filename}")
+        save_to_cache(output_path, cache_path)
+    except ocrmypdf.exceptions.PriorOcrFoundError:
+        logger.info(f"File already has OCR: {filename}")
+        shutil.copy2(input_path, output_path)
+        result['prior_ocr'] = True
+    except Exception as e:
+        logger.error(f"Error processing {filename}: {str(e)}")
+        shutil.copy2(input_path, output_path)
+        result['error'] = f"{filename}: {str(e)}"
+    finally:
+        result['cpu_seconds'] = round(cpu_time() - started, 3)
+    return result
+
+def process_pdfs(input_dir, user, reservation, file_info):
+    """OCR every PDF in input_dir in parallel, charging the reservation once at the end
+
+    `file_info` maps each filename to its pre-flight page counts. Returns
+    (processed_files, output_dir, errors, credits_used).
+    """
     output_dir = tempfile.mkdtemp()
     processed_files = []
     errors = []
-    file_count = 0
-    
-    for filename in os.listdir(input_dir):
-        if filename.lower().endswith('.pdf'):
-            if user.credits <= 0 and user.subscription_status != 'premium':
-                errors.append("Insufficient credits. Please purchase more credits or upgrade to premium.")
-                break
-                
-            input_path = os.path.join(input_dir, filename)
-            output_path = os.path.join(output_dir, filename)
-            
-            try:
-                logger.info(f"Processing file: {filename}")
-                ocrmypdf.ocr(
-                    input_path, 
-                    output_path,
-                    deskew=True,
-                    skip_text=True,
-                    force_ocr=False,
-                    optimize=0,
-                    clean=False,
-                    fast_web_view=0,
-                    max_image_mpixels=0,
-                    progress_bar=False
-                )
-                processed_files.append(output_path)
-                file_count += 1
-                logger.info(f"Successfully processed: {filename}")
-                
-                # Deduct credits if not premium
-                if user.subscription_status != 'premium':
-                    user.credits -= 1
-                    db.session.commit()
-                
-            except ocrmypdf.exceptions.PriorOcrFoundError:
-                logger.info(f"File already has OCR: {filename}")
-                shutil.copy2(input_path, output_path)
-                processed_files.append(output_path)
-                file_count += 1
-            except Exception as e:
-                logger.error(f"Error processing {filename}: {str(e)}")
-                errors.append(f"{filename}: {str(e)}")
-                shutil.copy2(input_path, output_path)
-                processed_files.append(output_path)
-                file_count += 1
-    
-    # Record usage
-    usage = UsageHistory(
-        user_id=user.id,
-        files_processed=file_count,
-        credits_used=file_count if user.subscription_status != 'premium' else 0
-    )
-    db.session.add(usage)
-    db.session.commit()
-    
-    return processed_files, output_dir, errors
+    units = 0.0
+    usage = {'pages': 0, 'cpu_seconds': 0.0, 'cache_hits': 0}
+
+    filenames = sorted(f for f in os.listdir(input_dir) if f.lower().endswith('.pdf'))
+
+    try:
+        if filenames:
+            workers = max(1, min(app.config['OCR_WORKERS'], len(filenames)))
+            # Fewer files than workers leaves cores spare, so each worker's tesseract may use more threads
+            with ProcessPoolExecutor(max_workers=workers, initializer=resources.init_worker,
+                                     initargs=(resources.threads_per_worker(workers),)) as executor:
+                futures = {
+                    executor.submit(ocr_file, os.path.join(input_dir, f), os.path.join(output_dir, f),
+                                    app.config['CACHE_FOLDER']): f
+                    for f in filenames
+                }
+                for future in as_completed(futures):
+                    filename = futures[future]
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"Worker failed on {filename}: {str(e)}")
+                        errors.append(f"{filename}: {str(e)}")
+                        continue
+                    if result['error']:
+                        errors.append(result['error'])
+                    # Charge by page; cache hits, born-digital pages and failures are refunded
+                    info = file_info.get(filename, {})
+                    units += charged_units(info, from_cache=result['from_cache'], prior_ocr=result['prior_ocr'],
+                                           failed=bool(result['error']))
+                    usage['pages'] += info.get('page_count', 0)
+                    usage['cpu_seconds'] += result['cpu_seconds']
+                    usage['cache_hits'] += int(result['from_cache'])
+                    processed_files.append(os.path.join(output_dir, filename))
+    finally:
+        # Charge the metered pages (nothing for premium); the rest of the reservation is refunded
+        charged = units_to_credits(units) if user.subscription_status != 'premium' else 0
+        settle_reservation(reservation, len(processed_files), charged, usage)
+
+    return processed_files, output_dir, errors, charged
 
 @app.route('/')
 def index():
@@ -132,8 +434,77 @@ def index():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    usage_history = UsageHistory.query.filter_by(user_id=current_user.id).order_by(UsageHistory.timestamp.desc()).limit(10)
-    return render_template('dashboard.html', user=current_user, usage_history=usage_history)
+    jobs = job_history(current_user.id, page=1, per_page=10)
+    daily_usage = usage_by_day(DailyUserUsage, days=30, user_id=current_user.id)
+    return render_template('dashboard.html', user=current_user, jobs=jobs, daily_usage=daily_usage,
+                           usage_totals=usage_totals(daily_usage))
+
+def usage_by_day(model, days=30, **key):
+    """Rollup rows for the last `days` days, oldest first, with empty days filled in"""
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    rows = {row.day: row for row in model.query.filter_by(**key).filter(model.day >= since)}
+    series = []
+    for offset in range(days):
+        day = since + timedelta(days=offset)
+        row = rows.get(day)
+        entry = {'day': day.isoformat()}
+        entry.update({name: (getattr(row, name) if row else 0) for name in ROLLUP_COUNTERS})
+        entry['cpu_seconds'] = round(entry['cpu_seconds'], 1)
+        series.append(entry)
+    return series
+
+def usage_totals(series):
+    return {name: round(sum(entry[name] for entry in series), 1) for name in ROLLUP_COUNTERS}
+
+@app.route('/api/usage')
+@login_required
+def api_usage():
+    days = min(request.args.get('days', 30, type=int), 366)
+    series = usage_by_day(DailyUserUsage, days=days, user_id=current_user.id)
+    return jsonify({'days': series, 'totals': usage_totals(series)})
+
+@app.route('/admin/usage')
+@login_required
+def admin_usage():
+    if current_user.email not in app.config['ADMIN_EMAILS']:
+        return jsonify({'error': 'Not authorized'}), 403
+    days = min(request.args.get('days', 30, type=int), 366)
+    series = usage_by_day(DailyGlobalUsage, days=days)
+    return jsonify({'days': series, 'totals': usage_totals(series)})
+
+def job_history(user_id, page=1, per_page=20):
+    """One page of a user's jobs, newest first (served by ix_job_user_created)"""
+    query = Job.query.filter_by(user_id=user_id).order_by(Job.created_at.desc(), Job.id.desc())
+    return query.paginate(page=page, per_page=per_page, max_per_page=100, error_out=False)
+
+@app.route('/api/jobs')
+@login_required
+def api_jobs():
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', 20, type=int)
+    jobs = job_history(current_user.id, page=page, per_page=per_page)
+    return jsonify({
+        'jobs': [job.to_dict() for job in jobs.items],
+        'page': jobs.page,
+        'per_page': jobs.per_page,
+        'total': jobs.total,
+        'has_next': jobs.has_next
+    })
+
+@app.route('/jobs/<job_id>/download')
+@login_required
+def download_job(job_id):
+    job = db.session.get(Job, job_id)
+    if job is None or job.user_id != current_user.id:
+        return jsonify({'error': 'Job not found'}), 404
+    if job.storage_tier == EXPIRED:
+        return jsonify({'error': 'The results of this job have expired'}), 410
+
+    zip_path = result_store.fetch(job.id, job.storage_tier)
+    if zip_path is None:
+        return jsonify({'error': 'No processed files found'}), 404
+    return send_file(zip_path, as_attachment=True,
+                     download_name=f"processed_files_{job.created_at.strftime('%Y%m%d_%H%M%S')}.zip")
 
 @app.route('/login', methods=['GET', 'POST'])
 def login():
@@ -177,6 +548,36 @@ def logout():
     logout_user()
     return redirect(url_for('index'))
 
+def save_uploads(files, input_dir):
+    """Save uploaded PDFs and inspect them; returns {filename: file info}"""
+    file_info = {}
+    for file in files:
+        if file.filename and file.filename.lower().endswith('.pdf'):
+            filename = secure_filename(file.filename)
+            file_path = os.path.join(input_dir, filename)
+            file.save(file_path)
+            logger.info(f"Saved uploaded file: {filename}")
+            file_info[filename] = inspect_upload(file_path)
+    return file_info
+
+@app.route('/quote', methods=['POST'])
+@login_required
+def quote_files():
+    """Pre-flight quote: pages and credits a batch would cost, without processing it"""
+    files = request.files.getlist('files[]')
+    input_dir = tempfile.mkdtemp()
+    try:
+        file_info = save_uploads(files, input_dir)
+        if not file_info:
+            return jsonify({'error': 'No PDF files provided'}), 400
+        job_quote = quote(list(file_info.values()))
+        if current_user.subscription_status == 'premium':
+            job_quote['max_credits'] = job_quote['expected_credits'] = 0
+        return jsonify({'quote': job_quote, 'file_info': list(file_info.values()),
+                        'credits_available': current_user.credits})
+    finally:
+        shutil.rmtree(input_dir, ignore_errors=True)
+
 @app.route('/process', methods=['POST'])
 @login_required
 def process_files():
@@ -187,55 +588,82 @@ def process_files():
     if not files:
         return jsonify({'error': 'No files selected'}), 400
     
-    # Check credits
-    if current_user.subscription_status != 'premium' and current_user.credits < len(files):
-        return jsonify({'error': f'Insufficient credits. You need {len(files)} credits but have {current_user.credits}'}), 400
-    
+    input_dir = tempfile.mkdtemp()
+    output_dir = None
+    reservation = None
     try:
-        input_dir = tempfile.mkdtemp()
-        for file in files:
-            if file.filename:
-                filename = secure_filename(file.filename)
-                file_path = os.path.join(input_dir, filename)
-                file.save(file_path)
-                logger.info(f"Saved uploaded file: {filename}")
+        file_info = save_uploads(files, input_dir)
+        if not file_info:
+            return jsonify({'error': 'No PDF files provided'}), 400
+
+        # Reserve the worst-case page cost up front; settlement refunds what wasn't OCR'd
+        job_quote = quote(list(file_info.values()))
+        reservation = reserve_credits(current_user, job_quote['max_credits'])
+        if reservation is None:
+            return jsonify({
+                'error': f"Insufficient credits. This batch needs up to {job_quote['max_credits']} credits "
+                         f"but you have {current_user.credits}",
+                'quote': job_quote
+            }), 400
         
-        processed_files, output_dir, errors = process_pdfs(input_dir, current_user)
+        processed_files, output_dir, errors, credits_used = process_pdfs(input_dir, current_user, reservation, file_info)
         
         if not processed_files:
             return jsonify({'error': 'No files were processed successfully'}), 400
         
-        zip_path = os.path.join(app.config['UPLOAD_FOLDER'], f'processed_files_{current_user.id}.zip')
+        job_id = uuid.uuid4().hex
+        zip_path = os.path.join(output_dir, f'{job_id}.zip')
         with zipfile.ZipFile(zip_path, 'w') as zipf:
             for file_path in processed_files:
                 arcname = os.path.basename(file_path)
                 zipf.write(file_path, arcname)
                 logger.info(f"Added to zip: {arcname}")
+
+        # Keep this job's result for re-download instead of overwriting the previous batch
+        job = Job(
+            id=job_id,
+            user_id=current_user.id,
+            files_processed=len(processed_files),
+            credits_used=credits_used,
+            error_count=len(errors),
+            size_bytes=result_store.save(job_id, zip_path)
+        )
+        db.session.add(job)
+        db.session.commit()
+        maybe_sweep_results()
         
         return jsonify({
             'message': 'Processing complete',
-            'download_url': url_for('download'),
+            'job_id': job_id,
+            'download_url': url_for('download_job', job_id=job_id),
             'credits_remaining': current_user.credits,
+            'credits_used': credits_used,
+            'quote': job_quote,
             'errors': errors if errors else None
         })
     
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
+        if reservation is not None and reservation.status == 'reserved':
+            db.session.rollback()
+            settle_reservation(reservation, 0, 0)
         return jsonify({'error': f'An unexpected error occurred: {str(e)}'}), 500
     finally:
         try:
             shutil.rmtree(input_dir, ignore_errors=True)
-            shutil.rmtree(output_dir, ignore_errors=True)
+            if output_dir:
+                shutil.rmtree(output_dir, ignore_errors=True)
         except Exception as e:
             logger.error(f"Error during cleanup: {str(e)}")
 
 @app.route('/download')
 @login_required
 def download():
-    zip_path = os.path.join(app.config['UPLOAD_FOLDER'], f'processed_files_{current_user.id}.zip')
-    if not os.path.exists(zip_path):
+    """Download the user's most recent job"""
+    job = Job.query.filter_by(user_id=current_user.id).order_by(Job.created_at.desc()).first()
+    if job is None:
         return jsonify({'error': 'No processed files found'}), 404
-    return send_file(zip_path, as_attachment=True, download_name='processed_files.zip')
+    return download_job(job.id)
 
 @app.route('/pricing')
 def pricing():
@@ -311,4 +739,6 @@ def subscription_success():
 if __name__ == '__main__':
     with app.app_context():
         db.create_all()
+        release_stale_reservations()
+        sweep_results()
     app.run(debug=True, port=5001) 
\ No newline at end of file
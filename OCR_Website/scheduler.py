@@ -0,0 +1,203 @@
+"""
+Fair-share scheduling of OCR tasks across users and jobs.
+
+All jobs share one process pool. Tasks are queued per user and per job and
+dispatched with weighted round-robin: each user gets `weight` dispatches per
+round, and a user's jobs take turns within that share. Small jobs go to a
+fast lane that is always served first and has a slot reserved for it, so an
+interactive single-file upload never waits behind a bulk batch.
+
+With a concurrency controller, tasks also carry a peak memory estimate and
+the next task waits until the controller says it fits; the pool's size is
+only the ceiling.
+"""
+
+import threading
+import logging
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class _Task:
+    __slots__ = ('fn', 'args', 'future', 'job_id', 'memory_mb')
+
+    def __init__(self, fn, args, future, job_id, memory_mb=0):
+        self.fn = fn
+        self.args = args
+        self.future = future
+        self.job_id = job_id
+        self.memory_mb = memory_mb
+
+
+class _UserQueue:
+    """Queued tasks for one user, grouped by job"""
+
+    def __init__(self, weight):
+        self.weight = weight
+        self.credit = 0
+        self.jobs = OrderedDict()
+
+    def pop(self):
+        # Rotate through the user's jobs so one big job can't hide the others
+        job_id, tasks = next(iter(self.jobs.items()))
+        task = tasks.popleft()
+        if tasks:
+            self.jobs.move_to_end(job_id)
+        else:
+            del self.jobs[job_id]
+        return task
+
+
+class FairShareScheduler:
+    """Weighted round-robin dispatcher in front of a shared process pool"""
+
+    def __init__(self, slots, fast_lane_reserved=1, initializer=None, initargs=(), concurrency=None,
+                 retry_seconds=2.0):
+        self.slots = max(1, slots)
+        self.concurrency = concurrency
+        self.retry_seconds = retry_seconds
+        # Small pools keep every slot for bulk work; reserving one of two would halve throughput
+        self.fast_lane_reserved = min(fast_lane_reserved, max(0, self.slots - 2))
+        self._executor = ProcessPoolExecutor(max_workers=self.slots, initializer=initializer, initargs=initargs)
+        self._fast_lane = deque()
+        self._users = OrderedDict()
+        self._in_flight = 0
+        self._bulk_in_flight = 0
+        self._in_flight_memory = 0
+        self._retry_timer = None
+        # Re-entrant: a pool future that is already done runs its callback inside _dispatch
+        self._lock = threading.RLock()
+
+    def submit(self, user_key, job_id, fn, *args, weight=1, fast_lane=False, memory_mb=0):
+        """Queue fn(*args) on behalf of a user's job and return a Future for its result"""
+        future = Future()
+        task = _Task(fn, args, future, job_id, memory_mb)
+        with self._lock:
+            if fast_lane:
+                self._fast_lane.append(task)
+            else:
+                queue = self._users.get(user_key)
+                if queue is None:
+                    # A newly active user has had no service yet, so it goes next
+                    queue = self._users[user_key] = _UserQueue(weight)
+                    self._users.move_to_end(user_key, last=False)
+                queue.weight = max(1, weight)
+                queue.jobs.setdefault(job_id, deque()).append(task)
+            self._dispatch()
+        return future
+
+    def cancel_job(self, job_id):
+        """Drop a job's queued tasks; tasks already running finish normally"""
+        with self._lock:
+            dropped = [t for t in self._fast_lane if t.job_id == job_id]
+            self._fast_lane = deque(t for t in self._fast_lane if t.job_id != job_id)
+            for user_key, queue in list(self._users.items()):
+                dropped.extend(queue.jobs.pop(job_id, ()))
+                if not queue.jobs:
+                    del self._users[user_key]
+        for task in dropped:
+            # Cancelling alone doesn't wake as_completed()/wait(); notifying does
+            task.future.cancel()
+            task.future.set_running_or_notify_cancel()
+        return len(dropped)
+
+    def queued(self):
+        """Return the number of tasks waiting for a slot"""
+        with self._lock:
+            return len(self._fast_lane) + sum(
+                len(tasks) for queue in self._users.values() for tasks in queue.jobs.values())
+
+    def running(self):
+        """Return the number of running tasks and the sum of their memory estimates"""
+        with self._lock:
+            return self._in_flight, self._in_flight_memory
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            if self._retry_timer is not None:
+                self._retry_timer.cancel()
+        self._executor.shutdown(wait=wait)
+
+    def _peek_bulk_task(self):
+        user_key, queue = next(iter(self._users.items()))
+        return next(iter(queue.jobs.values()))[0]
+
+    def _next_bulk_task(self):
+        # Deficit-style weighted round-robin: a user keeps the turn until its credit runs out
+        while self._users:
+            user_key, queue = next(iter(self._users.items()))
+            if queue.credit <= 0:
+                queue.credit = queue.weight
+            task = queue.pop()
+            queue.credit -= 1
+            if not queue.jobs:
+                del self._users[user_key]
+            elif queue.credit <= 0:
+                self._users.move_to_end(user_key)
+            return task
+        return None
+
+    def _dispatch(self):
+        """Start queued tasks while slots are free (caller holds the lock)"""
+        while self._in_flight < self.slots:
+            if self._fast_lane:
+                bulk = False
+                if not self._fits(self._fast_lane[0]):
+                    return
+                task = self._fast_lane.popleft()
+            elif self._bulk_in_flight < self.slots - self.fast_lane_reserved and self._users:
+                bulk = True
+                # The head task waits for memory rather than letting smaller ones overtake it indefinitely
+                if not self._fits(self._peek_bulk_task()):
+                    return
+                task = self._next_bulk_task()
+            else:
+                return
+
+            if not task.future.set_running_or_notify_cancel():
+                continue
+            self._in_flight += 1
+            self._in_flight_memory += task.memory_mb
+            if bulk:
+                self._bulk_in_flight += 1
+            try:
+                pool_future = self._executor.submit(task.fn, *task.args)
+            except Exception as e:
+                self._in_flight -= 1
+                self._in_flight_memory -= task.memory_mb
+                if bulk:
+                    self._bulk_in_flight -= 1
+                task.future.set_exception(e)
+                continue
+            pool_future.add_done_callback(lambda f, task=task, bulk=bulk: self._on_done(task, bulk, f))
+
+    def _fits(self, task):
+        """Ask the concurrency controller whether a task can start now (caller holds the lock)"""
+        if self.concurrency is None or self.concurrency.can_start(self._in_flight, self._in_flight_memory,
+                                                                  task.memory_mb):
+            return True
+        # Completions re-dispatch, but memory freed elsewhere doesn't, so look again shortly
+        if self._retry_timer is None:
+            self._retry_timer = threading.Timer(self.retry_seconds, self._retry)
+            self._retry_timer.daemon = True
+            self._retry_timer.start()
+        return False
+
+    def _retry(self):
+        with self._lock:
+            self._retry_timer = None
+            self._dispatch()
+
+    def _on_done(self, task, bulk, pool_future):
+        with self._lock:
+            self._in_flight -= 1
+            self._in_flight_memory -= task.memory_mb
+            if bulk:
+                self._bulk_in_flight -= 1
+            self._dispatch()
+        try:
+            task.future.set_result(pool_future.result())
+        except Exception as e:
+            task.future.set_exception(e)
@@ -0,0 +1,181 @@
+"""
+Per-job scratch space.
+
+Every job gets one scratch directory on disk, next to the OCR cache so that
+outputs can be hardlinked into the cache instead of copied, and a "hot"
+directory for short-lived intermediates that is placed on tmpfs when the job
+is small enough to fit. Usage is checked against a per-job quota, and the
+directories are removed when the job ends, when the process exits, or by a
+startup sweep if the process died without cleaning up.
+"""
+
+import os
+import time
+import shutil
+import atexit
+import fcntl
+import logging
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Linux FICLONE ioctl: share extents with the source file on btrfs/XFS
+FICLONE = 0x40049409
+
+# Only plan to use this fraction of the free space on tmpfs
+TMPFS_HEADROOM = 0.5
+# A file's intermediates (rasters, re-encoded images) take a multiple of its size
+HOT_BYTES_PER_INPUT_BYTE = 4
+
+_live_spaces = {}
+_live_lock = threading.Lock()
+
+
+class ScratchQuotaExceeded(Exception):
+    """Raised when a job writes more scratch data than its quota allows"""
+
+
+def link_or_copy(src, dst, hardlink=True):
+    """
+    Place `src` at `dst` by hardlink, then reflink, falling back to a copy.
+
+    A hardlink shares the file itself, so a later in-place edit of either name
+    changes both; pass hardlink=False wherever `dst` (or `src`) is a file a
+    user owns, and only a reflink or a copy is made.
+    """
+    if os.path.exists(dst):
+        os.remove(dst)
+    if hardlink:
+        try:
+            os.link(src, dst)
+            return 'link'
+        except OSError:
+            pass
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return 'reflink'
+    except OSError:
+        pass
+    shutil.copyfile(src, dst)
+    return 'copy'
+
+
+def directory_size(path):
+    """Total size in bytes of the regular files under `path`"""
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.lstat(os.path.join(dirpath, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def choose_work_dir(input_path, hot_dir, cold_dir):
+    """Pick tmpfs for a single file's intermediates when they fit, disk otherwise"""
+    if hot_dir and hot_dir != cold_dir and os.path.isdir(hot_dir):
+        try:
+            needed = os.path.getsize(input_path) * HOT_BYTES_PER_INPUT_BYTE
+            if needed < shutil.disk_usage(hot_dir).free * TMPFS_HEADROOM:
+                return hot_dir
+        except OSError:
+            pass
+    return cold_dir
+
+
+class ScratchSpace:
+    """Scratch directories for one job"""
+
+    def __init__(self, job_id, root, tmpfs_root='/dev/shm', expected_bytes=0, quota_bytes=None):
+        self.job_id = job_id
+        self.quota_bytes = quota_bytes
+        os.makedirs(root, exist_ok=True)
+        self.root = tempfile.mkdtemp(prefix=f'job_{job_id}_', dir=root)
+
+        # Intermediates go to tmpfs only if the whole job's working set fits comfortably
+        self.hot = os.path.join(self.root, 'hot')
+        if tmpfs_root and os.path.isdir(tmpfs_root):
+            try:
+                free = shutil.disk_usage(tmpfs_root).free
+                if expected_bytes * HOT_BYTES_PER_INPUT_BYTE < free * TMPFS_HEADROOM:
+                    self.hot = tempfile.mkdtemp(prefix=f'ocr_job_{job_id}_', dir=tmpfs_root)
+            except OSError as e:
+                logger.warning(f"Could not use tmpfs at {tmpfs_root}: {str(e)}")
+        os.makedirs(self.hot, exist_ok=True)
+        self.on_tmpfs = not self.hot.startswith(self.root)
+        self._cleaned = False
+
+        with _live_lock:
+            _live_spaces[self.root] = self
+
+    def mkdir(self, name):
+        """Create a named subdirectory of the job's disk scratch"""
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        return path
+
+    def usage(self):
+        """Bytes currently used by the job across disk and tmpfs"""
+        used = directory_size(self.root)
+        if self.on_tmpfs:
+            used += directory_size(self.hot)
+        return used
+
+    def check_quota(self):
+        """Raise ScratchQuotaExceeded if the job has outgrown its quota"""
+        if self.quota_bytes:
+            used = self.usage()
+            if used > self.quota_bytes:
+                raise ScratchQuotaExceeded(
+                    f"Job used {used / (1024 * 1024):.0f}MB of scratch space, "
+                    f"over its {self.quota_bytes / (1024 * 1024):.0f}MB quota")
+
+    def cleanup(self):
+        """Remove all of the job's scratch data; safe to call more than once"""
+        if self._cleaned:
+            return
+        self._cleaned = True
+        shutil.rmtree(self.root, ignore_errors=True)
+        if self.on_tmpfs:
+            shutil.rmtree(self.hot, ignore_errors=True)
+        with _live_lock:
+            _live_spaces.pop(self.root, None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.cleanup()
+
+
+def sweep_stale(roots, max_age_seconds=24 * 60 * 60):
+    """Remove job scratch left behind by processes that died without cleaning up"""
+    cutoff = time.time() - max_age_seconds
+    removed = 0
+    for root in roots:
+        if not root or not os.path.isdir(root):
+            continue
+        for name in os.listdir(root):
+            path = os.path.join(root, name)
+            if not (name.startswith('job_') or name.startswith('ocr_job_')) or path in _live_spaces:
+                continue
+            try:
+                if os.path.isdir(path) and os.stat(path).st_mtime < cutoff:
+                    shutil.rmtree(path, ignore_errors=True)
+                    removed += 1
+            except OSError:
+                pass
+    if removed:
+        logger.info(f"Removed {removed} stale scratch directories")
+    return removed
+
+
+@atexit.register
+def _cleanup_live_spaces():
+    with _live_lock:
+        spaces = list(_live_spaces.values())
+    for space in spaces:
+        space.cleanup()
@@ -0,0 +1,55 @@
+"""
+Single-flight registry: concurrent callers asking for the same key share one
+in-flight computation instead of starting their own.
+"""
+
+import threading
+from concurrent.futures import Future
+
+
+def chain_future(source, target):
+    """Resolve `target` with the outcome of `source` once it finishes"""
+    def _copy(f):
+        if f.cancelled():
+            if target.cancel():
+                target.set_running_or_notify_cancel()
+        elif f.exception() is not None:
+            target.set_exception(f.exception())
+        else:
+            target.set_result(f.result())
+    source.add_done_callback(_copy)
+
+
+class SingleFlight:
+    """Share one in-flight Future per key between concurrent callers"""
+
+    def __init__(self):
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, submit):
+        """
+        Return (future, shared). `submit` is only called, outside the lock, when no
+        call for `key` is already in flight; otherwise the existing future is shared.
+        """
+        with self._lock:
+            existing = self._futures.get(key)
+            if existing is not None:
+                return existing, True
+            placeholder = self._futures[key] = Future()
+
+        placeholder.add_done_callback(lambda f: self._release(key, f))
+        try:
+            chain_future(submit(), placeholder)
+        except Exception as e:
+            placeholder.set_exception(e)
+        return placeholder, False
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._futures)
+
+    def _release(self, key, future):
+        with self._lock:
+            if self._futures.get(key) is future:
+                del self._futures[key]
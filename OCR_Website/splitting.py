@@ -0,0 +1,138 @@
+"""
+Split very large PDFs into page chunks for OCR, and merge the results back.
+
+A document of thousands of pages OCR'd as one task can run for hours, and a
+single failure or timeout throws all of that work away. Split into chunks of
+a fixed number of pages, each chunk is an ordinary document to the pipeline:
+it is scheduled, cached under its own content hash, timed out and retried on
+its own, and the OCR'd chunks are concatenated in page order at the end.
+
+Chunks are written with a deterministic document ID, so splitting the same
+file again produces byte-identical chunks and every chunk that finished
+before a failure is a cache hit when the file is resubmitted.
+
+The merged document is the original with each OCR'd page's content swapped
+into the original page object, rather than a new file assembled from the
+chunks, so everything that refers to pages (outlines, named destinations,
+page labels, form fields, annotations and the structure tree) still points
+at the right ones.
+"""
+
+import os
+import logging
+
+import pikepdf
+
+logger = logging.getLogger(__name__)
+
+# What OCR changes on a page; everything else (annotations, structure links...) stays the original's
+PAGE_CONTENT_KEYS = ('/Contents', '/Resources', '/MediaBox', '/CropBox', '/Rotate')
+# XMP properties that claim PDF/A conformance
+PDFA_XMP_KEYS = ('pdfaid:part', 'pdfaid:conformance', 'pdfaid:amd')
+
+
+def page_count(pdf_path):
+    """Number of pages in a PDF, without reading their content"""
+    with pikepdf.open(pdf_path) as pdf:
+        return len(pdf.pages)
+
+
+def chunk_ranges(pages, chunk_pages):
+    """Split `pages` into consecutive (start, stop) ranges of at most `chunk_pages` pages"""
+    chunk_pages = max(1, chunk_pages)
+    return [(start, min(start + chunk_pages, pages)) for start in range(0, pages, chunk_pages)]
+
+
+def chunk_name(filename, start, stop):
+    """File name for the chunk of `filename` holding pages start+1..stop"""
+    stem = os.path.splitext(filename)[0]
+    return f"{stem}.pages{start + 1:05d}-{stop:05d}.pdf"
+
+
+def split_pdf(pdf_path, ranges, output_dir):
+    """Write each (start, stop) page range of a PDF to its own file in `output_dir`; returns the paths"""
+    paths = []
+    filename = os.path.basename(pdf_path)
+    with pikepdf.open(pdf_path) as source:
+        for start, stop in ranges:
+            path = os.path.join(output_dir, chunk_name(filename, start, stop))
+            with pikepdf.Pdf.new() as chunk:
+                chunk.pages.extend(source.pages[start:stop])
+                chunk.save(path, deterministic_id=True)
+            paths.append(path)
+    logger.info(f"Split {filename} into {len(paths)} chunks")
+    return paths
+
+
+def copy_foreign(pdf, source, obj):
+    """Copy `obj` from the Pdf `source` into `pdf`; direct objects are made indirect first, as qpdf requires"""
+    return pdf.copy_foreign(obj if obj.is_indirect else source.make_indirect(obj))
+
+
+def swap_page_content(pdf, target, chunk, page):
+    """Give `target`, a page of `pdf`, the content, resources and geometry of `page` from `chunk`"""
+    source = page.obj
+    # Copied through an indirect holder, so the chunk's page tree doesn't come along via /Parent
+    holder = pikepdf.Dictionary({key: source[key] for key in PAGE_CONTENT_KEYS if key in source})
+    copied = copy_foreign(pdf, chunk, holder)
+    obj = target.obj
+    for key in PAGE_CONTENT_KEYS:
+        if key in copied:
+            obj[key] = copied[key]
+        elif key == '/CropBox':
+            obj[key] = copied['/MediaBox']
+        elif key == '/Rotate':
+            # Explicit, so a /Rotate inherited from the original page tree doesn't apply on top
+            obj[key] = 0
+        elif key in obj:
+            del obj[key]
+
+
+def drop_pdfa_claim(pdf):
+    """Remove the output intent and XMP conformance properties that declare `pdf` to be PDF/A"""
+    if '/OutputIntents' in pdf.Root:
+        del pdf.Root.OutputIntents
+    if '/Metadata' in pdf.Root:
+        with pdf.open_metadata(set_pikepdf_as_editor=False, update_docinfo=False) as meta:
+            for key in PDFA_XMP_KEYS:
+                if key in meta:
+                    del meta[key]
+
+
+def merge_chunks(original_path, ranges, chunk_paths, output_path, pdfa=True):
+    """
+    Write `original_path` to `output_path` with the pages of each OCR'd chunk swapped in.
+
+    `chunk_paths[i]` holds the OCR'd pages of `ranges[i]`, or is None to keep
+    those pages as they are. With `pdfa`, the output intent and PDF/A XMP of
+    the first chunk that has them are carried over, so a merge of PDF/A
+    chunks still declares itself PDF/A; without it (some pages passed through
+    unconverted) any PDF/A claim is removed, since it would no longer be true.
+    """
+    with pikepdf.open(original_path) as merged:
+        conformance = None
+        for (start, stop), path in zip(ranges, chunk_paths):
+            if path is None:
+                continue
+            with pikepdf.open(path) as chunk:
+                if len(chunk.pages) != stop - start:
+                    raise ValueError(f"{os.path.basename(path)} has {len(chunk.pages)} pages, "
+                                     f"expected {stop - start}")
+                for offset, page in enumerate(chunk.pages):
+                    swap_page_content(merged, merged.pages[start + offset], chunk, page)
+                if conformance is None and '/OutputIntents' in chunk.Root:
+                    with chunk.open_metadata() as meta:
+                        conformance = (copy_foreign(merged, chunk, chunk.Root.OutputIntents),
+                                       {key: meta[key] for key in PDFA_XMP_KEYS if key in meta})
+
+        if not pdfa:
+            drop_pdfa_claim(merged)
+        elif conformance is not None:
+            output_intents, claim = conformance
+            merged.Root.OutputIntents = output_intents
+            with merged.open_metadata(set_pikepdf_as_editor=False) as meta:
+                if '/Metadata' not in merged.Root or not len(meta):
+                    meta.load_from_docinfo(merged.docinfo)
+                for key, value in claim.items():
+                    meta[key] = value
+        merged.save(output_path, deterministic_id=True)
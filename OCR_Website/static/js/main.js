@@ -5,6 +5,7 @@ const dropZone = document.getElementById('drop-zone');
 const fileInput = document.getElementById('file-input');
 const fileList = document.getElementById('file-list');
 const processBtn = document.getElementById('process-btn');
+const outputMode = document.getElementById('output-mode');
 const progress = document.getElementById('progress');
 const progressBar = document.getElementById('progress-bar');
 const downloadSection = document.getElementById('download-section');
@@ -16,7 +17,7 @@ const darkModeToggle = document.getElementById('dark-mode-toggle');
 let files = [];
 // Make files globally accessible for demo
 window.files = files;
-let lastLogTimestamp = null;
+let lastLogSeq = 0;
 let logUpdateInterval = null;
 let statusUpdateInterval = null;
 let processingStartTime = null;
@@ -100,17 +101,27 @@ function handleDrop(e) {
     handleFiles({ target: { files: droppedFiles } });
 }
 
+// Scanned images are converted to PDF on the server
+function isImage(name) {
+    return /\.(tiff?|jpe?g|png)$/i.test(name);
+}
+
+// ZIP and TAR archives are unpacked on the server
+function isArchive(name) {
+    return /\.(zip|tar|tgz|tbz2|txz|tar\.gz|tar\.bz2|tar\.xz)$/i.test(name);
+}
+
 // Make handleFiles available globally for demo override
 window.handleFiles = function(e) {
     updateStepHighlight(1);
     const newFilesArray = [...e.target.files];
     
-    // Filter for PDF files only
-    const newPdfFiles = newFilesArray.filter(file => file.type === 'application/pdf');
+    // Filter for PDF files, scanned images and ZIP/TAR archives of them
+    const newPdfFiles = newFilesArray.filter(file => file.type === 'application/pdf' || isImage(file.name) || isArchive(file.name));
     
-    // Check if any non-PDF files were filtered out
+    // Check if any other files were filtered out
     if (newPdfFiles.length < newFilesArray.length) {
-        showError("Some files were skipped because they are not PDFs.");
+        showError("Some files were skipped because they are not PDFs, TIFF/JPEG/PNG images or ZIP/TAR archives.");
     }
     
     // Check file size limit (1.5GB total)
@@ -307,6 +318,9 @@ processBtn.addEventListener('click', async () => {
     updateStepHighlight(3);
     const formData = new FormData();
     files.forEach(file => formData.append('files[]', file));
+    if (outputMode) {
+        formData.append('output_mode', outputMode.value);
+    }
 
     progress.classList.remove('hidden');
     processBtn.disabled = true;
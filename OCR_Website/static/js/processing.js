@@ -41,27 +41,29 @@ async function fetchStatus() {
 
 async function fetchLogs() {
     try {
-        const response = await fetch('/logs');
+        // Only ask for our own job's lines, and only those we haven't seen yet
+        if (!currentProcessId) return;
+        const params = new URLSearchParams({ job: currentProcessId, after: lastLogSeq });
+
+        const response = await fetch(`/logs?${params}`);
         if (response.ok) {
-            const logs = await response.json();
+            const data = await response.json();
+            const logs = data.entries;
             const logDisplay = document.getElementById('log-display');
+            lastLogSeq = data.cursor;
             
             if (logs.length > 0) {
                 // Add new logs
                 logs.forEach(log => {
-                    if (!lastLogTimestamp || log.timestamp > lastLogTimestamp) {
-                        // Create log entry with appropriate color based on level
-                        let levelClass = 'log-info'; // Default for INFO
-                        if (log.level === 'ERROR') levelClass = 'log-error';
-                        if (log.level === 'WARNING') levelClass = 'log-warning';
-                        
-                        const logEntry = document.createElement('div');
-                        logEntry.className = `log-entry ${levelClass}`;
-                        logEntry.innerHTML = `<span class="log-timestamp">[${log.timestamp}]</span> ${log.message}`;
-                        logDisplay.appendChild(logEntry);
-                        
-                        lastLogTimestamp = log.timestamp;
-                    }
+                    // Create log entry with appropriate color based on level
+                    let levelClass = 'log-info'; // Default for INFO
+                    if (log.level === 'ERROR') levelClass = 'log-error';
+                    if (log.level === 'WARNING') levelClass = 'log-warning';
+                    
+                    const logEntry = document.createElement('div');
+                    logEntry.className = `log-entry ${levelClass}`;
+                    logEntry.innerHTML = `<span class="log-timestamp">[${log.timestamp}]</span> ${log.message}`;
+                    logDisplay.appendChild(logEntry);
                 });
                 
                 // Auto-scroll to bottom if enabled
@@ -80,10 +82,11 @@ function startUpdates() {
     if (logUpdateInterval) clearInterval(logUpdateInterval);
     if (statusUpdateInterval) clearInterval(statusUpdateInterval);
     
-    // Reset log display and timestamp
+    // Reset log display and cursor
     const logDisplay = document.getElementById('log-display');
     logDisplay.innerHTML = '<div class="log-entry">Starting process...</div>';
-    lastLogTimestamp = null;
+    lastLogSeq = 0;
+    currentProcessId = null;
     processingStartTime = Date.now();
     
     // Start fetching logs and status periodically
@@ -0,0 +1,130 @@
+"""
+Content-hashed, precompressed static assets.
+
+`python static_assets.py` copies each CSS/JS file under static/ to
+static/dist/ with a content hash in its name, writes .gz and .br (when the
+brotli package is installed) variants next to it, and records the mapping in
+static/dist/manifest.json.
+
+`init_static_assets(app)` makes url_for('static', ...) return the hashed
+names from that manifest, and serves them with the best precompressed variant
+the client accepts and far-future immutable cache headers. Without a build,
+assets are served as before.
+"""
+
+import os
+import sys
+import gzip
+import json
+import hashlib
+import logging
+import mimetypes
+
+from flask import request, send_from_directory
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+ASSET_EXTENSIONS = ('.css', '.js')
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+# Variants in order of preference: (Accept-Encoding token, file suffix)
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+
+
+def build(static_folder):
+    """Write hashed, precompressed copies of the static assets and return the manifest"""
+    dist_root = os.path.join(static_folder, DIST_DIR)
+    manifest = {}
+
+    for dirpath, dirnames, filenames in os.walk(static_folder):
+        # Don't rebuild our own output
+        dirnames[:] = [d for d in dirnames if os.path.join(dirpath, d) != dist_root]
+        for name in sorted(filenames):
+            if not name.endswith(ASSET_EXTENSIONS):
+                continue
+            source = os.path.join(dirpath, name)
+            logical = os.path.relpath(source, static_folder).replace(os.sep, '/')
+            with open(source, 'rb') as f:
+                data = f.read()
+
+            stem, ext = os.path.splitext(logical)
+            hashed = f"{DIST_DIR}/{stem}.{hashlib.sha256(data).hexdigest()[:12]}{ext}"
+            target = os.path.join(static_folder, hashed)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(target, 'wb') as f:
+                f.write(data)
+            # mtime=0 keeps the .gz byte-identical across builds
+            with open(target + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            if brotli is not None:
+                with open(target + '.br', 'wb') as f:
+                    f.write(brotli.compress(data, quality=11))
+
+            manifest[logical] = hashed
+            logger.info(f"{logical} -> {hashed}")
+
+    if brotli is None:
+        logger.warning("brotli is not installed; only .gz variants were written")
+
+    os.makedirs(dist_root, exist_ok=True)
+    with open(os.path.join(dist_root, MANIFEST_NAME), 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    return manifest
+
+
+def load_manifest(static_folder):
+    """Return the logical -> hashed name mapping, or {} if the assets haven't been built"""
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def init_static_assets(app):
+    """Serve built assets under hashed names with precompression and immutable caching"""
+    manifest = load_manifest(app.static_folder)
+    if not manifest:
+        logger.info("No static asset manifest found; serving unhashed assets")
+        return
+    hashed_names = set(manifest.values())
+
+    @app.url_defaults
+    def hashed_static_url(endpoint, values):
+        if endpoint == 'static' and values.get('filename') in manifest:
+            values['filename'] = manifest[values['filename']]
+
+    def serve_static(filename):
+        if filename not in hashed_names:
+            return app.send_static_file(filename)
+
+        response = None
+        for encoding, suffix in ENCODINGS:
+            # A parsed lookup, so 'br;q=0' is a refusal and 'gzip' doesn't match inside another token
+            if request.accept_encodings[encoding] > 0 and os.path.exists(os.path.join(app.static_folder, filename + suffix)):
+                response = send_from_directory(app.static_folder, filename + suffix, max_age=31536000)
+                # Keep the original type rather than application/gzip
+                response.mimetype = mimetypes.guess_type(filename)[0]
+                response.headers['Content-Encoding'] = encoding
+                break
+        if response is None:
+            response = send_from_directory(app.static_folder, filename, max_age=31536000)
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.headers['Vary'] = 'Accept-Encoding'
+        return response
+
+    app.view_functions['static'] = serve_static
+    logger.info(f"Serving {len(manifest)} hashed static assets")
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    folder = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    build(folder)
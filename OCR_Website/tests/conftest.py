@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+# The app's modules live at the top of OCR_Website, not in a package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def web_app(tmp_path_factory):
+    """
+    The web app module, imported against a throwaway database and with its upload, cache and
+    scratch folders (and the ones it creates at import) in a temporary directory
+    """
+    root = tmp_path_factory.mktemp('web_app')
+    os.environ['DATABASE_URL'] = f"sqlite:///{root / 'app.db'}"
+    cwd = os.getcwd()
+    os.chdir(root)
+    try:
+        import app as web
+    finally:
+        os.chdir(cwd)
+    web.app.config.update(
+        TESTING=True,
+        UPLOAD_FOLDER=str(root / 'uploads'),
+        CACHE_FOLDER=str(root / 'ocr_cache'),
+        SCRATCH_FOLDER=str(root / 'ocr_cache' / '.scratch'),
+    )
+    return web
@@ -0,0 +1,141 @@
+import threading
+
+import pikepdf
+import pytest
+from PIL import Image
+
+import admission
+from admission import (DEFAULT_DPI, DEFAULT_PAGE_SIZE_IN, WORKER_BASE_MEMORY_MB, AdmissionController,
+                       estimate_image_dpi, estimate_job_cost, estimate_task_memory_mb, largest_page_inches)
+
+
+def scanned_pdf(path, dpi, size_in=(8.5, 11)):
+    """A one-page PDF holding a single image scanned at `dpi`"""
+    image = Image.new('L', (int(size_in[0] * dpi), int(size_in[1] * dpi)), 255)
+    image.save(path, 'PDF', resolution=dpi)
+    return str(path)
+
+
+def born_digital_pdf(path, pages=((612, 792),)):
+    pdf = pikepdf.new()
+    for width, height in pages:
+        pdf.add_blank_page(page_size=(width, height))
+    pdf.save(path)
+    return str(path)
+
+
+def test_image_dpi_comes_from_the_embedded_scan(tmp_path):
+    assert estimate_image_dpi(scanned_pdf(tmp_path / 'scan.pdf', 200)) == 200
+
+
+def test_born_digital_pages_have_no_image_dpi(tmp_path):
+    assert estimate_image_dpi(born_digital_pdf(tmp_path / 'text.pdf')) == 0
+
+
+def test_unreadable_pdf_falls_back_to_defaults(tmp_path):
+    broken = tmp_path / 'broken.pdf'
+    broken.write_bytes(b'not a pdf')
+    assert estimate_image_dpi(str(broken)) == DEFAULT_DPI
+    assert largest_page_inches(str(broken)) == DEFAULT_PAGE_SIZE_IN
+
+
+def test_largest_page_wins(tmp_path):
+    path = born_digital_pdf(tmp_path / 'mixed.pdf', pages=[(612, 792), (1224, 792), (612, 1008)])
+    assert largest_page_inches(path) == (17.0, 11.0)
+
+
+def test_task_memory_grows_with_page_area_and_dpi_squared():
+    letter_300 = estimate_task_memory_mb({'dpi': 300, 'page_size_in': (8.5, 11)})
+    letter_600 = estimate_task_memory_mb({'dpi': 600, 'page_size_in': (8.5, 11)})
+    tabloid_300 = estimate_task_memory_mb({'dpi': 300, 'page_size_in': (11, 17)})
+    raster = letter_300 - WORKER_BASE_MEMORY_MB
+    assert letter_600 - WORKER_BASE_MEMORY_MB == pytest.approx(raster * 4, rel=0.01)
+    assert tabloid_300 - WORKER_BASE_MEMORY_MB == pytest.approx(raster * 2, rel=0.01)
+    # Born-digital pages are passed through, not rasterized
+    assert estimate_task_memory_mb({'dpi': 0}) == WORKER_BASE_MEMORY_MB
+
+
+def test_job_cost_adds_up_files():
+    files = [
+        {'page_count': 10, 'size_mb': 20, 'dpi': 300},
+        {'page_count': 10, 'size_mb': 4, 'dpi': 0},
+    ]
+    cost = estimate_job_cost(files, workers=4)
+    assert cost['disk_mb'] == 24 * admission.DISK_COPIES_PER_FILE
+    assert cost['cpu_seconds'] == 10 * admission.SECONDS_PER_PAGE_AT_300_DPI + 10 * admission.SECONDS_PER_TEXT_PAGE
+    # Two files can't keep more than two workers busy
+    assert cost['wall_seconds'] == round(cost['cpu_seconds'] / 2, 1)
+    assert cost['memory_mb'] == round(2 * estimate_task_memory_mb(files[0]), 1)
+
+
+@pytest.fixture
+def machine(monkeypatch):
+    """Free disk and memory the controller sees, in MB; tests adjust them"""
+    free = {'disk': 10000, 'memory': 4000}
+    monkeypatch.setattr(admission, 'free_disk_mb', lambda paths: free['disk'])
+    monkeypatch.setattr(admission, 'available_memory_mb', lambda: free['memory'])
+    return free
+
+
+def cost(disk_mb=100, memory_mb=500, cpu_seconds=60, wall_seconds=60):
+    return {'disk_mb': disk_mb, 'memory_mb': memory_mb, 'cpu_seconds': cpu_seconds, 'wall_seconds': wall_seconds}
+
+
+def controller(**options):
+    return AdmissionController(workers=2, disk_reserve_mb=1000, memory_reserve_mb=500, **options)
+
+
+def test_job_that_fits_is_accepted_with_an_eta(machine):
+    decision = controller().try_admit('a', cost(wall_seconds=30))
+    assert decision == {'decision': 'accept', 'eta_seconds': 30}
+
+
+def test_job_larger_than_the_machine_is_rejected(machine):
+    assert controller().try_admit('a', cost(disk_mb=9500))['decision'] == 'reject'
+    assert controller().try_admit('a', cost(memory_mb=3600))['decision'] == 'reject'
+
+
+def test_job_that_fits_once_others_finish_is_deferred(machine):
+    gate = controller()
+    assert gate.try_admit('a', cost(disk_mb=5000))['decision'] == 'accept'
+    # The first job's files haven't been written yet; its reservation still counts
+    decision = gate.try_admit('b', cost(disk_mb=5000, cpu_seconds=0))
+    assert decision['decision'] == 'defer'
+    assert decision['retry_after'] == 31
+
+    gate.release('a')
+    assert gate.try_admit('b', cost(disk_mb=5000))['decision'] == 'accept'
+
+
+def test_full_queue_defers_but_an_idle_server_takes_any_length_of_job(machine):
+    gate = controller(max_backlog_seconds=100)
+    assert gate.try_admit('long', cost(cpu_seconds=400, wall_seconds=400))['decision'] == 'accept'
+    decision = gate.try_admit('next', cost(wall_seconds=10))
+    assert decision['decision'] == 'defer'
+    assert decision['reason'] == 'The processing queue is full'
+    assert gate.backlog() == 200
+
+
+def test_concurrent_admissions_cannot_overbook_the_disk(machine):
+    gate = controller()
+    decisions = []
+    barrier = threading.Barrier(8)
+
+    def admit(n):
+        barrier.wait()
+        decisions.append(gate.try_admit(n, cost(disk_mb=2000))['decision'])
+
+    threads = [threading.Thread(target=admit, args=(n,)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # 10000MB free less the 1000MB reserve holds four 2000MB jobs
+    assert decisions.count('accept') == 4
+
+
+def test_upload_size_precheck(machine):
+    gate = controller()
+    assert gate.check_upload_size(1024 * 1024 * 100)['decision'] == 'accept'
+    assert gate.check_upload_size(1024 * 1024 * 2000)['decision'] == 'reject'
+    assert gate.check_upload_size(None)['decision'] == 'accept'
@@ -0,0 +1,229 @@
+import io
+import itertools
+import os
+import zipfile
+
+import pytest
+
+from api import hash_token
+
+PDF = b'%PDF-1.4 test document'
+_names = itertools.count()
+
+
+@pytest.fixture
+def api(web_app, monkeypatch, tmp_path):
+    """The API with job starts recorded instead of run; `api.started` lists each start's arguments"""
+    backend = web_app.app.extensions['ocr_api']
+    started = []
+
+    def start_job(process_id, scratch, filenames, user, output_mode, on_complete=None, on_file=None):
+        inputs = {name: open(os.path.join(scratch.mkdir('input'), name), 'rb').read() for name in filenames}
+        started.append({'id': process_id, 'inputs': inputs, 'output_mode': output_mode, 'on_complete': on_complete})
+        scratch.cleanup()
+        return {'eta_seconds': 12, 'quote': {'files': len(filenames)}}
+
+    monkeypatch.setattr(backend, 'start_job', start_job)
+    monkeypatch.setitem(web_app.app.config, 'SCRATCH_TMPFS', None)
+    monkeypatch.setitem(web_app.app.config, 'UPLOAD_FOLDER', str(tmp_path))
+    backend.started = started
+    yield backend
+    del backend.started
+
+
+def make_user(web_app):
+    with web_app.app.app_context():
+        n = next(_names)
+        user = web_app.User(username=f'api{n}', email=f'api{n}@example.com', password_hash='x')
+        web_app.db.session.add(user)
+        web_app.db.session.commit()
+        return user.id
+
+
+def login(web_app, user_id):
+    client = web_app.app.test_client()
+    with client.session_transaction() as session:
+        session['_user_id'] = str(user_id)
+        session['_fresh'] = True
+    return client
+
+
+def new_token(web_app, user_id=None):
+    """A logged-in client and a fresh token for a new (or the given) user"""
+    client = login(web_app, user_id or make_user(web_app))
+    response = client.post('/api/v1/tokens', json={'name': 'ci'})
+    assert response.status_code == 201
+    return client, response.get_json()
+
+
+def bearer(token, **headers):
+    return dict(headers, Authorization=f"Bearer {token['token']}")
+
+
+def upload(client, token, *files, headers=None, **form):
+    data = dict(form, **{'files[]': [(io.BytesIO(body), name) for name, body in files]})
+    return client.post('/api/v1/jobs', data=data, content_type='multipart/form-data',
+                       headers=bearer(token, **(headers or {})))
+
+
+def test_tokens_are_shown_once_and_stored_hashed(web_app, api):
+    client, token = new_token(web_app)
+    assert token['token'].startswith('ocr_') and token['webhook_secret']
+    assert token['prefix'] == token['token'][:10]
+
+    listed = client.get('/api/v1/tokens').get_json()['tokens']
+    assert [entry['id'] for entry in listed] == [token['id']]
+    assert 'token' not in listed[0] and 'webhook_secret' not in listed[0]
+    with web_app.app.app_context():
+        assert web_app.ApiToken.query.filter_by(token_hash=hash_token(token['token'])).count() == 1
+    # Token management needs a browser session, not a token
+    assert web_app.app.test_client().get('/api/v1/tokens', headers=bearer(token)).status_code in (302, 401)
+
+
+def test_requests_need_a_live_token(web_app, api):
+    client, token = new_token(web_app)
+    anonymous = client.get('/api/v1/jobs', headers={'Authorization': ''})
+    assert anonymous.status_code == 401
+    assert anonymous.headers['WWW-Authenticate'] == 'Bearer'
+    assert client.get('/api/v1/jobs', headers={'Authorization': 'Bearer ocr_wrong'}).status_code == 401
+    assert client.get('/api/v1/jobs', headers=bearer(token)).status_code == 200
+
+    assert client.delete(f"/api/v1/tokens/{token['id']}").get_json()['revoked']
+    revoked = client.get('/api/v1/jobs', headers=bearer(token))
+    assert revoked.status_code == 401
+    assert 'invalid_token' in revoked.headers['WWW-Authenticate']
+
+
+def test_uploaded_job_is_started_and_listed(web_app, api):
+    client, token = new_token(web_app)
+    response = upload(client, token, ('scan.pdf', PDF), ('notes.txt', b'ignored'), output_mode='pdf')
+    assert response.status_code == 202
+    job = response.get_json()
+    assert response.headers['Location'] == job['links']['self'] == f"/api/v1/jobs/{job['id']}"
+    assert (job['status'], job['output_mode'], job['eta_seconds']) == ('processing', 'pdf', 12)
+    assert api.started[-1]['inputs'] == {'scan.pdf': PDF}
+
+    listed = client.get('/api/v1/jobs?status=processing', headers=bearer(token)).get_json()
+    assert [entry['id'] for entry in listed['jobs']] == [job['id']]
+    still_running = client.get(f"/api/v1/jobs/{job['id']}/files", headers=bearer(token))
+    assert still_running.status_code == 409
+    assert still_running.get_json()['status'] == 'processing'
+
+
+def test_bad_submissions_are_refused(web_app, api):
+    client, token = new_token(web_app)
+    assert upload(client, token, ('notes.txt', b'text')).status_code == 400
+    assert upload(client, token, ('scan.pdf', PDF), output_mode='docx').status_code == 400
+    private_hook = upload(client, token, ('scan.pdf', PDF), webhook_url='http://127.0.0.1/hook')
+    assert private_hook.status_code == 400
+    assert client.get('/api/v1/jobs?limit=x', headers=bearer(token)).status_code == 400
+    assert api.started == []
+
+
+def test_retried_submission_returns_the_original_job(web_app, api):
+    client, token = new_token(web_app)
+    first = upload(client, token, ('scan.pdf', PDF), headers={'Idempotency-Key': 'nightly-1'})
+    retry = upload(client, token, ('scan.pdf', PDF), headers={'Idempotency-Key': 'nightly-1'})
+    assert retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json()['id'] == first.get_json()['id']
+    assert len(api.started) == 1
+
+    reused = upload(client, token, ('other.pdf', PDF), headers={'Idempotency-Key': 'nightly-1'})
+    assert reused.status_code == 422
+    # Keys are per user
+    other_client, other_token = new_token(web_app)
+    other = upload(other_client, other_token, ('scan.pdf', PDF), headers={'Idempotency-Key': 'nightly-1'})
+    assert other.status_code == 202
+
+
+def test_deferred_job_is_forgotten_so_its_key_can_be_retried(web_app, api, monkeypatch):
+    client, token = new_token(web_app)
+
+    def busy(process_id, scratch, *args, **kwargs):
+        raise web_app.JobNotStarted('The processing queue is full', status=503, retry_after=90)
+
+    monkeypatch.setattr(api, 'start_job', busy)
+    deferred = upload(client, token, ('scan.pdf', PDF), headers={'Idempotency-Key': 'k'})
+    assert deferred.status_code == 503
+    assert deferred.headers['Retry-After'] == '90'
+    assert deferred.get_json()['retry_after'] == 90
+    assert client.get('/api/v1/jobs', headers=bearer(token)).get_json()['total'] == 0
+
+
+def finish(web_app, api, job_id, tmp_path):
+    """Complete a started job the way the pipeline does: write its ZIP and call its completion handler"""
+    with zipfile.ZipFile(tmp_path / f'processed_files_{job_id}.zip', 'w') as zf:
+        zf.writestr('scan.pdf', PDF + b' ocr')
+        zf.writestr('typed.pdf', PDF)
+    started = next(entry for entry in api.started if entry['id'] == job_id)
+    started['on_complete']({'results': {
+        'success': True,
+        'stats': {'files': 3},
+        'errors': ['broken.pdf: could not read'],
+        'total_pages': 4,
+        'file_info': [
+            {'name': 'scan.pdf', 'page_count': 3, 'compute_units': 3.0},
+            {'name': 'typed.pdf', 'page_count': 1, 'compute_units': 0.0, 'prior_ocr': True},
+            {'name': 'broken.pdf', 'page_count': 0, 'error': 'could not read'},
+        ],
+    }})
+
+
+def test_finished_job_reports_and_serves_each_file(web_app, api, tmp_path):
+    client, token = new_token(web_app)
+    job_id = upload(client, token, ('scan.pdf', PDF), ('typed.pdf', PDF), ('broken.pdf', PDF)).get_json()['id']
+    finish(web_app, api, job_id, tmp_path)
+
+    job = client.get(f'/api/v1/jobs/{job_id}', headers=bearer(token)).get_json()
+    assert job['status'] == 'completed' and job['completed_at']
+    assert (job['total_pages'], job['errors']) == (4, ['broken.pdf: could not read'])
+    files = {entry['name']: entry for entry in job['files']}
+    assert {name: entry['status'] for name, entry in files.items()} == \
+        {'scan.pdf': 'ok', 'typed.pdf': 'prior_ocr', 'broken.pdf': 'failed'}
+    assert files['broken.pdf']['download_url'] is None
+
+    one = client.get(files['scan.pdf']['download_url'], headers=bearer(token))
+    assert one.data == PDF + b' ocr'
+    assert one.mimetype == 'application/pdf'
+    assert client.get(f'/api/v1/jobs/{job_id}/files/missing.pdf', headers=bearer(token)).status_code == 404
+    download = client.get(f'/api/v1/jobs/{job_id}/download', headers=bearer(token))
+    assert zipfile.ZipFile(io.BytesIO(download.data)).namelist() == ['scan.pdf', 'typed.pdf']
+
+
+def test_jobs_are_only_visible_to_their_owner(web_app, api, tmp_path):
+    client, token = new_token(web_app)
+    job_id = upload(client, token, ('scan.pdf', PDF)).get_json()['id']
+    finish(web_app, api, job_id, tmp_path)
+
+    # Another user's token gets the same answer as for a job that doesn't exist
+    other_client, other_token = new_token(web_app)
+    for path in ('', '/files', '/files/scan.pdf', '/download', '/webhooks'):
+        assert other_client.get(f'/api/v1/jobs/{job_id}{path}', headers=bearer(other_token)).status_code == 404
+        assert client.get(f'/api/v1/jobs/{job_id}{path}', headers=bearer(token)).status_code == 200
+
+
+def test_server_paths_must_stay_inside_the_import_roots(web_app, api, tmp_path, monkeypatch):
+    client, token = new_token(web_app)
+    root = tmp_path / 'imports'
+    (root / 'batch').mkdir(parents=True)
+    (root / 'batch' / 'a.pdf').write_bytes(PDF)
+    (root / 'batch' / 'notes.txt').write_text('skipped')
+    secret = tmp_path / 'secret.pdf'
+    secret.write_bytes(b'%PDF-1.4 private')
+    os.symlink(secret, root / 'batch' / 'link.pdf')
+
+    submit = lambda paths: client.post('/api/v1/jobs', json={'paths': paths}, headers=bearer(token))
+    assert submit([str(root / 'batch')]).status_code == 403
+
+    monkeypatch.setitem(web_app.app.config, 'API_IMPORT_ROOTS', [os.path.realpath(root)])
+    assert submit([str(secret)]).status_code == 403
+    assert submit([str(root / 'batch' / 'link.pdf')]).status_code == 403
+    assert submit([str(root / 'missing.pdf')]).status_code == 400
+
+    response = submit([str(root / 'batch')])
+    assert response.status_code == 202
+    # The folder's PDFs are copied in, named after their path below the root; the escaping link is skipped
+    assert api.started[-1]['inputs'] == {'batch_a.pdf': PDF}
+    # The inputs are copies, never links to the originals
+    assert os.stat(root / 'batch' / 'a.pdf').st_nlink == 1
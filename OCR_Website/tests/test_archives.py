@@ -0,0 +1,121 @@
+import io
+import os
+import tarfile
+import zipfile
+
+import pytest
+
+from archives import ArchiveError, ArchiveLimits, iter_pdfs, unique_name
+
+
+def make_zip(path, members, compression=zipfile.ZIP_DEFLATED):
+    with zipfile.ZipFile(path, 'w', compression) as zf:
+        for name, data in members.items():
+            zf.writestr(name, data)
+    return str(path)
+
+
+def extract_all(archive, dest, **limits):
+    return list(iter_pdfs(archive, str(dest), ArchiveLimits(**limits) if limits else None))
+
+
+@pytest.fixture
+def dest(tmp_path):
+    path = tmp_path / 'out'
+    path.mkdir()
+    return path
+
+
+def test_extracts_pdfs_and_skips_other_members(tmp_path, dest):
+    archive = make_zip(tmp_path / 'a.zip', {'one.pdf': b'%PDF-1 one', 'notes.txt': b'skip',
+                                            'sub/two.pdf': b'%PDF-1 two'})
+    names = [name for name, _ in extract_all(archive, dest)]
+    assert names == ['one.pdf', 'sub_two.pdf']
+    assert sorted(os.listdir(dest)) == ['one.pdf', 'sub_two.pdf']
+
+
+def test_highly_compressed_member_is_refused(tmp_path, dest):
+    archive = make_zip(tmp_path / 'bomb.zip', {'bomb.pdf': b'\0' * (4 * 1024 * 1024)})
+    with pytest.raises(ArchiveError, match='compressed more than'):
+        extract_all(archive, dest, max_ratio=50)
+    # Nothing partial is left behind for the OCR queue
+    assert os.listdir(dest) == []
+
+
+def test_member_size_limit_counts_bytes_written(tmp_path, dest):
+    # Stored, so the ratio check can't be what stops it
+    archive = make_zip(tmp_path / 'big.zip', {'big.pdf': os.urandom(3 * 1024 * 1024)}, zipfile.ZIP_STORED)
+    with pytest.raises(ArchiveError, match='expands to more than'):
+        extract_all(archive, dest, max_member_bytes=1024 * 1024)
+
+
+def test_total_size_limit(tmp_path, dest):
+    members = {f'{n}.pdf': os.urandom(1024 * 1024) for n in range(3)}
+    archive = make_zip(tmp_path / 'many.zip', members, zipfile.ZIP_STORED)
+    extracted = []
+    with pytest.raises(ArchiveError, match='Archive expands to more than'):
+        for item in iter_pdfs(archive, str(dest), ArchiveLimits(max_total_bytes=2 * 1024 * 1024 + 1)):
+            extracted.append(item)
+    # Members finished before the limit was hit are complete and usable
+    assert [name for name, _ in extracted] == ['0.pdf', '1.pdf']
+
+
+def test_member_count_limit(tmp_path, dest):
+    archive = make_zip(tmp_path / 'count.zip', {f'{n}.pdf': b'%PDF' for n in range(4)})
+    with pytest.raises(ArchiveError, match='more than 3 documents'):
+        extract_all(archive, dest, max_members=3)
+
+
+def test_zip_traversal_names_stay_inside_dest(tmp_path, dest):
+    archive = make_zip(tmp_path / 'evil.zip', {
+        '../../escape.pdf': b'%PDF',
+        '/abs/root.pdf': b'%PDF',
+        '..\\windows.pdf': b'%PDF',
+    })
+    for name, path in extract_all(archive, dest):
+        assert os.path.dirname(os.path.realpath(path)) == os.path.realpath(dest)
+        assert '..' not in name and '/' not in name
+    assert not (tmp_path / 'escape.pdf').exists()
+    assert len(os.listdir(dest)) == 3
+
+
+def test_tar_links_and_traversal_are_not_followed(tmp_path, dest):
+    archive = str(tmp_path / 'evil.tar.gz')
+    with tarfile.open(archive, 'w:gz') as tf:
+        data = b'%PDF-1 real'
+        info = tarfile.TarInfo('../../escape.pdf')
+        info.size = len(data)
+        tf.addfile(info, io.BytesIO(data))
+        link = tarfile.TarInfo('passwd.pdf')
+        link.type = tarfile.SYMTYPE
+        link.linkname = '/etc/passwd'
+        tf.addfile(link)
+
+    names = [name for name, _ in extract_all(archive, dest)]
+    assert names == ['escape.pdf']
+    assert not (tmp_path / 'escape.pdf').exists()
+    assert not os.path.islink(dest / 'escape.pdf')
+
+
+def test_tar_bomb_is_refused_on_the_running_total(tmp_path, dest):
+    archive = str(tmp_path / 'bomb.tar.gz')
+    with tarfile.open(archive, 'w:gz') as tf:
+        data = b'\0' * (4 * 1024 * 1024)
+        info = tarfile.TarInfo('bomb.pdf')
+        info.size = len(data)
+        tf.addfile(info, io.BytesIO(data))
+    with pytest.raises(ArchiveError, match='compressed more than'):
+        extract_all(archive, dest, max_ratio=50)
+
+
+def test_corrupt_archive_raises_archive_error(tmp_path, dest):
+    archive = tmp_path / 'broken.zip'
+    archive.write_bytes(b'PK\x03\x04 not really a zip')
+    with pytest.raises(ArchiveError):
+        extract_all(str(archive), dest)
+
+
+def test_unique_name_does_not_overwrite(tmp_path):
+    (tmp_path / 'a.pdf').write_bytes(b'')
+    assert unique_name(str(tmp_path), 'x/../a.pdf') == 'x_a.pdf'
+    assert unique_name(str(tmp_path), '../a.pdf') == 'a_1.pdf'
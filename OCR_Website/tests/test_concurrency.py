@@ -0,0 +1,76 @@
+import pytest
+
+import concurrency
+from concurrency import AdaptiveConcurrency
+
+
+@pytest.fixture
+def limits(monkeypatch):
+    """The container limits the controller reads; tests change them between refreshes"""
+    live = {'cpus': 4, 'available': 4000, 'limit': 8000, 'workers': 1}
+    monkeypatch.setattr(concurrency, 'cpu_limit', lambda: live['cpus'])
+    monkeypatch.setattr(concurrency, 'available_memory_mb', lambda: live['available'])
+    monkeypatch.setattr(concurrency, 'memory_limit_mb', lambda: live['limit'])
+    monkeypatch.setattr(concurrency, 'web_workers', lambda: live['workers'])
+    return live
+
+
+def controller(max_slots=8, **options):
+    # refresh_seconds=0 re-reads the limits on every call
+    return AdaptiveConcurrency(max_slots, reserve_mb=500, refresh_seconds=0, **options)
+
+
+def test_cpu_slots_follow_the_limit_up_to_the_pool_size(limits):
+    gate = controller(max_slots=6)
+    assert gate.slots() == 4
+    limits['cpus'] = 16
+    assert gate.slots() == 6
+    assert not gate.can_start(in_flight=6, in_flight_mb=0, task_mb=1)
+
+
+def test_limits_are_cached_between_refreshes(limits):
+    gate = AdaptiveConcurrency(8, refresh_seconds=60)
+    assert gate.slots() == 4
+    limits['cpus'] = 2
+    assert gate.slots() == 4
+
+
+def test_memory_budget_counts_running_tasks_back_in(limits):
+    gate = controller()
+    # 4000MB free less the reserve, plus 1000MB the running tasks hold
+    assert gate.memory_budget_mb(in_flight_mb=1000) == 4500
+    assert gate.can_start(in_flight=1, in_flight_mb=1000, task_mb=3500)
+    assert not gate.can_start(in_flight=1, in_flight_mb=1000, task_mb=3600)
+
+
+def test_budget_is_capped_by_this_process_share_of_the_limit(limits):
+    limits['available'] = 20000
+    limits['workers'] = 3
+    gate = controller()
+    assert gate.memory_budget_mb(in_flight_mb=0) == 2500
+    # An explicit process count overrides the web worker count
+    assert controller(processes=1).memory_budget_mb(in_flight_mb=0) == 7500
+
+
+def test_unmeasurable_memory_leaves_only_the_cpu_limit(limits):
+    limits['available'] = None
+    limits['limit'] = None
+    gate = controller()
+    assert gate.memory_budget_mb(in_flight_mb=0) is None
+    assert gate.can_start(in_flight=3, in_flight_mb=100000, task_mb=100000)
+    assert gate.snapshot() == {'cpu_slots': 4, 'available_mb': None, 'capacity_mb': None}
+
+
+def test_an_oversized_task_still_runs_alone(limits):
+    gate = controller()
+    assert gate.can_start(in_flight=0, in_flight_mb=0, task_mb=50000)
+    assert not gate.can_start(in_flight=1, in_flight_mb=10, task_mb=50000)
+
+
+def test_concurrency_grows_when_memory_frees_up(limits):
+    gate = controller()
+    limits['available'] = 600
+    assert not gate.can_start(in_flight=1, in_flight_mb=500, task_mb=700)
+    limits['available'] = 2000
+    assert gate.can_start(in_flight=1, in_flight_mb=500, task_mb=700)
+    assert gate.snapshot() == {'cpu_slots': 4, 'available_mb': 1500, 'capacity_mb': 7500}
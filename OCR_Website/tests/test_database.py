@@ -0,0 +1,113 @@
+import threading
+
+from sqlalchemy import create_engine, text
+
+import database
+from database import TTLCache, configure_sqlite, engine_options
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_entries_expire_after_the_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(database.time, 'monotonic', clock)
+    cache = TTLCache(ttl_seconds=5)
+    cache.put('user', 'alice')
+    clock.now += 4
+    assert cache.get('user') == 'alice'
+    clock.now += 2
+    assert cache.get('user') is None
+    assert cache.get('never stored') is None
+
+
+def test_invalidate_and_clear():
+    cache = TTLCache()
+    cache.put(1, 'a')
+    cache.put(2, 'b')
+    cache.invalidate(1)
+    cache.invalidate('missing')
+    assert cache.get(1) is None and cache.get(2) == 'b'
+    cache.clear()
+    assert cache.get(2) is None
+
+
+def test_zero_ttl_disables_caching():
+    cache = TTLCache(ttl_seconds=0)
+    cache.put('user', 'alice')
+    assert cache.get('user') is None
+
+
+def test_full_cache_drops_expired_entries_before_the_oldest(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(database.time, 'monotonic', clock)
+    cache = TTLCache(ttl_seconds=5, maxsize=2)
+    cache.put('old', 1)
+    clock.now += 3
+    cache.put('newer', 2)
+    clock.now += 3
+    # 'old' has expired, so it goes and 'newer' stays
+    cache.put('newest', 3)
+    assert (cache.get('newer'), cache.get('newest')) == (2, 3)
+    # Nothing has expired now; the oldest live entry makes room
+    cache.put('latest', 4)
+    assert cache.get('newer') is None
+    assert (cache.get('newest'), cache.get('latest')) == (3, 4)
+
+
+def test_concurrent_puts_stay_within_maxsize():
+    cache = TTLCache(maxsize=50)
+
+    def fill(offset):
+        for n in range(500):
+            cache.put(offset + n, n)
+
+    threads = [threading.Thread(target=fill, args=(offset * 1000,)) for offset in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache._entries) <= 50
+
+
+def test_engine_options_by_database():
+    sqlite = engine_options('sqlite:///app.db', pool_size=8, busy_timeout_ms=2500)
+    assert sqlite['pool_size'] == 8
+    assert sqlite['connect_args'] == {'timeout': 2.5, 'check_same_thread': False}
+    assert engine_options('sqlite://') == engine_options('sqlite:///:memory:') == {}
+    postgres = engine_options('postgresql://db/ocr')
+    assert postgres['pool_pre_ping'] and 'connect_args' not in postgres
+
+
+def test_sqlite_connections_get_wal_and_busy_timeout(tmp_path):
+    uri = f"sqlite:///{tmp_path / 'app.db'}"
+    engine = create_engine(uri, **engine_options(uri))
+    configure_sqlite(engine, busy_timeout_ms=1234)
+    try:
+        with engine.connect() as conn:
+            assert conn.execute(text('PRAGMA journal_mode')).scalar() == 'wal'
+            assert conn.execute(text('PRAGMA synchronous')).scalar() == 1
+            assert conn.execute(text('PRAGMA foreign_keys')).scalar() == 1
+            assert conn.execute(text('PRAGMA busy_timeout')).scalar() == 1234
+    finally:
+        engine.dispose()
+
+
+def test_cached_user_survives_the_request_session(web_app):
+    with web_app.app.app_context():
+        user = web_app.User(username='cache34', email='cache34@example.com', password_hash='x')
+        web_app.db.session.add(user)
+        web_app.db.session.commit()
+        user_id = user.id
+        web_app.user_cache.clear()
+
+        loaded = web_app.load_user(str(user_id))
+        web_app.db.session.commit()
+        # Detached, so the commit didn't expire it and its attributes still load
+        assert loaded.username == 'cache34'
+        assert web_app.load_user(str(user_id)) is loaded
@@ -0,0 +1,92 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pikepdf
+import pytest
+from PIL import Image
+
+from images import DEFAULT_DPI, ImageConversionError, describe, image_to_pdf, is_image, pdf_name
+
+
+def multipage_tiff(path, frames=3, dpi=200, mode='L'):
+    pages = [Image.new(mode, (400, 500), n * 60) for n in range(frames)]
+    pages[0].save(path, save_all=True, append_images=pages[1:], dpi=(dpi, dpi))
+    return str(path)
+
+
+def page_images(pdf_path):
+    with pikepdf.open(pdf_path) as pdf:
+        return [(page.MediaBox, pikepdf.PdfImage(next(iter(page.get_images().values()))).filters) for page in pdf.pages]
+
+
+def test_image_names():
+    assert is_image('Scan.TIFF') and is_image('photo.jpeg') and not is_image('scan.pdf')
+    assert pdf_name('batch/scan.tif') == 'batch/scan.pdf'
+
+
+def test_describe_reads_frames_and_resolution(tmp_path):
+    info = describe(multipage_tiff(tmp_path / 'scan.tif'))
+    assert info == {'frames': 3, 'dpi': 200, 'page_size_in': (2.0, 2.5)}
+
+
+def test_placeholder_resolution_means_a_300_dpi_scan(tmp_path):
+    path = tmp_path / 'scan.png'
+    Image.new('L', (600, 900)).save(path, dpi=(72, 72))
+    info = describe(str(path))
+    assert info['dpi'] == DEFAULT_DPI
+    assert info['page_size_in'] == (2.0, 3.0)
+
+
+def test_multipage_tiff_becomes_one_page_per_frame(tmp_path):
+    output = tmp_path / 'scan.pdf'
+    assert image_to_pdf(multipage_tiff(tmp_path / 'scan.tif'), str(output)) == 3
+    pages = page_images(output)
+    assert len(pages) == 3
+    # 400x500 pixels at 200 DPI is 2x2.5 inches
+    assert [float(value) for value in pages[0][0]] == [0, 0, 144, 180]
+
+
+def test_conversion_is_deterministic_and_parallel_safe(tmp_path):
+    tiff = multipage_tiff(tmp_path / 'scan.tif', frames=4)
+    image_to_pdf(tiff, str(tmp_path / 'serial.pdf'))
+    image_to_pdf(tiff, str(tmp_path / 'again.pdf'))
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        image_to_pdf(tiff, str(tmp_path / 'parallel.pdf'), submit=pool.submit, work_dir=str(tmp_path))
+    serial = (tmp_path / 'serial.pdf').read_bytes()
+    assert (tmp_path / 'again.pdf').read_bytes() == serial
+    assert (tmp_path / 'parallel.pdf').read_bytes() == serial
+    # Frame files are cleaned up
+    assert sorted(os.listdir(tmp_path)) == ['again.pdf', 'parallel.pdf', 'scan.tif', 'serial.pdf']
+
+
+def test_jpeg_and_bilevel_frames_are_not_re_encoded(tmp_path):
+    jpeg = tmp_path / 'photo.jpg'
+    Image.new('RGB', (300, 300), (200, 100, 50)).save(jpeg, quality=80, dpi=(150, 150))
+    image_to_pdf(str(jpeg), str(tmp_path / 'photo.pdf'))
+    with pikepdf.open(tmp_path / 'photo.pdf') as pdf:
+        image = next(iter(pdf.pages[0].get_images().values()))
+        assert pikepdf.PdfImage(image).filters == ['/DCTDecode']
+        assert image.read_raw_bytes() == jpeg.read_bytes()
+
+    image_to_pdf(multipage_tiff(tmp_path / 'fax.tif', frames=2, mode='1'), str(tmp_path / 'fax.pdf'))
+    assert [filters for _, filters in page_images(tmp_path / 'fax.pdf')] == [['/CCITTFaxDecode']] * 2
+
+
+def test_transparency_is_flattened_onto_white(tmp_path):
+    png = tmp_path / 'logo.png'
+    Image.new('RGBA', (100, 100), (0, 0, 0, 0)).save(png, dpi=(300, 300))
+    image_to_pdf(str(png), str(tmp_path / 'logo.pdf'))
+    with pikepdf.open(tmp_path / 'logo.pdf') as pdf:
+        image = next(iter(pdf.pages[0].get_images().values()))
+        assert '/SMask' not in image
+        assert pikepdf.PdfImage(image).as_pil_image().getpixel((50, 50)) == (255, 255, 255)
+
+
+def test_unreadable_image_raises_a_conversion_error(tmp_path):
+    broken = tmp_path / 'broken.tif'
+    broken.write_bytes(b'II*\x00 not really a tiff')
+    with pytest.raises(ImageConversionError):
+        describe(str(broken))
+    with pytest.raises(ImageConversionError):
+        image_to_pdf(str(broken), str(tmp_path / 'broken.pdf'), work_dir=str(tmp_path))
+    assert sorted(os.listdir(tmp_path)) == ['broken.tif']
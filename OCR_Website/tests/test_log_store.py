@@ -0,0 +1,125 @@
+import logging
+import threading
+
+from log_store import LogStore, bind_job, current_job_id, set_current_job
+
+
+def messages(entries):
+    return [entry['message'] for entry in entries]
+
+
+def test_cursor_returns_only_newer_entries():
+    store = LogStore()
+    for n in range(5):
+        store.append('INFO', f'line {n}')
+    cursor = store.since()[-1]['seq']
+    assert store.last_seq == cursor == 5
+
+    store.append('INFO', 'line 5')
+    assert messages(store.since(after=cursor)) == ['line 5']
+    assert store.since(after=store.last_seq) == []
+
+
+def test_limit_pages_forward_from_the_cursor():
+    store = LogStore()
+    for n in range(10):
+        store.append('INFO', f'line {n}')
+    first = store.since(limit=4)
+    second = store.since(after=first[-1]['seq'], limit=4)
+    assert messages(first) == ['line 0', 'line 1', 'line 2', 'line 3']
+    assert messages(second) == ['line 4', 'line 5', 'line 6', 'line 7']
+
+
+def test_ring_buffer_drops_the_oldest_entries():
+    store = LogStore(maxlen=3)
+    for n in range(5):
+        store.append('INFO', f'line {n}')
+    assert messages(store.since()) == ['line 2', 'line 3', 'line 4']
+    # A cursor older than the buffer still gets everything that is left
+    assert [entry['seq'] for entry in store.since(after=1)] == [3, 4, 5]
+
+
+def test_entries_are_filtered_by_job():
+    store = LogStore()
+    store.append('INFO', 'a1', job_id='a')
+    store.append('INFO', 'global')
+    store.append('WARNING', 'b1', job_id='b')
+    store.append('INFO', 'a2', job_id='a')
+
+    assert messages(store.since(job_id='a')) == ['a1', 'a2']
+    assert messages(store.since(job_id='b')) == ['b1']
+    assert store.since(job_id='missing') == []
+    assert messages(store.since()) == ['a1', 'global', 'b1', 'a2']
+    # Job entries share the global sequence, so one cursor works for both views
+    assert messages(store.since(after=2, job_id='a')) == ['a2']
+
+
+def test_per_job_history_is_bounded():
+    store = LogStore(maxlen=100, per_job_maxlen=2)
+    for n in range(4):
+        store.append('INFO', f'a{n}', job_id='a')
+    assert messages(store.since(job_id='a')) == ['a2', 'a3']
+
+
+def test_least_recently_active_job_is_forgotten():
+    store = LogStore(max_jobs=2)
+    store.append('INFO', 'a', job_id='a')
+    store.append('INFO', 'b', job_id='b')
+    store.append('INFO', 'a again', job_id='a')
+    store.append('INFO', 'c', job_id='c')
+
+    assert store.since(job_id='b') == []
+    assert messages(store.since(job_id='a')) == ['a', 'a again']
+    assert messages(store.since(job_id='c')) == ['c']
+
+
+def test_bind_job_is_per_thread_and_restores_the_previous_job():
+    seen = {}
+
+    def other_thread():
+        seen['other'] = current_job_id()
+
+    set_current_job(None)
+    with bind_job('outer'):
+        with bind_job('inner'):
+            assert current_job_id() == 'inner'
+            thread = threading.Thread(target=other_thread)
+            thread.start()
+            thread.join()
+        assert current_job_id() == 'outer'
+    assert current_job_id() is None
+    assert seen['other'] is None
+
+
+def test_concurrent_appends_get_unique_sequence_numbers():
+    store = LogStore(maxlen=10000)
+
+    def write(job_id):
+        for n in range(200):
+            store.append('INFO', str(n), job_id=job_id)
+
+    threads = [threading.Thread(target=write, args=(f'job{n}',)) for n in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    seqs = [entry['seq'] for entry in store.since(limit=10000)]
+    assert seqs == list(range(1, 1001))
+
+
+def test_pipeline_module_logs_reach_the_job_endpoint(web_app, caplog):
+    # pytest owns the root logger, so the app's basicConfig(level=INFO) didn't apply
+    caplog.set_level(logging.INFO)
+    client = web_app.app.test_client()
+    cursor = client.get('/logs').get_json()['cursor']
+    with bind_job('job-27'):
+        logging.getLogger('scratch').info('scratch line')
+        logging.getLogger('pipeline').warning('pipeline line')
+    logging.getLogger('scratch').info('untagged line')
+
+    body = client.get(f'/logs?after={cursor}&job=job-27').get_json()
+    assert messages(body['entries']) == ['scratch line', 'pipeline line']
+    assert body['cursor'] == body['entries'][-1]['seq']
+    # A cursor from before a restart (ahead of the store) starts over instead of returning nothing
+    assert client.get(f'/logs?after={10 ** 9}&limit=1').get_json()['entries']
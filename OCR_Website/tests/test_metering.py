@@ -0,0 +1,75 @@
+import pikepdf
+import pytest
+from PIL import Image
+
+from metering import (MAX_PAGE_UNITS, MIN_PAGE_UNITS, charged_units, file_units, inspect_pdf, page_units, quote,
+                      units_to_credits)
+
+SCAN = {'page_count': 10, 'text_pages': 0, 'dpi': 300}
+MIXED = {'page_count': 10, 'text_pages': 4, 'dpi': 600}
+
+
+def test_page_units_scale_with_pixels_within_bounds():
+    assert page_units(300) == 1.0
+    assert page_units(None) == page_units(0) == 1.0
+    assert page_units(450) == 2.25
+    assert page_units(100) == MIN_PAGE_UNITS
+    assert page_units(1200) == MAX_PAGE_UNITS
+
+
+def test_file_units_can_skip_pages_that_already_have_text():
+    assert file_units(MIXED) == 40.0
+    assert file_units(MIXED, scanned_only=True) == 24.0
+    assert file_units({'page_count': 2, 'text_pages': 5, 'dpi': 300}, scanned_only=True) == 0
+
+
+def test_credits_round_up_without_float_noise():
+    assert units_to_credits(0) == 0
+    assert units_to_credits(0.1 + 0.2) == 1
+    assert units_to_credits(3.0000000001) == 3
+    assert units_to_credits(3.01) == 4
+
+
+def test_quote_gives_worst_case_and_expected_cost():
+    assert quote([SCAN, MIXED]) == {
+        'files': 2,
+        'pages': 20,
+        'text_pages': 4,
+        'max_units': 50.0,
+        'expected_units': 34.0,
+        'max_credits': 50,
+        'expected_credits': 34,
+    }
+
+
+def test_refunds_for_cache_hits_born_digital_files_and_failures():
+    assert charged_units(MIXED) == 24.0
+    assert charged_units(MIXED, from_cache=True) == 0
+    assert charged_units(MIXED, prior_ocr=True) == 0
+    assert charged_units(MIXED, failed=True) == 0
+
+
+def test_split_file_pays_for_the_chunks_that_succeeded():
+    # 7 of 10 pages were OCR'd before another chunk failed
+    assert charged_units(MIXED, failed=True, ocr_pages=7) == pytest.approx(24.0 * 0.7)
+    assert charged_units(MIXED, ocr_pages=0) == 0
+    assert charged_units(MIXED, ocr_pages=25) == 24.0
+    assert charged_units({'page_count': 0}, ocr_pages=3) == 0
+    assert charged_units(MIXED, from_cache=True, ocr_pages=7) == 0
+
+
+def test_inspect_pdf_counts_pages_with_fonts(tmp_path):
+    scan = tmp_path / 'scan.pdf'
+    Image.new('L', (100, 100), 255).save(scan, 'PDF', save_all=True, append_images=[Image.new('L', (100, 100))])
+    assert inspect_pdf(str(scan)) == (2, 0)
+
+    typed = tmp_path / 'typed.pdf'
+    pdf = pikepdf.new()
+    font = pdf.make_indirect(pikepdf.Dictionary(Type=pikepdf.Name.Font, Subtype=pikepdf.Name.Type1,
+                                                BaseFont=pikepdf.Name.Helvetica))
+    for with_font in (True, False, True):
+        page = pdf.add_blank_page()
+        if with_font:
+            page.Resources = pikepdf.Dictionary(Font=pikepdf.Dictionary(F1=font))
+    pdf.save(typed)
+    assert inspect_pdf(str(typed)) == (3, 2)
@@ -0,0 +1,139 @@
+import json
+import os
+import shutil
+
+import ocrmypdf
+import pytest
+from PIL import Image
+
+import ocr_cli
+import pipeline
+from ocr_cli import BatchPipeline, discover, end_partial_line, file_status, load_manifest, run
+
+
+def fake_ocr(input_path, output_path, **options):
+    """Stands in for ocrmypdf in the forked workers: copies the file, or fails the way its name says"""
+    name = os.path.basename(str(input_path))
+    if 'typed' in name:
+        raise ocrmypdf.exceptions.PriorOcrFoundError()
+    if 'broken' in name:
+        raise RuntimeError('tesseract crashed')
+    shutil.copyfile(input_path, output_path)
+
+
+@pytest.fixture(autouse=True)
+def own_config(monkeypatch):
+    # BatchPipeline points the shared pipeline settings at its cache; keep that out of other tests
+    monkeypatch.setattr(pipeline, 'config', dict(pipeline.config))
+
+
+@pytest.fixture
+def tree(tmp_path, monkeypatch):
+    monkeypatch.setattr(ocrmypdf, 'ocr', fake_ocr)
+    source = tmp_path / 'scans'
+    (source / 'b').mkdir(parents=True)
+    for rel_path, shade in (('a_scanned.pdf', 0), ('b/c_typed.pdf', 80), ('b/broken.pdf', 160)):
+        Image.new('L', (200, 260), shade).save(source / rel_path, 'PDF', resolution=100)
+    (source / 'notes.txt').write_text('not a document')
+    return source
+
+
+def options(tmp_path, **overrides):
+    return dict(dict(workers=2, output_mode='pdf', cache_dir=str(tmp_path / 'cache')), **overrides)
+
+
+def records(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f]
+
+
+def test_discover_finds_documents_in_a_stable_order(tree):
+    (tree / 'scan.TIFF').write_bytes(b'')
+    assert list(discover(str(tree))) == ['a_scanned.pdf', 'scan.TIFF', 'b/broken.pdf', 'b/c_typed.pdf']
+
+
+def test_manifest_keeps_the_latest_outcome_and_skips_partial_lines(tmp_path):
+    path = tmp_path / 'results.jsonl'
+    path.write_text('\n'.join([
+        json.dumps({'path': 'a.pdf', 'status': 'ok'}),
+        json.dumps({'path': 'b.pdf', 'status': 'ok'}),
+        json.dumps({'path': 'b.pdf', 'status': 'failed'}),
+        json.dumps({'path': 'c.pdf', 'status': 'cached'}),
+        '{"path": "d.pdf", "sta',
+    ]))
+    assert sorted(load_manifest(str(path))) == ['a.pdf', 'c.pdf']
+    assert load_manifest(str(tmp_path / 'missing.jsonl')) == {}
+
+    end_partial_line(str(path))
+    assert path.read_text().endswith('"sta\n')
+    end_partial_line(str(path))
+    assert path.read_text().endswith('"sta\n')
+
+
+def test_file_status():
+    assert file_status({'prior_ocr': True, 'error': 'File already has OCR'}) == 'prior_ocr'
+    assert file_status({'error': 'boom'}) == 'failed'
+    assert file_status({'from_cache': True}) == 'cached'
+    assert file_status({}) == 'ok'
+
+
+def test_batch_mirrors_the_tree_and_records_every_file(tmp_path, tree):
+    output = tmp_path / 'out'
+    summary = run(str(tree), str(output), **options(tmp_path))
+
+    assert (summary['files'], summary['processed']) == (3, 3)
+    assert (summary['ok'], summary['prior_ocr'], summary['failed']) == (1, 1, 1)
+    assert summary['pages'] == 3
+    for rel_path in ('a_scanned.pdf', 'b/c_typed.pdf', 'b/broken.pdf'):
+        # Failed files are passed through so the output tree stays complete
+        assert (output / rel_path).read_bytes() == (tree / rel_path).read_bytes()
+        # Outputs in the user's tree never share an inode with inputs or the cache
+        assert os.stat(output / rel_path).st_ino != os.stat(tree / rel_path).st_ino
+
+    by_path = {record['path']: record for record in records(summary['results'])}
+    assert by_path['b/broken.pdf']['error'] == 'tesseract crashed'
+    assert by_path['a_scanned.pdf']['error'] is None
+    assert by_path['a_scanned.pdf']['sha256'] == pipeline.get_file_hash(str(tree / 'a_scanned.pdf'))
+    # The scratch space is gone once the run closes
+    assert not os.listdir(tmp_path / 'cache' / '.scratch')
+
+
+def test_rerun_resumes_and_retries_only_what_is_left(tmp_path, tree):
+    output = tmp_path / 'out'
+    run(str(tree), str(output), **options(tmp_path))
+
+    summary = run(str(tree), str(output), **options(tmp_path))
+    assert (summary['skipped'], summary['processed'], summary['failed']) == (2, 1, 1)
+
+    # A file changed since it was recorded is done again, this time from the cache
+    os.utime(tree / 'a_scanned.pdf', (1, 1))
+    summary = run(str(tree), str(output), **options(tmp_path))
+    assert (summary['skipped'], summary['cached'], summary['failed']) == (1, 1, 1)
+
+    summary = run(str(tree), str(output), **options(tmp_path, resume=False))
+    assert summary['skipped'] == 0 and summary['processed'] == 3
+
+
+def test_defaults_follow_the_web_app(tmp_path, monkeypatch):
+    monkeypatch.setenv('OCR_THREADS', '3')
+    batch = BatchPipeline(str(tmp_path / 'out'), workers=2, cache_dir=str(tmp_path / 'cache'))
+    try:
+        assert batch.output_mode == pipeline.DEFAULT_OUTPUT_MODE
+        assert batch.threads == pipeline.config['OCR_THREADS'] == 3
+        assert pipeline.config['CACHE_FOLDER'] == str(tmp_path / 'cache')
+        assert batch.results_path == str(tmp_path / 'out' / ocr_cli.RESULTS_NAME)
+    finally:
+        batch.close()
+    with pytest.raises(ValueError):
+        BatchPipeline(str(tmp_path / 'out'), output_mode='docx')
+
+
+def test_main_exits_non_zero_when_a_file_failed(tmp_path, tree, capsys):
+    argv = [str(tree), str(tmp_path / 'out'), '--workers', '1', '--mode', 'pdf',
+            '--cache-dir', str(tmp_path / 'cache'), '--json']
+    assert ocr_cli.main(argv) == 1
+    summary = json.loads(capsys.readouterr().out)
+    assert summary['failed'] == 1
+
+    os.remove(tree / 'b' / 'broken.pdf')
+    assert ocr_cli.main(argv) == 0
@@ -0,0 +1,90 @@
+import threading
+import zipfile
+
+import pikepdf
+from PIL import Image
+
+import postprocess
+from postprocess import PostProcessor, optimize_pdf, rebuild_zip, supported_level
+
+
+def scanned_pdf(path, pages=2):
+    images = [Image.new('RGB', (850, 1100), (255, 255, n * 40)) for n in range(pages)]
+    images[0].save(path, 'PDF', resolution=100, save_all=True, append_images=images[1:])
+    return str(path)
+
+
+def is_linearized(path):
+    with pikepdf.open(path) as pdf:
+        return pdf.is_linearized
+
+
+def test_level_drops_when_pngquant_is_missing(monkeypatch):
+    monkeypatch.setattr(postprocess.pngquant, 'available', lambda: False)
+    assert supported_level(3) == 1
+    assert supported_level(1) == 1
+    monkeypatch.setattr(postprocess.pngquant, 'available', lambda: True)
+    assert supported_level(3) == 3
+
+
+def test_optimize_linearizes_in_place_once(tmp_path):
+    for level in (0, 1):
+        path = scanned_pdf(tmp_path / f'level{level}.pdf')
+        sizes = optimize_pdf(path, level=level)
+        assert sizes and sizes[1] > 0
+        assert is_linearized(path)
+        with pikepdf.open(path) as pdf:
+            assert len(pdf.pages) == 2
+        # Already-linearized output is left alone
+        assert optimize_pdf(path, level=level) is None
+    # Only the optimized files are left behind, no temp files or work directories
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['level0.pdf', 'level1.pdf']
+
+
+def test_optimizing_an_evicted_file_is_a_no_op(tmp_path):
+    assert optimize_pdf(str(tmp_path / 'gone.pdf')) is None
+
+
+def test_rebuild_zip_swaps_members_and_keeps_the_rest(tmp_path):
+    zip_path = tmp_path / 'job.zip'
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        zf.writestr('a.pdf', b'old a')
+        zf.writestr('b.pdf', b'old b')
+    (tmp_path / 'new_a.pdf').write_bytes(b'new a')
+
+    rebuild_zip(str(zip_path), {'a.pdf': str(tmp_path / 'new_a.pdf'), 'b.pdf': str(tmp_path / 'missing.pdf')})
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.namelist() == ['a.pdf', 'b.pdf']
+        assert zf.read('a.pdf') == b'new a'
+        assert zf.read('b.pdf') == b'old b'
+
+
+def test_post_processor_optimizes_shared_files_once_and_rebuilds_the_zip(tmp_path):
+    cached = scanned_pdf(tmp_path / 'cached.pdf')
+    broken = tmp_path / 'broken.pdf'
+    broken.write_bytes(b'not a pdf')
+    zip_path = tmp_path / 'job.zip'
+    with zipfile.ZipFile(zip_path, 'w') as zf:
+        for name in ('one.pdf', 'same_as_one.pdf', 'broken.pdf'):
+            zf.writestr(name, b'placeholder')
+
+    done = threading.Event()
+    results = {}
+
+    def on_done(stats):
+        results.update(stats)
+        done.set()
+
+    processor = PostProcessor(workers=1, level=0)
+    try:
+        processor.submit('job-32', str(zip_path),
+                         {'one.pdf': cached, 'same_as_one.pdf': cached, 'broken.pdf': str(broken)},
+                         on_done=on_done)
+        assert done.wait(60)
+    finally:
+        processor.shutdown()
+
+    assert results['optimized_files'] == 1
+    assert results['errors'] == 1
+    with zipfile.ZipFile(zip_path) as zf:
+        assert zf.read('one.pdf') == zf.read('same_as_one.pdf') == open(cached, 'rb').read()
@@ -0,0 +1,143 @@
+import os
+
+import pytest
+
+import resources
+
+MEMINFO = "MemTotal:       16777216 kB\nMemFree:         1048576 kB\nMemAvailable:    8388608 kB\n"
+
+
+@pytest.fixture
+def proc():
+    """The /proc files the module reads, by path"""
+    return {'/proc/meminfo': MEMINFO, '/proc/self/cgroup': '0::/\n'}
+
+
+@pytest.fixture
+def host(tmp_path, monkeypatch, proc):
+    """
+    A fake /sys/fs/cgroup and /proc for the module to read: a 16GB, 8GB-available host with
+    eight CPUs. Tests write the cgroup files they need under the returned directory.
+    """
+    cgroup = tmp_path / 'cgroup'
+    cgroup.mkdir()
+    read = resources._read
+
+    def fake_read(path):
+        return proc[path].strip() if path in proc else read(path)
+
+    monkeypatch.setattr(resources, 'CGROUP_ROOT', str(cgroup))
+    monkeypatch.setattr(resources, '_read', fake_read)
+    monkeypatch.setattr(resources.os, 'sched_getaffinity', lambda pid: set(range(8)))
+    monkeypatch.delenv('WEB_CONCURRENCY', raising=False)
+    return cgroup
+
+
+def write(directory, name, value):
+    path = directory / name
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(value + '\n')
+
+
+def test_no_cgroup_means_the_whole_host(host):
+    assert resources.cgroup_version() is None
+    assert resources.cpu_quota() is None
+    assert resources.cpu_limit() == 8
+    assert resources.memory_limit_mb() == 16384
+    assert resources.available_memory_mb() == 8192
+
+
+def test_cgroup_v2_limits(host):
+    write(host, 'cgroup.controllers', 'cpu memory')
+    write(host, 'cpu.max', '250000 100000')
+    write(host, 'memory.max', str(4 * 1024 ** 3))
+    write(host, 'memory.current', str(3 * 1024 ** 3))
+
+    assert resources.cgroup_version() == 2
+    assert resources.cpu_quota() == 2.5
+    # Rounded down, so two busy workers aren't throttled every period
+    assert resources.cpu_limit() == 2
+    assert resources.memory_limit_mb() == 4096
+    assert resources.available_memory_mb() == 1024
+
+
+def test_cgroup_v2_unlimited(host):
+    write(host, 'cgroup.controllers', 'cpu memory')
+    write(host, 'cpu.max', 'max 100000')
+    write(host, 'memory.max', 'max')
+    write(host, 'memory.current', '0')
+    assert resources.cpu_quota() is None
+    assert resources.memory_limit_mb() == 16384
+    assert resources.cgroup_memory_available_mb() is None
+
+
+def test_cgroup_v2_reads_the_process_own_group(host, proc):
+    write(host, 'cgroup.controllers', 'cpu memory')
+    write(host, 'cpu.max', 'max 100000')
+    write(host / 'app.slice', 'cgroup.controllers', 'cpu memory')
+    write(host / 'app.slice', 'cpu.max', '100000 100000')
+    proc['/proc/self/cgroup'] = '0::/app.slice\n'
+    assert resources.cpu_quota() == 1.0
+    # A group that isn't mounted here falls back to the root
+    proc['/proc/self/cgroup'] = '0::/elsewhere\n'
+    assert resources.cpu_quota() is None
+
+
+def test_cgroup_v1_limits(host):
+    write(host / 'cpu,cpuacct', 'cpu.cfs_quota_us', '300000')
+    write(host / 'cpu,cpuacct', 'cpu.cfs_period_us', '100000')
+    write(host / 'memory', 'memory.limit_in_bytes', str(2 * 1024 ** 3))
+    write(host / 'memory', 'memory.usage_in_bytes', str(512 * 1024 ** 2))
+
+    assert resources.cgroup_version() == 1
+    assert resources.cpu_limit() == 3
+    assert resources.memory_limit_mb() == 2048
+    assert resources.available_memory_mb() == 1536
+
+
+def test_cgroup_v1_unlimited(host):
+    write(host / 'cpu', 'cpu.cfs_quota_us', '-1')
+    write(host / 'cpu', 'cpu.cfs_period_us', '100000')
+    write(host / 'memory', 'memory.limit_in_bytes', str(resources.CGROUP_V1_UNLIMITED))
+    write(host / 'memory', 'memory.usage_in_bytes', '0')
+    assert resources.cpu_quota() is None
+    assert resources.memory_limit_mb() == 16384
+
+
+def test_worker_sizes_share_the_cpus_once(host, monkeypatch):
+    # 8 CPUs and 16GB allow the maximum of two gunicorn workers
+    assert resources.web_workers() == resources.MAX_WEB_WORKERS == 2
+    assert resources.ocr_workers() == 4
+    assert resources.threads_per_worker(4) == 1
+    # A job with one file leaves its worker's other cores to tesseract
+    assert resources.threads_per_worker(1) == 4
+
+    monkeypatch.setenv('WEB_CONCURRENCY', '1')
+    assert resources.ocr_workers() == 8
+
+
+def test_memory_limits_the_web_worker_count(host):
+    write(host, 'cgroup.controllers', 'cpu memory')
+    write(host, 'memory.max', str(1024 ** 3))
+    write(host, 'memory.current', '0')
+    assert resources.web_workers() == 1
+
+
+def test_thread_limits(monkeypatch):
+    for name in resources.THREAD_ENV_VARS:
+        # Set before deleting, so the variables the module writes are removed again afterwards
+        monkeypatch.setenv(name, '1')
+        monkeypatch.delenv(name)
+    assert resources.thread_environment(0) == {name: '1' for name in resources.THREAD_ENV_VARS}
+
+    monkeypatch.setenv('OMP_THREAD_LIMIT', '6')
+    resources.apply_thread_limits(2)
+    # Explicit settings win at startup...
+    assert os.environ['OMP_THREAD_LIMIT'] == '6'
+    assert os.environ['OMP_NUM_THREADS'] == '2'
+
+    # ...but each pool process is pinned to its share, and chains to its own initializer
+    seen = []
+    resources.init_worker(3, seen.append, 'ready')
+    assert os.environ['OMP_THREAD_LIMIT'] == os.environ['MKL_NUM_THREADS'] == '3'
+    assert seen == ['ready']
@@ -0,0 +1,84 @@
+import gzip
+import os
+
+import pytest
+
+from result_store import ARCHIVE, HOT, LocalDirectoryBackend, ResultStore, StorageBackend, make_backend
+
+ZIP_BYTES = b'PK' + b'result ' * 1000
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ResultStore(str(tmp_path / 'hot'), LocalDirectoryBackend(str(tmp_path / 'archive')))
+
+
+def finished_zip(tmp_path, name='job.zip'):
+    path = tmp_path / name
+    path.write_bytes(ZIP_BYTES)
+    return str(path)
+
+
+def test_backend_must_implement_every_method():
+    class PutOnly(StorageBackend):
+        def put(self, key, path):
+            pass
+
+    with pytest.raises(TypeError):
+        PutOnly()
+
+
+def test_make_backend_accepts_paths_and_file_urls(tmp_path):
+    assert make_backend(str(tmp_path / 'a')).root == str(tmp_path / 'a')
+    assert make_backend(f"file://{tmp_path / 'b'}").root == str(tmp_path / 'b')
+    assert os.path.isdir(tmp_path / 'b')
+    with pytest.raises(ValueError):
+        make_backend('s3://bucket/results')
+
+
+def test_local_backend_round_trip(tmp_path):
+    backend = LocalDirectoryBackend(str(tmp_path / 'archive'))
+    source = finished_zip(tmp_path)
+    backend.put('key', source)
+    assert backend.exists('key')
+    backend.get('key', str(tmp_path / 'copy'))
+    assert (tmp_path / 'copy').read_bytes() == ZIP_BYTES
+    backend.delete('key')
+    backend.delete('key')
+    assert not backend.exists('key')
+    # No temp files left next to the objects
+    assert os.listdir(tmp_path / 'archive') == []
+
+
+def test_saved_result_is_served_from_the_hot_tier(tmp_path, store):
+    assert store.save('j1', finished_zip(tmp_path)) == len(ZIP_BYTES)
+    assert store.fetch('j1', HOT) == store.hot_path('j1')
+    assert [job_id for job_id, _ in store.local_copies()] == ['j1']
+
+
+def test_archived_result_is_compressed_and_restored_on_download(tmp_path, store):
+    store.save('j1', finished_zip(tmp_path))
+    store.archive('j1')
+    assert not os.path.exists(store.hot_path('j1'))
+    archived = tmp_path / 'archive' / store.archive_key('j1')
+    assert gzip.decompress(archived.read_bytes()) == ZIP_BYTES
+    assert archived.stat().st_size < len(ZIP_BYTES)
+
+    # A job recorded as hot whose file is gone isn't looked up in the archive
+    assert store.fetch('j1', HOT) is None
+    path = store.fetch('j1', ARCHIVE)
+    assert open(path, 'rb').read() == ZIP_BYTES
+    assert sorted(os.listdir(store.hot_dir)) == ['j1.zip']
+
+
+def test_drop_local_copy_keeps_the_archive_and_delete_removes_both(tmp_path, store):
+    store.save('j1', finished_zip(tmp_path))
+    store.archive('j1')
+    store.fetch('j1', ARCHIVE)
+    store.drop_local_copy('j1')
+    assert store.backend.exists(store.archive_key('j1'))
+
+    store.delete('j1')
+    store.delete('j1')
+    assert store.fetch('j1', ARCHIVE) is None
+    assert list(store.local_copies()) == []
@@ -0,0 +1,148 @@
+import os
+import shutil
+import subprocess
+import threading
+import time
+
+import ocrmypdf
+import pytest
+
+import pipeline
+from pipeline import FAST_OCR_PROFILE, OcrTimeout, process_single_pdf, run_ocr
+
+PDF = b'%PDF-1.4 scanned page'
+
+
+@pytest.fixture
+def scan(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'config', dict(pipeline.config, CACHE_FOLDER=str(tmp_path / 'cache'),
+                                                 OCR_RETRY_TIMEOUT_SECONDS=5))
+    os.makedirs(tmp_path / 'cache')
+    path = tmp_path / 'scan.pdf'
+    path.write_bytes(PDF)
+    return path
+
+
+def use_ocr(monkeypatch, fake):
+    """Replace ocrmypdf.ocr; the OCR child is forked, so it sees the replacement too"""
+    monkeypatch.setattr(ocrmypdf, 'ocr', fake)
+
+
+def copy_ocr(input_path, output_path, **options):
+    shutil.copyfile(input_path, output_path)
+
+
+def slow_unless_fast_profile(input_path, output_path, **options):
+    if options.get('skip_big') != FAST_OCR_PROFILE['skip_big']:
+        time.sleep(60)
+    shutil.copyfile(input_path, output_path)
+
+
+def never_finishes(input_path, output_path, **options):
+    time.sleep(60)
+
+
+class Unpicklable(Exception):
+    def __init__(self, message, handle):
+        super().__init__(message)
+        self.handle = handle
+
+    def __reduce__(self):
+        raise TypeError('cannot pickle')
+
+
+def test_ocr_runs_in_a_child_and_reports_its_errors(tmp_path, monkeypatch):
+    use_ocr(monkeypatch, copy_ocr)
+    (tmp_path / 'in.pdf').write_bytes(PDF)
+    run_ocr(str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf'), timeout=30, skip_text=True)
+    assert (tmp_path / 'out.pdf').read_bytes() == PDF
+
+    def prior_ocr(input_path, output_path, **options):
+        raise ocrmypdf.exceptions.PriorOcrFoundError()
+
+    use_ocr(monkeypatch, prior_ocr)
+    with pytest.raises(ocrmypdf.exceptions.PriorOcrFoundError):
+        run_ocr(str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf'))
+
+    def unpicklable(input_path, output_path, **options):
+        raise Unpicklable('tesseract said no', threading.Lock())
+
+    use_ocr(monkeypatch, unpicklable)
+    with pytest.raises(RuntimeError, match='tesseract said no'):
+        run_ocr(str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf'))
+
+
+def test_child_that_dies_is_an_error_not_a_hang(tmp_path, monkeypatch):
+    use_ocr(monkeypatch, lambda input_path, output_path, **options: os._exit(3))
+    with pytest.raises(RuntimeError, match='exit code 3'):
+        run_ocr(str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf'), timeout=30)
+
+
+def test_timeout_kills_ocr_and_everything_it_started(tmp_path, monkeypatch):
+    pid_file = tmp_path / 'tesseract.pid'
+
+    def hangs_in_a_helper(input_path, output_path, **options):
+        helper = subprocess.Popen(['sleep', '60'])
+        pid_file.write_text(str(helper.pid))
+        helper.wait()
+
+    use_ocr(monkeypatch, hangs_in_a_helper)
+    started = time.monotonic()
+    with pytest.raises(OcrTimeout):
+        run_ocr(str(tmp_path / 'in.pdf'), str(tmp_path / 'out.pdf'), timeout=1)
+    assert time.monotonic() - started < 10
+
+    helper_pid = int(pid_file.read_text())
+    # The helper was in the OCR child's process group, so it died with it (reaped by init, or a zombie)
+    deadline = time.monotonic() + 5
+    while time.monotonic() < deadline:
+        try:
+            with open(f'/proc/{helper_pid}/stat') as f:
+                state = f.read().rsplit(')', 1)[1].split()[0]
+        except FileNotFoundError:
+            break
+        if state == 'Z':
+            break
+        time.sleep(0.05)
+    else:
+        pytest.fail('the helper process outlived the timeout')
+
+
+def test_timed_out_file_is_retried_with_the_fast_profile(tmp_path, scan, monkeypatch):
+    use_ocr(monkeypatch, slow_unless_fast_profile)
+    result = process_single_pdf((str(scan), str(tmp_path / 'out.pdf'), 'scan.pdf', 1, (None, None), None, 'pdf'))
+    assert result['success'] and result['error'] is None
+    assert result['timed_out'] and result['fast_profile']
+    assert (tmp_path / 'out.pdf').read_bytes() == PDF
+    # The retried output is cached like any other
+    assert result['cache_path'] and os.path.exists(result['cache_path'])
+
+
+def test_file_that_times_out_twice_is_passed_through(tmp_path, scan, monkeypatch):
+    use_ocr(monkeypatch, never_finishes)
+    monkeypatch.setitem(pipeline.config, 'OCR_RETRY_TIMEOUT_SECONDS', 1)
+    result = process_single_pdf((str(scan), str(tmp_path / 'out.pdf'), 'scan.pdf', 1, (None, None), None, 'pdf'))
+    assert 'again after 1s with the fast profile' in result['error']
+    assert result['success'] and result['timed_out']
+    assert (tmp_path / 'out.pdf').read_bytes() == PDF
+    assert os.listdir(tmp_path / 'cache') == []
+
+
+def test_optimize_pre_pass_counts_against_the_timeout(tmp_path, scan, monkeypatch):
+    calls = tmp_path / 'calls'
+
+    def slow_optimize(input_path, output_path, timeout=None):
+        time.sleep(timeout + 0.2)
+        return input_path, False
+
+    def record_profile(input_path, output_path, **options):
+        with open(calls, 'a') as f:
+            f.write(f"{options['skip_big']}\n")
+        shutil.copyfile(input_path, output_path)
+
+    monkeypatch.setattr(pipeline, 'optimize_large_pdf', slow_optimize)
+    use_ocr(monkeypatch, record_profile)
+    result = process_single_pdf((str(scan), str(tmp_path / 'out.pdf'), 'scan.pdf', 1, (None, None), None, 'pdfa'))
+    # The full-profile run never started; only the cheaper retry did
+    assert calls.read_text().split() == [str(FAST_OCR_PROFILE['skip_big'])]
+    assert result['success'] and result['fast_profile'] and result['error'] is None
@@ -0,0 +1,142 @@
+import threading
+from datetime import datetime, timedelta
+
+import pytest
+from flask import Flask
+
+import saas_app
+from database import engine_options
+from saas_app import CreditReservation, UsageHistory, User, db
+
+THREADS = 8
+
+
+@pytest.fixture
+def app(tmp_path):
+    # saas_app is bound to instance/users.db; the tests get a database of their own
+    app = Flask('saas-tests')
+    uri = f'sqlite:///{tmp_path / "saas.db"}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def user(app):
+    user = User(email='racer@example.com', credits=10)
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+
+def balance(user_id):
+    db.session.expire_all()
+    return db.session.get(User, user_id).credits
+
+
+def race(app, work):
+    """Run `work(n)` from THREADS threads at once, each with its own session, and return the results"""
+    barrier = threading.Barrier(THREADS)
+    results = [None] * THREADS
+    errors = []
+
+    def run(n):
+        with app.app_context():
+            try:
+                barrier.wait()
+                results[n] = work(n)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=run, args=(n,)) for n in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return results
+
+
+def test_concurrent_reservations_never_overspend(app, user):
+    user_id = user.id
+
+    def reserve(n):
+        reservation = saas_app.reserve_credits(db.session.get(User, user_id), 3)
+        return reservation.id if reservation else None
+
+    granted = [result for result in race(app, reserve) if result]
+    assert len(granted) == 3
+    assert balance(user_id) == 1
+    assert CreditReservation.query.count() == 3
+
+
+def test_settling_twice_refunds_once(app, user):
+    reservation = saas_app.reserve_credits(user, 6)
+    assert saas_app.settle_reservation(reservation, files_processed=1, credits_used=2)
+    assert not saas_app.settle_reservation(reservation, files_processed=1, credits_used=2)
+
+    assert balance(user.id) == 8
+    assert UsageHistory.query.count() == 1
+
+
+def test_concurrent_settles_refund_once(app, user):
+    user_id, reservation_id = user.id, saas_app.reserve_credits(user, 6).id
+
+    def settle(n):
+        return saas_app.settle_reservation(db.session.get(CreditReservation, reservation_id), 1, 2)
+
+    assert sorted(race(app, settle)) == [False] * (THREADS - 1) + [True]
+    assert balance(user_id) == 8
+    assert UsageHistory.query.count() == 1
+
+
+def age(reservation):
+    reservation.created_at = datetime.utcnow() - timedelta(hours=7)
+    db.session.commit()
+
+
+def test_settle_after_release_changes_nothing(app, user):
+    reservation = saas_app.reserve_credits(user, 6)
+    age(reservation)
+    saas_app.release_stale_reservations()
+    assert balance(user.id) == 10
+
+    assert not saas_app.settle_reservation(reservation, files_processed=1, credits_used=2)
+    assert balance(user.id) == 10
+    assert db.session.get(CreditReservation, reservation.id).status == 'released'
+    assert UsageHistory.query.count() == 0
+
+
+def test_release_after_settle_changes_nothing(app, user):
+    reservation = saas_app.reserve_credits(user, 6)
+    age(reservation)
+    assert saas_app.settle_reservation(reservation, files_processed=1, credits_used=2)
+
+    saas_app.release_stale_reservations()
+    assert balance(user.id) == 8
+    assert db.session.get(CreditReservation, reservation.id).status == 'settled'
+
+
+def test_settle_racing_the_stale_sweep_closes_the_reservation_once(app, user):
+    reservation = saas_app.reserve_credits(user, 6)
+    age(reservation)
+    user_id, reservation_id = user.id, reservation.id
+
+    def settle_or_sweep(n):
+        if n % 2:
+            return saas_app.settle_reservation(db.session.get(CreditReservation, reservation_id), 1, 2)
+        saas_app.release_stale_reservations()
+
+    race(app, settle_or_sweep)
+    db.session.expire_all()
+    status = db.session.get(CreditReservation, reservation_id).status
+    # Either the batch was charged for what it used, or the whole hold went back; never both
+    assert (status, balance(user_id)) in [('settled', 8), ('released', 10)]
+    assert UsageHistory.query.count() == (status == 'settled')
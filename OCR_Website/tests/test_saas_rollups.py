@@ -0,0 +1,102 @@
+import threading
+from datetime import date, datetime, timedelta
+
+import pytest
+from flask import Flask
+
+from database import engine_options
+from saas_app import (DailyGlobalUsage, DailyUserUsage, User, db, record_usage, usage_by_day,
+                      usage_totals)
+
+THREADS = 8
+
+
+@pytest.fixture
+def app(tmp_path):
+    # saas_app is bound to instance/users.db; the tests get a database of their own
+    app = Flask('saas-tests')
+    uri = f'sqlite:///{tmp_path / "saas.db"}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = uri
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(uri)
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.engine.dispose()
+
+
+@pytest.fixture
+def users(app):
+    users = [User(email=f'user{n}@example.com') for n in range(2)]
+    db.session.add_all(users)
+    db.session.commit()
+    return [user.id for user in users]
+
+
+def job(pages=10, cpu_seconds=2.5, cache_hits=0, credits_used=1):
+    return {'jobs': 1, 'files': 2, 'pages': pages, 'cpu_seconds': cpu_seconds, 'cache_hits': cache_hits,
+            'credits_used': credits_used}
+
+
+def test_jobs_fold_into_user_and_global_rows(app, users):
+    day = date(2026, 10, 1)
+    record_usage(users[0], job(pages=10), day=day)
+    record_usage(users[0], job(pages=5, cache_hits=1), day=day)
+    record_usage(users[1], job(pages=7), day=day)
+    record_usage(users[0], job(pages=1), day=day + timedelta(days=1))
+    db.session.commit()
+
+    first = DailyUserUsage.query.filter_by(user_id=users[0], day=day).one()
+    assert (first.jobs, first.files, first.pages, first.cache_hits) == (2, 4, 15, 1)
+    assert first.cpu_seconds == 5.0
+    overall = db.session.get(DailyGlobalUsage, day)
+    assert (overall.jobs, overall.pages, overall.credits_used) == (3, 22, 3)
+    assert DailyUserUsage.query.count() == 3
+
+
+def test_concurrent_first_jobs_of_the_day_share_one_row(app, users):
+    day = date(2026, 10, 2)
+    barrier = threading.Barrier(THREADS)
+    errors = []
+
+    def settle():
+        with app.app_context():
+            try:
+                barrier.wait()
+                record_usage(users[0], job(pages=1), day=day)
+                db.session.commit()
+            except Exception as e:
+                errors.append(e)
+            finally:
+                db.session.remove()
+
+    threads = [threading.Thread(target=settle) for _ in range(THREADS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert not errors
+    db.session.expire_all()
+    row = DailyUserUsage.query.filter_by(user_id=users[0], day=day).one()
+    assert (row.jobs, row.pages) == (THREADS, THREADS)
+    assert db.session.get(DailyGlobalUsage, day).jobs == THREADS
+
+
+def test_usage_series_fills_empty_days(app, users):
+    today = datetime.utcnow().date()
+    record_usage(users[0], job(pages=4, cpu_seconds=1.25), day=today)
+    record_usage(users[0], job(pages=6), day=today - timedelta(days=2))
+    record_usage(users[1], job(pages=100), day=today)
+    # Outside the window
+    record_usage(users[0], job(pages=50), day=today - timedelta(days=7))
+    db.session.commit()
+
+    series = usage_by_day(DailyUserUsage, days=3, user_id=users[0])
+    assert [entry['day'] for entry in series] == [(today - timedelta(days=n)).isoformat() for n in (2, 1, 0)]
+    assert [entry['pages'] for entry in series] == [6, 0, 4]
+    assert series[2]['cpu_seconds'] == 1.2
+    totals = usage_totals(series)
+    assert (totals['jobs'], totals['pages']) == (2, 10)
+    assert usage_totals(usage_by_day(DailyGlobalUsage, days=3))['pages'] == 110
@@ -0,0 +1,135 @@
+from concurrent.futures import Future
+
+import pytest
+
+from scheduler import FairShareScheduler
+
+
+class ManualExecutor:
+    """Stands in for the process pool: records what was started and finishes it on demand"""
+
+    def __init__(self):
+        self.started = []
+
+    def submit(self, fn, *args):
+        future = Future()
+        future.set_running_or_notify_cancel()
+        self.started.append((args[0], future))
+        return future
+
+    def finish(self, name):
+        for started, future in self.started:
+            if started == name and not future.done():
+                future.set_result(name)
+                return
+        raise AssertionError(f"{name} is not running")
+
+    def names(self):
+        return [name for name, _ in self.started]
+
+    def running(self):
+        return [name for name, future in self.started if not future.done()]
+
+
+def task(name):
+    return name
+
+
+@pytest.fixture
+def make_scheduler():
+    def make(slots, fast_lane_reserved=1):
+        scheduler = FairShareScheduler(slots=slots, fast_lane_reserved=fast_lane_reserved)
+        # The pool never started a process; swap it for one the test drives by hand
+        scheduler._executor.shutdown(wait=False)
+        scheduler._executor = ManualExecutor()
+        return scheduler
+    return make
+
+
+def drain(scheduler):
+    """Finish running tasks one at a time, in start order, until nothing is left"""
+    executor = scheduler._executor
+    while executor.running():
+        executor.finish(executor.running()[0])
+    return executor.names()
+
+
+def test_weighted_round_robin_order(make_scheduler):
+    scheduler = make_scheduler(slots=1, fast_lane_reserved=0)
+    scheduler.submit('z', 'job-z', task, 'blocker')
+    for n in range(4):
+        scheduler.submit('a', 'job-a', task, f'a{n}', weight=2)
+    for n in range(3):
+        scheduler.submit('b', 'job-b', task, f'b{n}', weight=1)
+
+    # The newest user goes first, then each user gets `weight` tasks per round
+    assert drain(scheduler) == ['blocker', 'b0', 'a0', 'a1', 'b1', 'a2', 'a3', 'b2']
+
+
+def test_jobs_of_one_user_take_turns(make_scheduler):
+    scheduler = make_scheduler(slots=1, fast_lane_reserved=0)
+    scheduler.submit('u', 'blocker', task, 'blocker')
+    for n in range(3):
+        scheduler.submit('u', 'big', task, f'big{n}')
+    scheduler.submit('u', 'small', task, 'small0')
+
+    order = drain(scheduler)
+    assert order.index('small0') < order.index('big2')
+
+
+def test_fast_lane_has_a_reserved_slot(make_scheduler):
+    scheduler = make_scheduler(slots=3, fast_lane_reserved=1)
+    for n in range(5):
+        scheduler.submit('bulk', 'batch', task, f'bulk{n}')
+    # Bulk work stops one slot short, so an interactive upload starts at once
+    assert scheduler._executor.running() == ['bulk0', 'bulk1']
+
+    future = scheduler.submit('user', 'single', task, 'fast', fast_lane=True)
+    assert scheduler._executor.running() == ['bulk0', 'bulk1', 'fast']
+    scheduler._executor.finish('fast')
+    assert future.result(timeout=1) == 'fast'
+
+
+def test_fast_lane_is_served_before_queued_bulk_work(make_scheduler):
+    scheduler = make_scheduler(slots=3, fast_lane_reserved=1)
+    for n in range(4):
+        scheduler.submit('bulk', 'batch', task, f'bulk{n}')
+    scheduler.submit('user', 'single', task, 'fast', fast_lane=True)
+    scheduler.submit('user', 'single2', task, 'fast2', fast_lane=True)
+
+    scheduler._executor.finish('bulk0')
+    assert scheduler._executor.running()[-1] == 'fast2'
+
+
+def test_small_pools_reserve_nothing(make_scheduler):
+    scheduler = make_scheduler(slots=2, fast_lane_reserved=1)
+    for n in range(3):
+        scheduler.submit('bulk', 'batch', task, f'bulk{n}')
+    assert scheduler._executor.running() == ['bulk0', 'bulk1']
+
+
+def test_cancel_job_drops_only_its_queued_tasks(make_scheduler):
+    scheduler = make_scheduler(slots=1, fast_lane_reserved=0)
+    running = scheduler.submit('a', 'doomed', task, 'doomed0')
+    queued = [scheduler.submit('a', 'doomed', task, f'doomed{n}') for n in (1, 2)]
+    other = scheduler.submit('b', 'kept', task, 'kept0')
+
+    assert scheduler.cancel_job('doomed') == 2
+    assert all(future.cancelled() for future in queued)
+    assert scheduler.queued() == 1
+
+    # The task already running finishes normally, and the other job still runs
+    assert drain(scheduler) == ['doomed0', 'kept0']
+    assert running.result(timeout=1) == 'doomed0'
+    assert other.result(timeout=1) == 'kept0'
+
+
+def test_cancel_job_covers_the_fast_lane(make_scheduler):
+    scheduler = make_scheduler(slots=3, fast_lane_reserved=1)
+    for n in range(3):
+        scheduler.submit('bulk', 'batch', task, f'bulk{n}')
+    scheduler.submit('user', 'single', task, 'fast0', fast_lane=True)
+    queued = scheduler.submit('user', 'single', task, 'fast1', fast_lane=True)
+
+    assert scheduler.cancel_job('single') == 1
+    assert queued.cancelled()
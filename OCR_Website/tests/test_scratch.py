@@ -0,0 +1,104 @@
+import os
+import time
+from types import SimpleNamespace
+
+import pytest
+
+import scratch
+from scratch import ScratchQuotaExceeded, ScratchSpace, choose_work_dir, link_or_copy, sweep_stale
+
+
+def write(path, size):
+    with open(path, 'wb') as f:
+        f.write(b'x' * size)
+    return str(path)
+
+
+def test_link_or_copy_hardlinks_when_allowed(tmp_path):
+    src = write(tmp_path / 'src.pdf', 10)
+    dst = str(tmp_path / 'dst.pdf')
+    assert link_or_copy(src, dst) == 'link'
+    assert os.stat(src).st_ino == os.stat(dst).st_ino
+
+
+def test_link_or_copy_never_shares_a_user_file(tmp_path):
+    src = write(tmp_path / 'src.pdf', 10)
+    dst = str(tmp_path / 'dst.pdf')
+    assert link_or_copy(src, dst, hardlink=False) in ('reflink', 'copy')
+    assert os.stat(src).st_ino != os.stat(dst).st_ino
+    # Editing the copy in place leaves the original alone
+    with open(dst, 'ab') as f:
+        f.write(b'more')
+    assert os.path.getsize(src) == 10
+
+
+def test_link_or_copy_replaces_an_existing_destination(tmp_path):
+    src = write(tmp_path / 'src.pdf', 10)
+    dst = write(tmp_path / 'dst.pdf', 99)
+    link_or_copy(src, dst)
+    assert os.path.getsize(dst) == 10
+
+
+def test_work_dir_is_tmpfs_only_when_the_file_fits(tmp_path, monkeypatch):
+    hot, cold = str(tmp_path / 'hot'), str(tmp_path / 'cold')
+    os.makedirs(hot)
+    small = write(tmp_path / 'small.pdf', 1000)
+    assert choose_work_dir(small, hot, cold) == hot
+    assert choose_work_dir(small, None, cold) == cold
+    assert choose_work_dir(small, cold, cold) == cold
+
+    # Intermediates of a 1000-byte file need 4000 bytes; half of a 6000-byte tmpfs isn't enough
+    monkeypatch.setattr(scratch.shutil, 'disk_usage', lambda path: SimpleNamespace(free=6000))
+    assert choose_work_dir(small, hot, cold) == cold
+
+
+def test_scratch_space_uses_tmpfs_and_cleans_up(tmp_path):
+    shm = tmp_path / 'shm'
+    shm.mkdir()
+    with ScratchSpace('j1', str(tmp_path / 'scratch'), tmpfs_root=str(shm), expected_bytes=1000) as space:
+        assert space.on_tmpfs
+        assert os.path.dirname(space.hot) == str(shm)
+        write(os.path.join(space.mkdir('pages'), 'page.pdf'), 100)
+        write(os.path.join(space.hot, 'raster'), 50)
+        assert space.usage() == 150
+    assert not os.path.exists(space.root)
+    assert not os.path.exists(space.hot)
+    assert space.root not in scratch._live_spaces
+    # A second cleanup is a no-op
+    space.cleanup()
+
+
+def test_large_job_keeps_intermediates_on_disk(tmp_path):
+    space = ScratchSpace('j2', str(tmp_path / 'scratch'), tmpfs_root=str(tmp_path / 'missing'))
+    assert not space.on_tmpfs
+    assert space.hot.startswith(space.root)
+    space.cleanup()
+
+
+def test_quota_is_enforced(tmp_path):
+    space = ScratchSpace('j3', str(tmp_path / 'scratch'), tmpfs_root=None, quota_bytes=100)
+    write(os.path.join(space.root, 'a'), 80)
+    space.check_quota()
+    write(os.path.join(space.hot, 'b'), 40)
+    with pytest.raises(ScratchQuotaExceeded):
+        space.check_quota()
+    space.cleanup()
+
+
+def test_sweep_removes_only_old_job_directories(tmp_path):
+    root = tmp_path / 'scratch'
+    root.mkdir()
+    stale = root / 'job_old_abc'
+    recent = root / 'job_new_abc'
+    unrelated = root / 'keep_me'
+    for path in (stale, recent, unrelated):
+        path.mkdir()
+    old = time.time() - 48 * 60 * 60
+    os.utime(stale, (old, old))
+    os.utime(unrelated, (old, old))
+    live = ScratchSpace('live', str(root), tmpfs_root=None)
+    os.utime(live.root, (old, old))
+
+    assert sweep_stale([str(root), None, str(tmp_path / 'missing')]) == 1
+    assert sorted(os.listdir(root)) == sorted([recent.name, unrelated.name, os.path.basename(live.root)])
+    live.cleanup()
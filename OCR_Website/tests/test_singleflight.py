@@ -0,0 +1,70 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import pytest
+
+from singleflight import SingleFlight, chain_future
+
+
+def test_chain_future_copies_result_exception_and_cancellation():
+    source, target = Future(), Future()
+    chain_future(source, target)
+    source.set_result('done')
+    assert target.result(timeout=1) == 'done'
+
+    source, target = Future(), Future()
+    chain_future(source, target)
+    source.set_exception(ValueError('bad page'))
+    with pytest.raises(ValueError):
+        target.result(timeout=1)
+
+    source, target = Future(), Future()
+    chain_future(source, target)
+    source.cancel()
+    assert target.cancelled()
+
+
+def test_concurrent_callers_share_one_computation():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        release.wait(5)
+        return 'result'
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        first, first_shared = flight.run('hash', lambda: pool.submit(work))
+        second, second_shared = flight.run('hash', lambda: pool.submit(work))
+        other, other_shared = flight.run('other', lambda: pool.submit(lambda: 'other'))
+        assert (first_shared, second_shared, other_shared) == (False, True, False)
+        assert second is first
+        release.set()
+        assert second.result(timeout=5) == 'result'
+        assert other.result(timeout=5) == 'other'
+    assert calls == [1]
+
+
+def test_key_is_released_once_the_computation_finishes():
+    flight = SingleFlight()
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        first, _ = flight.run('hash', lambda: pool.submit(lambda: 1))
+        first.result(timeout=5)
+        assert flight.in_flight() == 0
+        second, shared = flight.run('hash', lambda: pool.submit(lambda: 2))
+        assert not shared
+        assert second.result(timeout=5) == 2
+
+
+def test_failed_submit_is_reported_to_every_waiter_and_released():
+    flight = SingleFlight()
+
+    def submit():
+        raise RuntimeError('pool is shut down')
+
+    future, shared = flight.run('hash', submit)
+    assert not shared
+    with pytest.raises(RuntimeError):
+        future.result(timeout=1)
+    assert flight.in_flight() == 0
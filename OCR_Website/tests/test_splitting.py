@@ -0,0 +1,143 @@
+import os
+
+import pikepdf
+import pytest
+from pikepdf import Array, Dictionary, Name, OutlineItem
+
+from splitting import chunk_name, chunk_ranges, merge_chunks, page_count, split_pdf
+
+PAGES = 7
+
+
+def marker(page):
+    return page.obj.Contents.read_bytes().decode()
+
+
+def make_original(path):
+    pdf = pikepdf.new()
+    for n in range(PAGES):
+        pdf.add_blank_page(page_size=(200 + n, 300))
+        pdf.pages[-1].obj.Contents = pdf.make_stream(f'original {n}'.encode())
+    pdf.Root.PageLabels = Dictionary(Nums=Array([0, Dictionary(S=Name.r)]))
+    with pdf.open_outline() as outline:
+        outline.root.append(OutlineItem('Chapter', 5))
+    pdf.docinfo['/Title'] = 'Case file'
+    pdf.save(path)
+    return str(path)
+
+
+def fake_ocr(chunk_path, start, pdfa=False):
+    """Rewrite a chunk's pages the way OCR would, marking each with its page number"""
+    output = f'{chunk_path}.ocr.pdf'
+    with pikepdf.open(chunk_path) as chunk:
+        for offset, page in enumerate(chunk.pages):
+            page.obj.Contents = chunk.make_stream(f'ocr {start + offset}'.encode())
+        if pdfa:
+            chunk.Root.OutputIntents = Array([Dictionary(Type=Name.OutputIntent, S=Name.GTS_PDFA1)])
+            with chunk.open_metadata() as meta:
+                meta['pdfaid:part'] = '2'
+                meta['pdfaid:conformance'] = 'B'
+        chunk.save(output)
+    return output
+
+
+@pytest.fixture
+def original(tmp_path):
+    return make_original(tmp_path / 'original.pdf')
+
+
+def test_chunk_ranges_cover_every_page_once():
+    assert chunk_ranges(7, 3) == [(0, 3), (3, 6), (6, 7)]
+    assert chunk_ranges(6, 3) == [(0, 3), (3, 6)]
+    assert chunk_ranges(2, 0) == [(0, 1), (1, 2)]
+
+
+def test_chunk_names_sort_in_page_order():
+    names = [chunk_name('scan.pdf', start, stop) for start, stop in chunk_ranges(2500, 1000)]
+    assert names == sorted(names) == ['scan.pages00001-01000.pdf', 'scan.pages01001-02000.pdf',
+                                      'scan.pages02001-02500.pdf']
+
+
+def test_split_keeps_page_order(tmp_path, original):
+    ranges = chunk_ranges(PAGES, 3)
+    paths = split_pdf(original, ranges, str(tmp_path))
+    assert [page_count(path) for path in paths] == [3, 3, 1]
+    seen = []
+    for path in paths:
+        with pikepdf.open(path) as chunk:
+            seen.extend(marker(page) for page in chunk.pages)
+    assert seen == [f'original {n}' for n in range(PAGES)]
+
+
+def test_split_is_deterministic(tmp_path, original):
+    first, second = tmp_path / 'first', tmp_path / 'second'
+    first.mkdir()
+    second.mkdir()
+    ranges = chunk_ranges(PAGES, 3)
+    for a, b in zip(split_pdf(original, ranges, str(first)), split_pdf(original, ranges, str(second))):
+        with open(a, 'rb') as fa, open(b, 'rb') as fb:
+            assert fa.read() == fb.read()
+
+
+def test_merge_restores_page_order(tmp_path, original):
+    ranges = chunk_ranges(PAGES, 3)
+    chunks = split_pdf(original, ranges, str(tmp_path))
+    outputs = [fake_ocr(path, start) for path, (start, _) in zip(chunks, ranges)]
+    merged = str(tmp_path / 'merged.pdf')
+    merge_chunks(original, ranges, outputs, merged)
+
+    with pikepdf.open(merged) as pdf:
+        assert [marker(page) for page in pdf.pages] == [f'ocr {n}' for n in range(PAGES)]
+        assert [float(page.mediabox[2]) for page in pdf.pages] == [200 + n for n in range(PAGES)]
+
+
+def test_merge_keeps_the_original_document_structure(tmp_path, original):
+    ranges = chunk_ranges(PAGES, 3)
+    chunks = split_pdf(original, ranges, str(tmp_path))
+    outputs = [fake_ocr(path, start) for path, (start, _) in zip(chunks, ranges)]
+    merged = str(tmp_path / 'merged.pdf')
+    merge_chunks(original, ranges, outputs, merged)
+
+    with pikepdf.open(merged) as pdf:
+        assert '/PageLabels' in pdf.Root
+        assert pdf.docinfo['/Title'] == 'Case file'
+        with pdf.open_outline() as outline:
+            target = outline.root[0].destination[0]
+            assert target.objgen == pdf.pages[5].obj.objgen
+
+
+def test_failed_chunk_keeps_its_original_pages(tmp_path, original):
+    ranges = chunk_ranges(PAGES, 3)
+    chunks = split_pdf(original, ranges, str(tmp_path))
+    outputs = [fake_ocr(chunks[0], 0), None, fake_ocr(chunks[2], 6)]
+    merged = str(tmp_path / 'merged.pdf')
+    merge_chunks(original, ranges, outputs, merged, pdfa=False)
+
+    with pikepdf.open(merged) as pdf:
+        assert [marker(page) for page in pdf.pages] == \
+            ['ocr 0', 'ocr 1', 'ocr 2', 'original 3', 'original 4', 'original 5', 'ocr 6']
+
+
+def test_pdfa_claim_only_survives_a_complete_merge(tmp_path, original):
+    ranges = chunk_ranges(PAGES, 3)
+    chunks = split_pdf(original, ranges, str(tmp_path))
+    outputs = [fake_ocr(path, start, pdfa=True) for path, (start, _) in zip(chunks, ranges)]
+    merged = str(tmp_path / 'merged.pdf')
+
+    merge_chunks(original, ranges, outputs, merged, pdfa=True)
+    with pikepdf.open(merged) as pdf:
+        assert '/OutputIntents' in pdf.Root
+        assert pdf.open_metadata().get('pdfaid:part') == '2'
+
+    merge_chunks(original, ranges, [outputs[0], None, outputs[2]], merged, pdfa=False)
+    with pikepdf.open(merged) as pdf:
+        assert '/OutputIntents' not in pdf.Root
+        assert 'pdfaid:part' not in pdf.open_metadata()
+
+
+def test_merge_refuses_a_chunk_with_the_wrong_page_count(tmp_path, original):
+    ranges = chunk_ranges(PAGES, 3)
+    chunks = split_pdf(original, ranges, str(tmp_path))
+    with pytest.raises(ValueError, match='expected 3'):
+        merge_chunks(original, ranges, [chunks[2], None, None], str(tmp_path / 'merged.pdf'))
+    assert not os.path.exists(tmp_path / 'merged.pdf')
@@ -0,0 +1,90 @@
+import gzip
+import os
+
+import pytest
+from flask import Flask, render_template_string
+
+import static_assets
+from static_assets import IMMUTABLE_CACHE_CONTROL, build, init_static_assets, load_manifest
+
+CSS = b'body { color: black; }\n' * 50
+
+
+@pytest.fixture
+def static_folder(tmp_path):
+    folder = tmp_path / 'static'
+    (folder / 'css').mkdir(parents=True)
+    (folder / 'css' / 'site.css').write_bytes(CSS)
+    (folder / 'logo.png').write_bytes(b'png')
+    return folder
+
+
+def make_app(static_folder):
+    app = Flask(__name__, static_folder=str(static_folder))
+    init_static_assets(app)
+    return app
+
+
+def test_build_writes_hashed_precompressed_copies(static_folder):
+    manifest = build(str(static_folder))
+    hashed = manifest['css/site.css']
+    assert list(manifest) == ['css/site.css']
+    assert hashed.startswith('dist/css/site.') and hashed.endswith('.css')
+    assert (static_folder / hashed).read_bytes() == CSS
+    assert gzip.decompress((static_folder / (hashed + '.gz')).read_bytes()) == CSS
+    assert load_manifest(str(static_folder)) == manifest
+
+    # Rebuilding doesn't pick up its own output, and unchanged content keeps its name
+    assert build(str(static_folder)) == manifest
+    (static_folder / 'css' / 'site.css').write_bytes(CSS + b'a { }\n')
+    assert build(str(static_folder))['css/site.css'] != hashed
+
+
+def test_without_a_build_assets_are_served_as_before(static_folder):
+    app = make_app(static_folder)
+    with app.test_request_context():
+        assert render_template_string("{{ url_for('static', filename='css/site.css') }}") == '/static/css/site.css'
+    response = app.test_client().get('/static/css/site.css')
+    assert response.data == CSS
+    assert 'immutable' not in response.headers.get('Cache-Control', '')
+
+
+def test_url_for_returns_the_hashed_name(static_folder):
+    hashed = build(str(static_folder))['css/site.css']
+    app = make_app(static_folder)
+    with app.test_request_context():
+        assert render_template_string("{{ url_for('static', filename='css/site.css') }}") == f'/static/{hashed}'
+        # Files outside the manifest keep their names
+        assert render_template_string("{{ url_for('static', filename='logo.png') }}") == '/static/logo.png'
+
+
+def test_hashed_asset_is_served_compressed_and_immutable(static_folder, monkeypatch):
+    monkeypatch.setattr(static_assets, 'brotli', None)
+    hashed = build(str(static_folder))['css/site.css']
+    client = make_app(static_folder).test_client()
+
+    response = client.get(f'/static/{hashed}', headers={'Accept-Encoding': 'br, gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert response.mimetype == 'text/css'
+    assert response.headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+    assert response.headers['Vary'] == 'Accept-Encoding'
+    assert gzip.decompress(response.data) == CSS
+
+
+def test_refused_encodings_fall_back_to_the_plain_file(static_folder):
+    hashed = build(str(static_folder))['css/site.css']
+    client = make_app(static_folder).test_client()
+
+    for accept in ('gzip;q=0', 'identity', 'x-gzip-ish'):
+        response = client.get(f'/static/{hashed}', headers={'Accept-Encoding': accept})
+        assert 'Content-Encoding' not in response.headers, accept
+        assert response.data == CSS
+        assert response.headers['Cache-Control'] == IMMUTABLE_CACHE_CONTROL
+
+
+@pytest.mark.skipif(static_assets.brotli is None, reason='brotli is not installed')
+def test_brotli_is_preferred_when_accepted(static_folder):
+    hashed = build(str(static_folder))['css/site.css']
+    assert os.path.exists(static_folder / (hashed + '.br'))
+    response = make_app(static_folder).test_client().get(f'/static/{hashed}', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers['Content-Encoding'] == 'br'
@@ -0,0 +1,102 @@
+import os
+import time
+
+import pytest
+
+import watch_folder
+from watch_folder import FolderWatcher
+
+SETTLE_SECONDS = 0.2
+
+
+@pytest.fixture(params=['inotify', 'polling'])
+def make_watcher(request, tmp_path):
+    if request.param == 'inotify' and watch_folder.INotify is None:
+        pytest.skip('inotify_simple is not installed')
+    watchers = []
+
+    def make(**options):
+        watcher = FolderWatcher(str(tmp_path), settle_seconds=SETTLE_SECONDS, poll_interval=0,
+                                use_inotify=request.param == 'inotify', **options)
+        watchers.append(watcher)
+        return watcher
+
+    yield make
+    for watcher in watchers:
+        watcher.close()
+
+
+def write(path, data=b'%PDF-1.4 scan'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'ab') as f:
+        f.write(data)
+
+
+def collect(watcher, seconds=SETTLE_SECONDS * 3):
+    """Everything the watcher reports over `seconds`"""
+    reported = []
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        reported.extend(watcher.poll(timeout=0.05))
+    return reported
+
+
+def test_existing_and_new_files_are_reported_once(tmp_path, make_watcher):
+    write(tmp_path / 'existing.pdf')
+    watcher = make_watcher()
+    write(tmp_path / 'sub' / 'new.PDF')
+    write(tmp_path / 'notes.txt')
+    write(tmp_path / '.partial.pdf')
+    write(tmp_path / '~$draft.pdf')
+
+    assert sorted(collect(watcher)) == ['existing.pdf', os.path.join('sub', 'new.PDF')]
+    assert collect(watcher, SETTLE_SECONDS * 2) == []
+
+
+def test_file_is_held_back_while_it_is_still_being_written(tmp_path, make_watcher):
+    watcher = make_watcher()
+    path = tmp_path / 'copying.pdf'
+    write(path)
+    for _ in range(4):
+        assert watcher.poll(timeout=SETTLE_SECONDS / 3) == []
+        write(path, b'more')
+    assert collect(watcher) == ['copying.pdf']
+
+
+def test_empty_file_waits_for_its_first_bytes(tmp_path, make_watcher):
+    watcher = make_watcher()
+    (tmp_path / 'empty.pdf').touch()
+    assert collect(watcher) == []
+    write(tmp_path / 'empty.pdf')
+    assert collect(watcher) == ['empty.pdf']
+
+
+def test_changed_file_is_reported_again(tmp_path, make_watcher):
+    write(tmp_path / 'scan.pdf')
+    watcher = make_watcher()
+    assert collect(watcher) == ['scan.pdf']
+    time.sleep(0.01)
+    write(tmp_path / 'scan.pdf', b'rescanned')
+    assert collect(watcher) == ['scan.pdf']
+
+
+def test_excluded_tree_and_other_extensions(tmp_path, make_watcher):
+    watcher = make_watcher(exclude=[str(tmp_path / 'out')], extensions=('.pdf', '.tif'))
+    write(tmp_path / 'out' / 'result.pdf')
+    write(tmp_path / 'scan.tif')
+    assert collect(watcher) == ['scan.tif']
+
+
+def test_folder_dropped_in_whole_is_picked_up(tmp_path, make_watcher):
+    watcher = make_watcher()
+    staging = tmp_path.parent / f'{tmp_path.name}_staging'
+    write(staging / 'batch' / 'a.pdf')
+    write(staging / 'batch' / 'b.pdf')
+    os.rename(staging / 'batch', tmp_path / 'batch')
+    assert sorted(collect(watcher)) == [os.path.join('batch', 'a.pdf'), os.path.join('batch', 'b.pdf')]
+
+
+def test_mode_reports_how_the_folder_is_watched(tmp_path):
+    watcher = FolderWatcher(str(tmp_path), use_inotify=False, poll_interval=2.5)
+    assert watcher.mode == 'polling every 2.5s'
+    watcher.close()
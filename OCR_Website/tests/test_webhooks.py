@@ -0,0 +1,93 @@
+import time
+
+import pytest
+
+from webhooks import (UnsafeWebhookURL, backoff_seconds, error_class, resolve_url, sign, signature_header,
+                      verify)
+
+SECRET = 'test-secret'
+BODY = b'{"event": "job.completed"}'
+
+
+def test_signature_round_trip():
+    assert verify(SECRET, signature_header(SECRET, BODY), BODY)
+
+
+def test_signature_format():
+    header = signature_header(SECRET, BODY, timestamp=1700000000)
+    assert header == f't=1700000000,v1={sign(SECRET, 1700000000, BODY)}'
+
+
+@pytest.mark.parametrize('secret, body', [
+    ('other-secret', BODY),
+    (SECRET, BODY + b' '),
+])
+def test_signature_rejects_wrong_secret_or_body(secret, body):
+    assert not verify(secret, signature_header(SECRET, BODY), body)
+
+
+def test_signature_rejects_stale_timestamp():
+    header = signature_header(SECRET, BODY, timestamp=time.time() - 3600)
+    assert not verify(SECRET, header, BODY, tolerance=300)
+    assert verify(SECRET, header, BODY, tolerance=7200)
+
+
+def test_signature_is_bound_to_its_timestamp():
+    # Replaying the digest under a fresh timestamp must not verify
+    old = int(time.time()) - 10
+    digest = sign(SECRET, old, BODY)
+    assert not verify(SECRET, f't={int(time.time())},v1={digest}', BODY)
+
+
+@pytest.mark.parametrize('header', ['', 'garbage', 't=abc,v1=00', 'v1=00', None])
+def test_malformed_signature_headers(header):
+    assert not verify(SECRET, header, BODY)
+
+
+def test_backoff_doubles_with_jitter():
+    for attempts, ceiling in [(1, 10), (2, 20), (3, 40), (4, 80)]:
+        for _ in range(50):
+            delay = backoff_seconds(attempts, base_delay=10, max_delay=3600)
+            assert ceiling / 2 <= delay <= ceiling
+
+
+def test_backoff_is_capped():
+    for _ in range(50):
+        assert backoff_seconds(30, base_delay=10, max_delay=300) <= 300
+
+
+@pytest.mark.parametrize('url', [
+    'http://127.0.0.1/hook',
+    'http://10.0.0.5/hook',
+    'http://192.168.1.1:8080/hook',
+    'http://169.254.169.254/latest/meta-data/',
+    'http://[::1]/hook',
+    'http://[::ffff:127.0.0.1]/hook',
+    'http://0.0.0.0/hook',
+    'http://224.0.0.1/hook',
+])
+def test_internal_addresses_are_refused(url):
+    with pytest.raises(UnsafeWebhookURL, match='public address'):
+        resolve_url(url)
+
+
+@pytest.mark.parametrize('url', ['ftp://example.com/hook', 'file:///etc/passwd', 'http:///nohost', 'not a url',
+                                 'http://example.com:99999/'])
+def test_malformed_urls_are_refused(url):
+    with pytest.raises(UnsafeWebhookURL):
+        resolve_url(url)
+
+
+def test_public_address_resolves_to_itself():
+    assert resolve_url('https://8.8.8.8/hooks/ocr?x=1') == ('https', '8.8.8.8', 443, '/hooks/ocr?x=1', '8.8.8.8')
+
+
+def test_private_addresses_allowed_for_local_testing():
+    assert resolve_url('http://127.0.0.1:8765/hook', allow_private=True)[4] == '127.0.0.1'
+
+
+def test_delivery_log_only_records_an_error_class():
+    assert error_class(ConnectionRefusedError('[Errno 111] Connection refused to 10.0.0.5:22')) == \
+        'connection failed'
+    assert error_class(TimeoutError('timed out')) == 'timeout'
+    assert error_class(UnsafeWebhookURL('webhook_url must resolve to a public address')) == 'address not allowed'
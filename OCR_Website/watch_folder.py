@@ -0,0 +1,148 @@
+"""
+Watch a directory tree for new PDFs (or other documents, by extension).
+
+Uses inotify (through the optional inotify_simple package) to hear about new
+and changed files as they happen, and falls back to rescanning the tree every
+`poll_interval` seconds where inotify isn't available (macOS, some network
+shares). Either way a file is only reported once it is stable: its size and
+modification time haven't changed for `settle_seconds`, so a scan that is
+still being copied in over SMB isn't picked up half-written.
+"""
+
+import os
+import time
+import logging
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+logger = logging.getLogger(__name__)
+
+# Editors and copy tools write to temporary names before renaming into place
+IGNORED_PREFIXES = ('.', '~$')
+
+
+def _is_candidate(name, extensions=('.pdf',)):
+    return name.lower().endswith(extensions) and not name.startswith(IGNORED_PREFIXES)
+
+
+class FolderWatcher:
+    """Reports PDFs under `root` (as relative paths) once they have finished being written"""
+
+    def __init__(self, root, settle_seconds=2.0, poll_interval=5.0, exclude=None, use_inotify=True,
+                 extensions=('.pdf',)):
+        self.root = os.path.abspath(root)
+        self.extensions = tuple(extensions)
+        self.settle_seconds = settle_seconds
+        self.poll_interval = poll_interval
+        self.exclude = [os.path.abspath(path) for path in (exclude or [])]
+        # path -> (size, mtime, time the file was last seen changing)
+        self._candidates = {}
+        # path -> (size, mtime) already reported, so a file is only reported again if it changes
+        self._reported = {}
+        self._last_scan = 0
+        self._inotify = None
+        self._watches = {}
+
+        if use_inotify and INotify is not None:
+            try:
+                self._inotify = INotify()
+                self._add_watches(self.root)
+            except OSError as e:
+                # Out of watches, or a filesystem that doesn't support inotify
+                logger.warning(f"inotify unavailable for {self.root} ({str(e)}); polling every {poll_interval}s")
+                self._inotify = None
+        # Files already in the folder are picked up on the first poll
+        self._scan()
+
+    @property
+    def mode(self):
+        return 'inotify' if self._inotify is not None else f'polling every {self.poll_interval:g}s'
+
+    def _excluded(self, path):
+        return any(path == excluded or path.startswith(excluded + os.sep) for excluded in self.exclude)
+
+    def _add_watches(self, top):
+        mask = flags.CLOSE_WRITE | flags.MOVED_TO | flags.CREATE | flags.MODIFY | flags.DELETE_SELF
+        for dirpath, dirnames, _ in os.walk(top):
+            dirnames[:] = [d for d in dirnames if not self._excluded(os.path.join(dirpath, d))]
+            wd = self._inotify.add_watch(dirpath, mask)
+            self._watches[wd] = dirpath
+
+    def _track(self, path):
+        """Note that a file exists or changed; it is reported once it stops changing"""
+        try:
+            stat = os.stat(path)
+        except OSError:
+            self._candidates.pop(path, None)
+            return
+        signature = (stat.st_size, stat.st_mtime)
+        if self._reported.get(path) == signature:
+            return
+        previous = self._candidates.get(path)
+        if previous is None or previous[:2] != signature:
+            self._candidates[path] = (stat.st_size, stat.st_mtime, time.monotonic())
+
+    def _scan(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not self._excluded(os.path.join(dirpath, d))]
+            for name in filenames:
+                if _is_candidate(name, self.extensions):
+                    self._track(os.path.join(dirpath, name))
+        self._last_scan = time.monotonic()
+
+    def _read_events(self, timeout):
+        for event in self._inotify.read(timeout=int(timeout * 1000)):
+            directory = self._watches.get(event.wd)
+            if directory is None:
+                continue
+            if event.mask & flags.DELETE_SELF:
+                self._watches.pop(event.wd, None)
+                continue
+            path = os.path.join(directory, event.name)
+            if event.mask & flags.ISDIR:
+                if event.mask & (flags.CREATE | flags.MOVED_TO) and not self._excluded(path):
+                    # A folder dropped in whole: watch it and pick up what it already holds
+                    self._add_watches(path)
+                    for dirpath, _, filenames in os.walk(path):
+                        for name in filenames:
+                            if _is_candidate(name, self.extensions):
+                                self._track(os.path.join(dirpath, name))
+            elif _is_candidate(event.name, self.extensions):
+                self._track(path)
+
+    def poll(self, timeout=1.0):
+        """Wait up to `timeout` seconds for activity and return the files that have become stable"""
+        if self._inotify is not None:
+            self._read_events(timeout)
+        else:
+            time.sleep(timeout)
+            if time.monotonic() - self._last_scan >= self.poll_interval:
+                self._scan()
+
+        stable = []
+        now = time.monotonic()
+        for path, (size, mtime, changed_at) in list(self._candidates.items()):
+            # An empty file is one the copy hasn't started writing yet
+            if now - changed_at < self.settle_seconds or size == 0:
+                continue
+            # Re-check before reporting: inotify doesn't see every write on network filesystems
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._candidates[path]
+                continue
+            if (stat.st_size, stat.st_mtime) != (size, mtime):
+                self._candidates[path] = (stat.st_size, stat.st_mtime, now)
+                continue
+            del self._candidates[path]
+            self._reported[path] = (size, mtime)
+            stable.append(os.path.relpath(path, self.root))
+        return sorted(stable)
+
+    def close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
@@ -0,0 +1,80 @@
+"""
+Local stand-in for a webhook receiver, for trying out and testing API webhooks.
+
+Listens on localhost, checks each delivery's signature, and prints the event.
+`--fail-first N` answers the first N deliveries with a 500 so the retry and
+backoff path can be watched end to end.
+
+    python webhook_receiver.py --port 8765 --secret "$TOKEN_WEBHOOK_SECRET" --fail-first 2
+
+Then submit a job with webhook_url=http://127.0.0.1:8765/hook, with the server
+started with WEBHOOK_ALLOW_PRIVATE_HOSTS=true (loopback URLs are refused otherwise).
+"""
+
+import sys
+import json
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from webhooks import SIGNATURE_HEADER, verify
+
+
+def make_handler(secret, fail_first):
+    state = {'received': 0}
+    lock = threading.Lock()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            with lock:
+                state['received'] += 1
+                count = state['received']
+            delivery = self.headers.get('X-OCR-Delivery')
+            event = self.headers.get('X-OCR-Event')
+
+            if secret and not verify(secret, self.headers.get(SIGNATURE_HEADER, ''), body):
+                print(f"#{count} delivery {delivery} ({event}): bad signature, rejected", flush=True)
+                self.send_response(401)
+                self.end_headers()
+                return
+            if count <= fail_first:
+                print(f"#{count} delivery {delivery} ({event}): failing on purpose", flush=True)
+                self.send_response(500)
+                self.end_headers()
+                return
+
+            print(f"#{count} delivery {delivery} ({event}):", flush=True)
+            print(json.dumps(json.loads(body), indent=2), flush=True)
+            self.send_response(204)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Print (and verify) webhook deliveries from the OCR API.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--secret', help="the submitting token's webhook_secret, to verify signatures with "
+                                         "(signatures aren't checked if omitted)")
+    parser.add_argument('--fail-first', type=int, default=0, metavar='N',
+                        help='answer the first N deliveries with HTTP 500 to exercise retries')
+    args = parser.parse_args(argv)
+
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(args.secret, args.fail_first))
+    print(f"Listening for webhooks on http://{args.host}:{server.server_port}/", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,336 @@
+"""
+Signed, retried webhook delivery through a persistent outbound queue.
+
+Events are written to the database (the WebhookDelivery table) before
+anything is sent, so a delivery survives a slow or unreachable receiver and a
+restart of the app. A background thread POSTs due deliveries and reschedules
+failures with exponential backoff and jitter until they succeed or run out of
+attempts. Several app processes can share one queue: a delivery is claimed by
+moving its next attempt forward with a conditional UPDATE, so only the process
+whose UPDATE matched sends it.
+
+Each request body is a JSON envelope, {"id", "event", "created_at", "data"},
+signed with HMAC-SHA256 over "<timestamp>.<body>" and sent as
+
+    X-OCR-Signature: t=<unix timestamp>,v1=<hex digest>
+
+Every API token has its own signing secret, returned once when the token is
+created, and a job's webhooks are signed with the secret of the token that
+submitted it, so one client can't forge another's events. Receivers recompute
+the digest with that secret (see `verify`) and should reject stale timestamps. Deliveries are at least once, and a retried
+event can arrive after a later one, so receivers should de-duplicate on the
+`X-OCR-Delivery` id.
+
+Webhook URLs are supplied by API clients, so they must not become a way to
+reach the server's own network: a URL is refused unless every address its
+host resolves to is public, both when it is submitted and again when each
+delivery is sent (the connection goes to the address that was checked, so a
+DNS change in between can't redirect it). Redirects are not followed, and the
+delivery log only records a generic error class, never the socket error.
+"""
+
+import ssl
+import hmac
+import json
+import time
+import random
+import socket
+import hashlib
+import logging
+import ipaddress
+import threading
+import http.client
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+SIGNATURE_HEADER = 'X-OCR-Signature'
+# How long a claimed delivery is held before another process may retry it
+CLAIM_SECONDS = 120
+# Delivered rows are kept this long for the delivery log, then pruned
+RETENTION_DAYS = 7
+PRUNE_INTERVAL_SECONDS = 3600
+MAX_ERROR_LENGTH = 500
+
+
+class UnsafeWebhookURL(ValueError):
+    """The webhook URL is malformed or points at a non-public address"""
+
+
+class MissingSigningSecret(Exception):
+    """The token a delivery would be signed with is gone or has no signing secret"""
+
+
+def utcnow():
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+def sign(secret, timestamp, body):
+    """Hex HMAC-SHA256 of a request body, bound to the time it was sent"""
+    message = f'{timestamp}.'.encode() + body
+    return hmac.new(secret.encode(), message, hashlib.sha256).hexdigest()
+
+
+def signature_header(secret, body, timestamp=None):
+    timestamp = int(time.time() if timestamp is None else timestamp)
+    return f't={timestamp},v1={sign(secret, timestamp, body)}'
+
+
+def verify(secret, header, body, tolerance=300):
+    """Return True if `header` is a valid signature of `body` made within `tolerance` seconds"""
+    try:
+        fields = dict(part.split('=', 1) for part in header.split(','))
+        timestamp = int(fields['t'])
+    except (AttributeError, KeyError, ValueError):
+        return False
+    if abs(time.time() - timestamp) > tolerance:
+        return False
+    return hmac.compare_digest(fields.get('v1', ''), sign(secret, timestamp, body))
+
+
+def backoff_seconds(attempts, base_delay, max_delay):
+    """Delay before the next try after `attempts` failures: doubling from `base_delay`, with jitter"""
+    delay = min(max_delay, base_delay * 2 ** max(0, attempts - 1))
+    return random.uniform(delay / 2, delay)
+
+
+def _is_public(address):
+    ip = ipaddress.ip_address(address.split('%', 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    return ip.is_global and not ip.is_multicast
+
+
+def resolve_url(url, allow_private=False):
+    """
+    Check a webhook URL and return (scheme, host, port, path, address) with the address to connect to.
+
+    Raises UnsafeWebhookURL unless it is an http(s) URL whose host resolves only
+    to public addresses (any address at all with `allow_private`, for local testing).
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        raise UnsafeWebhookURL('webhook_url must be an http or https URL')
+    try:
+        port = parsed.port or (443 if parsed.scheme == 'https' else 80)
+    except ValueError:
+        raise UnsafeWebhookURL('webhook_url has an invalid port')
+    try:
+        addresses = [info[4][0] for info in socket.getaddrinfo(parsed.hostname, port, type=socket.SOCK_STREAM)]
+    except (socket.gaierror, UnicodeError):
+        raise UnsafeWebhookURL('webhook_url host could not be resolved')
+    if not addresses:
+        raise UnsafeWebhookURL('webhook_url host could not be resolved')
+    # Every address must pass, or a host with one public and one private record could be steered inside
+    if not allow_private and not all(_is_public(address) for address in addresses):
+        raise UnsafeWebhookURL('webhook_url must resolve to a public address')
+    path = (parsed.path or '/') + (f'?{parsed.query}' if parsed.query else '')
+    return parsed.scheme, parsed.hostname, port, path, addresses[0]
+
+
+class _PinnedHTTPConnection(http.client.HTTPConnection):
+    """Connects to an already checked address, while sending the URL's own host name"""
+
+    def __init__(self, host, port, address, timeout):
+        super().__init__(host, port, timeout=timeout)
+        self._address = address
+
+    def connect(self):
+        self.sock = socket.create_connection((self._address, self.port), self.timeout)
+
+
+class _PinnedHTTPSConnection(http.client.HTTPSConnection):
+    """As _PinnedHTTPConnection, verifying the certificate against the URL's host name"""
+
+    def __init__(self, host, port, address, timeout):
+        super().__init__(host, port, timeout=timeout, context=ssl.create_default_context())
+        self._address = address
+
+    def connect(self):
+        sock = socket.create_connection((self._address, self.port), self.timeout)
+        self.sock = self._context.wrap_socket(sock, server_hostname=self.host)
+
+
+def post(url, body, headers, timeout=10, allow_private=False):
+    """POST `body` to a checked webhook URL without following redirects; returns (status, Retry-After)"""
+    scheme, host, port, path, address = resolve_url(url, allow_private)
+    connection_class = _PinnedHTTPSConnection if scheme == 'https' else _PinnedHTTPConnection
+    connection = connection_class(host, port, address, timeout)
+    try:
+        connection.request('POST', path, body=body, headers=headers)
+        response = connection.getresponse()
+        response.read()
+        return response.status, response.getheader('Retry-After')
+    finally:
+        connection.close()
+
+
+def error_class(exc):
+    """What the delivery log says about a failed attempt: a category, never the socket error itself"""
+    if isinstance(exc, UnsafeWebhookURL):
+        return 'address not allowed'
+    if isinstance(exc, MissingSigningSecret):
+        return 'no signing secret'
+    if isinstance(exc, (socket.timeout, TimeoutError)):
+        return 'timeout'
+    if isinstance(exc, ssl.SSLError):
+        return 'TLS error'
+    return 'connection failed'
+
+
+def envelope(delivery):
+    return json.dumps({
+        'id': delivery.id,
+        'event': delivery.event,
+        'created_at': delivery.created_at.isoformat() if delivery.created_at else None,
+        'data': json.loads(delivery.payload)
+    }).encode()
+
+
+class WebhookDispatcher:
+    """Queues webhook events in the database and delivers them from a background thread"""
+
+    def __init__(self, app, db, model, token_model, max_attempts=8, base_delay=10, max_delay=3600,
+                 timeout=10, poll_interval=5, allow_private=False):
+        self.app = app
+        self.db = db
+        self.model = model
+        self.token_model = token_model
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.timeout = timeout
+        self.poll_interval = poll_interval
+        self.allow_private = allow_private
+        self._wake = threading.Event()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._last_prune = 0
+
+    def start(self):
+        """Start the delivery thread, which also picks up deliveries left pending by a restart"""
+        if self._thread is not None:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='webhook-dispatcher', daemon=True)
+                self._thread.start()
+
+    def enqueue(self, job_id, token_id, url, event, data):
+        """Record an event for delivery to `url`, signed with token `token_id`'s secret, for the background thread"""
+        with self.app.app_context():
+            delivery = self.model(job_id=job_id, token_id=token_id, url=url, event=event, payload=json.dumps(data),
+                                  status='pending', attempts=0, next_attempt_at=utcnow())
+            self.db.session.add(delivery)
+            self.db.session.commit()
+            delivery_id = delivery.id
+        logger.info(f"Queued {event} webhook {delivery_id} for job {job_id}")
+        self.start()
+        self._wake.set()
+        return delivery_id
+
+    def _run(self):
+        while True:
+            try:
+                delivered = self.deliver_due()
+            except Exception as e:
+                logger.error(f"Webhook dispatcher error: {str(e)}")
+                delivered = 0
+            # Keep draining while there is work; otherwise sleep until woken or the next poll
+            if not delivered:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+
+    def deliver_due(self, limit=20):
+        """Send up to `limit` deliveries whose next attempt is due; returns how many were tried"""
+        tried = 0
+        with self.app.app_context():
+            model = self.model
+            due = (model.query.filter(model.status == 'pending', model.next_attempt_at <= utcnow())
+                   .order_by(model.next_attempt_at, model.id).limit(limit).all())
+            for delivery in due:
+                if self._claim(delivery):
+                    self._attempt(delivery)
+                    tried += 1
+            self._prune()
+        return tried
+
+    def _claim(self, delivery):
+        """Push the delivery's next attempt forward; False if another process claimed it first"""
+        model = self.model
+        claimed = model.query.filter(model.id == delivery.id, model.status == 'pending',
+                                     model.next_attempt_at == delivery.next_attempt_at) \
+            .update({model.next_attempt_at: utcnow() + timedelta(seconds=CLAIM_SECONDS)},
+                    synchronize_session=False)
+        self.db.session.commit()
+        if claimed != 1:
+            return False
+        self.db.session.refresh(delivery)
+        return True
+
+    def signing_secret(self, delivery):
+        """The secret of the token that submitted the delivery's job, or None"""
+        token = self.db.session.get(self.token_model, delivery.token_id) if delivery.token_id else None
+        return token.signing_secret if token is not None else None
+
+    def _attempt(self, delivery):
+        body = envelope(delivery)
+        headers = {
+            'Content-Type': 'application/json',
+            'User-Agent': 'ocr-webhooks/1',
+            'X-OCR-Event': delivery.event,
+            'X-OCR-Delivery': str(delivery.id)
+        }
+        secret = self.signing_secret(delivery)
+
+        retry_after, permanent, detail = None, False, None
+        try:
+            if not secret:
+                # Never send unsigned: the receiver would have no way to tell it from a forgery
+                raise MissingSigningSecret('no signing secret')
+            headers[SIGNATURE_HEADER] = signature_header(secret, body)
+            status, retry_after = post(delivery.url, body, headers, self.timeout, self.allow_private)
+            # Redirects aren't followed: a 3xx is a failed delivery like any other non-2xx
+            error = None if 200 <= status < 300 else f'HTTP {status}'
+            # The receiver says the endpoint is gone for good
+            permanent = status == 410
+        except Exception as e:
+            status = None
+            error = error_class(e)
+            detail = str(e) or e.__class__.__name__
+            # Neither a URL that now resolves somewhere private nor a missing secret gets better by retrying
+            permanent = isinstance(e, (UnsafeWebhookURL, MissingSigningSecret))
+
+        delivery.attempts += 1
+        if error is None:
+            delivery.status = 'delivered'
+            delivery.delivered_at = utcnow()
+            delivery.last_error = None
+            logger.info(f"Delivered {delivery.event} webhook {delivery.id} for job {delivery.job_id} ({status})")
+        elif permanent or delivery.attempts >= self.max_attempts:
+            delivery.status = 'failed'
+            delivery.last_error = error[:MAX_ERROR_LENGTH]
+            logger.error(f"Giving up on {delivery.event} webhook {delivery.id} for job {delivery.job_id} "
+                         f"after {delivery.attempts} attempts: {detail or error}")
+        else:
+            delay = backoff_seconds(delivery.attempts, self.base_delay, self.max_delay)
+            if retry_after and retry_after.isdigit():
+                delay = min(self.max_delay, max(delay, int(retry_after)))
+            delivery.next_attempt_at = utcnow() + timedelta(seconds=delay)
+            delivery.last_error = error[:MAX_ERROR_LENGTH]
+            logger.warning(f"{delivery.event} webhook {delivery.id} for job {delivery.job_id} failed "
+                           f"({detail or error}); retrying in {delay:.0f}s")
+        self.db.session.commit()
+
+    def _prune(self):
+        if time.monotonic() - self._last_prune < PRUNE_INTERVAL_SECONDS:
+            return
+        self._last_prune = time.monotonic()
+        model = self.model
+        cutoff = utcnow() - timedelta(days=RETENTION_DAYS)
+        removed = model.query.filter(model.status != 'pending', model.created_at < cutoff) \
+            .delete(synchronize_session=False)
+        self.db.session.commit()
+        if removed:
+            logger.info(f"Pruned {removed} old webhook deliveries")